@@ -0,0 +1,4 @@
+setlocal
+set PYTHONPATH=src
+py -2 src\navbench\main.py %*
+endlocal
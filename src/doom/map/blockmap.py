@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 #coding=utf8
 
+from util.rectangle import Rectangle
 from util.vector import Vector2
 import struct
 
@@ -43,6 +44,17 @@ class BlockMap(object):
         
         # List of Block objects.
         self.blocks = None
+        
+        # Unique linedefs and things for every region of up to 2 by 2 blocks, see build_regions.
+        self.region_linedefs = None
+        self.region_things = None
+        self.region_unique = None
+        
+        # A (linedef index, x1, y1, x2, y2) tuple for every linedef.
+        self.linedef_entries = None
+        
+        # A collision box tuple for every thing, from MapData.thing_boxes.
+        self.thing_entries = None
     
     
     def get(self, pos):
@@ -101,6 +113,70 @@ class BlockMap(object):
         return linedefs, things
     
     
+    def get_region_sets(self, x1, y1, x2, y2):
+        """
+        Returns the unique linedefs and things inside a blockmap region.
+        
+        Regions of up to 2 by 2 blocks are stored in the tables made by build_regions the first time they are
+        requested. Larger regions and regions that lie partly outside the blockmap are gathered from their blocks
+        every time.
+        
+        @return: a tuple of (linedef index, x1, y1, x2, y2) linedef tuples and a tuple of thing collision box tuples
+                 from MapData.thing_boxes. Both are in the order that a set made from the lists returned by
+                 get_region iterates in.
+        """
+        
+        if self.region_linedefs is not None and x1 >= 0 and y1 >= 0 and x2 < self.size.x and y2 < self.size.y:
+            width = x2 - x1
+            height = y2 - y1
+            if width <= 1 and height <= 1:
+                index = ((x1 + y1 * self.size.x) << 2) | width | (height << 1)
+                linedefs = self.region_linedefs[index]
+                if linedefs is not None:
+                    return linedefs, self.region_things[index]
+                
+                linedefs, things = self.gather_region_sets(x1, y1, x2, y2)
+                self.region_linedefs[index] = self.region_unique.setdefault(linedefs, linedefs)
+                self.region_things[index] = self.region_unique.setdefault(things, things)
+                return linedefs, things
+        
+        return self.gather_region_sets(x1, y1, x2, y2)
+    
+    
+    def gather_region_sets(self, x1, y1, x2, y2):
+        """
+        Gathers the unique linedefs and things inside a blockmap region from its blocks.
+        
+        @return: see get_region_sets.
+        """
+        
+        linedefs, things = self.get_region(Rectangle(x1, y1, x2, y2))
+        linedef_entries = self.linedef_entries
+        thing_entries = self.thing_entries
+        return tuple([linedef_entries[index] for index in set(linedefs)]), tuple([thing_entries[index] for index in set(things)])
+    
+    
+    def build_regions(self, map_data):
+        """
+        Prepares tables of the unique linedefs and things in every region of up to 2 by 2 blocks.
+        
+        A box that is smaller than a block overlaps at most 2 by 2 blocks, so these tables hold everything that a
+        collision test with such a box needs. The linedefs in them include their vertex coordinates, and identical
+        regions share their tuples. Things are stored as their collision boxes.
+        
+        @param map_data: the map data object to use the linedefs and thing collision boxes from.
+        """
+        
+        self.linedef_entries = []
+        for index, linedef in enumerate(map_data.linedefs):
+            self.linedef_entries.append((index, linedef.vertex1.x, linedef.vertex1.y, linedef.vertex2.x, linedef.vertex2.y))
+        self.thing_entries = map_data.thing_boxes
+        
+        self.region_linedefs = [None] * (len(self.blocks) * 4)
+        self.region_things = [None] * (len(self.blocks) * 4)
+        self.region_unique = {}
+    
+    
     def blockmap_to_map(self, pos):
         """
         Returns map unit coordinates for the blockmap block at coordinate x, y.
@@ -350,7 +426,7 @@ class BlockMap(object):
         """
         Reads a blockmap from Doom blockmap lump data.
         
-        @param data: the data of the lump to read.
+        @param data: the data of the lump to read. This can be a string or a buffer into a memory mapped WAD.
         """
         
         header = BLOCKMAP_HEADER.unpack_from(data)
@@ -365,7 +441,7 @@ class BlockMap(object):
         # Read offsets.
         block_count = self.size.x * self.size.y
         offset_struct = struct.Struct('<' + ('H' * block_count))
-        offsets = offset_struct.unpack_from(data[8:])
+        offsets = offset_struct.unpack_from(data, BLOCKMAP_HEADER.size)
         
         self.blocks = []
         linedef = 0
@@ -376,7 +452,7 @@ class BlockMap(object):
             # Unpack linedef indices from the current block.
             while 1:
                 offset += 2
-                linedef = BLOCKMAP_LINEDEF.unpack_from(data[offset:])[0]
+                linedef = BLOCKMAP_LINEDEF.unpack_from(data, offset)[0]
                 if linedef == 0xffff:
                     break
                 block.linedefs.append(linedef)
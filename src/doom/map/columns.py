@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#coding=utf8
+
+"""
+Columnar map geometry storage.
+"""
+
+import array
+import numpy
+
+
+class MapColumns(object):
+    """
+    Stores map geometry as a structure of arrays, with one NumPy array per map object field.
+    
+    This allows vectorized code to work on map geometry without having to access individual map objects. Object
+    references are stored as indices into the other arrays.
+    """
+    
+    def __init__(self):
+        # Vertex coordinates.
+        self.vertex_x = None
+        self.vertex_y = None
+        
+        # Linedef vertex indices, flags and sidedef indices. Unused sidedefs are Linedef.SIDEDEF_NONE.
+        self.linedef_v1 = None
+        self.linedef_v2 = None
+        self.linedef_flags = None
+        self.linedef_front = None
+        self.linedef_back = None
+        
+        # Sidedef sector indices.
+        self.sidedef_sector = None
+        
+        # Node partition lines and child node indices. Each field is stored once, in a Python array that
+        # MapData.point_in_subsector indexes one item at a time. The NumPy arrays share the memory of those.
+        self.node_arrays = None
+        self.node_x = None
+        self.node_y = None
+        self.node_dx = None
+        self.node_dy = None
+        self.node_right = None
+        self.node_left = None
+        
+        # Subsector sector indices.
+        self.subsector_sector = None
+        
+        # Sector floor and ceiling heights and internal flags.
+        self.sector_floorz = None
+        self.sector_ceilingz = None
+        self.sector_flags = None
+    
+    
+    def build(self, map_data):
+        """
+        Builds all columns from a map data object's objects.
+        
+        Linedef vertices are expected to still be indices, so this needs to be done before references are set.
+        
+        @param map_data: the map data object to build the columns from.
+        """
+        
+        vertices = map_data.vertices
+        self.vertex_x = numpy.fromiter((vertex.x for vertex in vertices), numpy.int32, len(vertices))
+        self.vertex_y = numpy.fromiter((vertex.y for vertex in vertices), numpy.int32, len(vertices))
+        
+        linedefs = map_data.linedefs
+        self.linedef_v1 = numpy.fromiter((linedef.vertex1 for linedef in linedefs), numpy.int32, len(linedefs))
+        self.linedef_v2 = numpy.fromiter((linedef.vertex2 for linedef in linedefs), numpy.int32, len(linedefs))
+        self.linedef_flags = numpy.fromiter((linedef.flags for linedef in linedefs), numpy.int32, len(linedefs))
+        self.linedef_front = numpy.fromiter((linedef.sidedef_front for linedef in linedefs), numpy.int32, len(linedefs))
+        self.linedef_back = numpy.fromiter((linedef.sidedef_back for linedef in linedefs), numpy.int32, len(linedefs))
+        
+        sidedefs = map_data.sidedefs
+        self.sidedef_sector = numpy.fromiter((sidedef.sector for sidedef in sidedefs), numpy.int32, len(sidedefs))
+        
+        # Indexing a Python array one item at a time is several times faster than indexing a NumPy array. Node fields
+        # all fit in 32 bits, partition line side tests widen them to 64 bits so that they cannot overflow.
+        nodes = map_data.nodes
+        self.node_arrays = (
+            array.array('i', [node.x for node in nodes]),
+            array.array('i', [node.y for node in nodes]),
+            array.array('i', [node.delta_x for node in nodes]),
+            array.array('i', [node.delta_y for node in nodes]),
+            array.array('i', [node.children[0] for node in nodes]),
+            array.array('i', [node.children[1] for node in nodes])
+        )
+        self.node_x, self.node_y, self.node_dx, self.node_dy, self.node_right, self.node_left = [
+            numpy.frombuffer(node_array, dtype=numpy.int32) for node_array in self.node_arrays
+        ]
+        
+        self.update_sectors(map_data)
+    
+    
+    def update_sectors(self, map_data):
+        """
+        Rebuilds the sector columns. Sector heights and flags and subsector sectors are set or changed by map setup,
+        so this needs to be called again after that is done.
+        
+        @param map_data: the map data object to build the sector columns from.
+        """
+        
+        # Subsectors do not have a sector until map setup has been done.
+        subsectors = map_data.subsectors
+        if len(subsectors) > 0 and subsectors[0].sector is not None:
+            self.subsector_sector = numpy.fromiter((subsector.sector for subsector in subsectors), numpy.int32, len(subsectors))
+        
+        sectors = map_data.sectors
+        self.sector_floorz = numpy.fromiter((sector.floorz for sector in sectors), numpy.int32, len(sectors))
+        self.sector_ceilingz = numpy.fromiter((sector.ceilingz for sector in sectors), numpy.int32, len(sectors))
+        self.sector_flags = numpy.fromiter((sector.flags for sector in sectors), numpy.int32, len(sectors))
@@ -3,18 +3,60 @@
 
 from doom.actions.list import ActionList
 from doom.map import blockmap
+from doom.map.columns import MapColumns
 from doom.map.objects import Thing, Linedef, Sidedef, Vertex, Segment, SubSector, Sector, Node
+from doom.map.raster import SectorRaster
 from doom.map.setup import MapSetup
 from util.vector import Vector2, Vector3
+import copy
 import hashlib
+import numpy
+import struct
+
+
+# The number of records to decode at once when decoding lump data in bulk.
+BULK_RECORDS = 1024
+
+# Map objects whose lump data is digested into a map's hash, in order.
+HASH_CLASSES = (Thing, Linedef, Sidedef, Vertex, Segment, SubSector, Node, Sector)
+
+
+def compute_map_hash(wad_file, lump_name):
+    """
+    Computes the hash of a map's data lumps without decoding them.
+    
+    The hash is the same as the data_hash of a MapData object for the same map.
+    
+    @param wad_file: WAD file object to read from.
+    @param lump_name: the name of the map header lump.
+    
+    @return: a MD5 digest string, or None if the map could not be found.
+    """
+    
+    headerindex = wad_file.get_index(lump_name)
+    if headerindex == -1:
+        return None
+    
+    hasher = hashlib.md5()
+    for source_class in HASH_CLASSES:
+        lump = wad_file.get_lump_index(headerindex + source_class.WAD_INDEX)
+        if lump is None:
+            return None
+        
+        for chunk in lump.get_data_chunks():
+            hasher.update(chunk)
+    
+    return hasher.digest()
 
 
 class MapData(object):
     """
     handles map data from Doom and Hexen format WAD files.
+    
+    If bulk is True, map lumps are decoded many records at a time instead of one record at a time.
     """
     
-    def __init__(self, wad_file, lump_name):
+    def __init__(self, wad_file, lump_name, bulk=True):
         # Raw map data.
         self.vertices = None
         self.linedefs = None
@@ -25,11 +67,27 @@ class MapData(object):
         self.subsectors = None
         self.segments = None
         self.blockmap = None
+        
+        # Columnar copy of the map geometry.
+        self.columns = None
+        
+        # Optional sector index raster for lookups on a fixed lattice of coordinates.
+        self.sector_raster = None
+        
+        # Lookup tables from tags, thing ids and thing types to map objects.
+        self.tag_sectors = None
+        self.tag_linedefs = None
+        self.tid_things = None
+        self.type_things = None
 
         # Additional map data, generated from raw data.
         self.linedef_ids = None
         self.teleporters = None
         
+        # A (left, top, right, bottom, bottom z, top z) collision box for every thing, or None if a thing does not
+        # block movement.
+        self.thing_boxes = None
+        
         # Registered action types.
         self.actions = ActionList()
         
@@ -39,6 +97,9 @@ class MapData(object):
         
         # If True, this map is stored in Hexen format, Doom format otherwise.
         self.is_hexen = False
+        
+        # If True, lump data is decoded in bulk.
+        self.bulk = bulk
 
         # Map bounds.
         self.min = Vector3(0x8000, 0x8000, 0x8000)
@@ -56,7 +117,7 @@ class MapData(object):
             if wad_file.lumps[headerindex + 11].name == 'BEHAVIOR':
                 self.is_hexen = True
         
-        # Read data lumps.
+        # Read data lumps. These must be read in HASH_CLASSES order to produce the same hash as compute_map_hash.
         self.things = self.read_data(wad_file, headerindex, Thing)
         self.linedefs = self.read_data(wad_file, headerindex, Linedef)
         self.sidedefs = self.read_data(wad_file, headerindex, Sidedef)
@@ -70,9 +131,15 @@ class MapData(object):
         self.data_hash = self.hasher.digest()
         self.hasher = None
         
+        # Build columnar geometry while object references are still indices.
+        self.columns = MapColumns()
+        self.columns.build(self)
+        
         # Change indices to references where needed.
         self.set_data_references(self.linedefs)
         self.set_data_references(self.segments)
+        
+        self.build_lookups()
     
     
     def read_data(self, wad_file, index, source_class):
@@ -86,31 +153,117 @@ class MapData(object):
         @return: a list of source_class objects with the data loaded into them.
         """ 
 
-        data = wad_file.get_lump_index(index + source_class.WAD_INDEX).get_data()
+        lump = wad_file.get_lump_index(index + source_class.WAD_INDEX)
+        data = lump.get_data()
         
         if self.is_hexen == True:
             item_struct = source_class.STRUCT_HEXEN
         else:
             item_struct = source_class.STRUCT_DOOM
         
+        if self.bulk == True:
+            datalist = self.decode_bulk(data, item_struct, source_class)
+        else:
+            datalist = self.decode_records(data, item_struct, source_class)
+        
+        self.hasher.update(data)
+        
+        # The lump data is no longer needed once it has been decoded.
+        lump.release()
+        
+        return datalist
+    
+    
+    def decode_records(self, data, item_struct, source_class):
+        """
+        Decodes lump data one record at a time.
+        
+        @param data: the lump data to decode.
+        @param item_struct: the Struct describing a single record.
+        @param source_class: the class of the objects to decode the records into.
+        
+        @return: a list of source_class objects.
+        """
+        
+        # Unpack directly from the lump data, so that no copies are made of memory mapped data.
         datalist = []
         offset = 0
         while offset < len(data):
             item = source_class()
             
-            struct_data = data[offset:offset + item_struct.size]
-            item_data = item_struct.unpack(struct_data)
+            item_data = item_struct.unpack_from(data, offset)
             
             item.unpack_from(item_data, self.is_hexen)
             datalist.append(item)
             
             offset += item_struct.size
         
-        self.hasher.update(data)
+        return datalist
+    
+    
+    def decode_bulk(self, data, item_struct, source_class):
+        """
+        Decodes lump data BULK_RECORDS records at a time.
+        
+        A single struct containing the record format repeated BULK_RECORDS times is used to unpack all the fields of
+        a run of records in one call. The fields are then split into a tuple per record.
+        
+        @param data: the lump data to decode.
+        @param item_struct: the Struct describing a single record.
+        @param source_class: the class of the objects to decode the records into.
+        
+        @return: a list of source_class objects.
+        """
+        
+        is_hexen = self.is_hexen
+        record_count = len(data) / item_struct.size
+        field_count = len(item_struct.unpack('\x00' * item_struct.size))
+        
+        byte_order = item_struct.format[0]
+        record_format = item_struct.format[1:]
+        bulk_struct = struct.Struct(byte_order + record_format * min(record_count, BULK_RECORDS))
+        
+        datalist = []
+        offset = 0
+        while record_count > 0:
+            
+            # The last run of records can be shorter.
+            if record_count < BULK_RECORDS and bulk_struct.size != record_count * item_struct.size:
+                bulk_struct = struct.Struct(byte_order + record_format * record_count)
+            
+            fields = bulk_struct.unpack_from(data, offset)
+            for item_data in zip(*[iter(fields)] * field_count):
+                item = source_class()
+                item.unpack_from(item_data, is_hexen)
+                datalist.append(item)
+            
+            offset += bulk_struct.size
+            record_count -= BULK_RECORDS
         
         return datalist
     
     
+    def build_lookups(self):
+        """
+        Builds lookup tables of sector indices by tag, linedefs by tag and things by thing id and type. The objects in
+        each table are kept in map order.
+        """
+        
+        self.tag_sectors = {}
+        for sector_index, sector in enumerate(self.sectors):
+            self.tag_sectors.setdefault(sector.tag, []).append(sector_index)
+        
+        self.tag_linedefs = {}
+        for linedef in self.linedefs:
+            self.tag_linedefs.setdefault(linedef.tag, []).append(linedef)
+        
+        self.tid_things = {}
+        self.type_things = {}
+        for thing in self.things:
+            self.tid_things.setdefault(thing.tid, []).append(thing)
+            self.type_things.setdefault(thing.doomid, []).append(thing)
+    
+    
     def set_data_references(self, datalist):
         """
         Sets map object list indices to references.
@@ -130,24 +283,68 @@ class MapData(object):
         # Process map data.
         setup = MapSetup(self, config)
         setup.setup()
+        self.columns.update_sectors(self)
+        self.build_thing_boxes(config)
         
         # Build blockmap.
         self.blockmap = blockmap.BlockMap()
         self.blockmap.generate(self, config)
     
     
+    def build_thing_boxes(self, config):
+        """
+        Computes the collision box of every thing that blocks movement.
+        
+        Thing z positions are taken from the floor or ceiling of the sector that a thing is in, so this needs
+        to be run after sector planes are set up.
+        
+        @param config: a configuration object containing thing dimensions.
+        """
+        
+        self.thing_boxes = []
+        for thing in self.things:
+            thing_type = thing.doomid
+            
+            # Parse custom bridge thing size.
+            if config.bridge_custom_type is not None and thing_type == config.bridge_custom_type:
+                radius = thing.args[0]
+                height = thing.args[1]
+                hanging = False
+                
+            else:
+                thing_def = config.thing_dimensions.get(thing_type)
+                if thing_def is None:
+                    self.thing_boxes.append(None)
+                    continue
+                
+                radius = thing_def.radius
+                height = thing_def.height
+                hanging = thing_def.is_hanging()
+            
+            # Determine z position.
+            if hanging == True:
+                z = self.get_ceil_z(thing.x, thing.y) - height
+            else:
+                z = self.get_floor_z(thing.x, thing.y)
+                if self.is_hexen == True:
+                    z += thing.z
+            
+            self.thing_boxes.append((
+                thing.x - radius,
+                thing.y - radius,
+                thing.x + radius,
+                thing.y + radius,
+                z,
+                z + height
+            ))
+    
+    
     def get_tag_sectors(self, tag):
         """
         Returns a list of sectors that have a specific tag.
         """
         
-        sectorlist = []
-        
-        for sector_index, sector in enumerate(self.sectors):
-            if sector.tag == tag:
-                sectorlist.append(sector_index)
-            
-        return sectorlist
+        return list(self.tag_sectors.get(tag, ()))
     
     
     def get_sector_center(self, sector_index):
@@ -174,13 +371,7 @@ class MapData(object):
         Returns a list of things with a specific id.
         """
         
-        output = []
-
-        for thing in self.things:
-            if thing.doomid == type_id:
-                output.append(thing)
-                
-        return output
+        return list(self.type_things.get(type_id, ()))
     
     
     def get_floor_z(self, x, y):
@@ -212,7 +403,184 @@ class MapData(object):
         Returns the sector index at map coordinates x,y.
         """
         
+        if self.sector_raster is not None:
+            sector_index = self.sector_raster.get(x, y)
+            if sector_index is not None:
+                return sector_index
+        
         return self.subsectors[self.point_in_subsector(x, y)].sector
+    
+    
+    def build_sector_raster(self, spacing, offset, margin):
+        """
+        Builds a sector index raster, after which get_sector and the functions that use it will look up coordinates
+        on the raster's lattice in the raster instead of in the node tree.
+        
+        @param spacing: the distance between lattice points, in map units.
+        @param offset: the map coordinate of a lattice point, modulo spacing.
+        @param margin: the number of map units to extend the raster by outside of the map bounds.
+        """
+        
+        self.sector_raster = SectorRaster()
+        self.sector_raster.build(self, spacing, offset, margin)
+    
+    
+    def release_sector_raster(self):
+        """
+        Releases the sector index raster.
+        """
+        
+        self.sector_raster = None
+    
+    
+    def get_collision_data(self):
+        """
+        Returns a copy of this map data that holds only what collision tests and sector lookups need, so that it is
+        cheaper to send to other processes.
+        
+        The copy shares its sectors, linedefs, sidedefs, subsectors, blockmap, columns and sector raster with this
+        map data. Things, nodes, segments, lookup tables and actions are left out.
+        """
+        
+        collision_data = copy.copy(self)
+        
+        collision_data.vertices = None
+        collision_data.things = None
+        collision_data.nodes = None
+        collision_data.segments = None
+        collision_data.tag_sectors = None
+        collision_data.tag_linedefs = None
+        collision_data.tid_things = None
+        collision_data.type_things = None
+        collision_data.linedef_ids = None
+        collision_data.teleporters = None
+        collision_data.actions = None
+        collision_data.hasher = None
+        
+        return collision_data
+    
+    
+    def get_sectors_batch(self, xs, ys):
+        """
+        Returns the sector indices at many map coordinates at once.
+        
+        Map setup must have been done before this can be used.
+        
+        @param xs: a NumPy array of integer x coordinates.
+        @param ys: a NumPy array of integer y coordinates.
+        
+        @return: a NumPy array of sector indices.
+        """
+        
+        return self.columns.subsector_sector[self.points_in_subsectors_batch(xs, ys)]
+    
+    
+    def get_floor_z_batch(self, xs, ys):
+        """
+        Returns the floor Z levels at many map coordinates at once.
+        
+        @param xs: a NumPy array of integer x coordinates.
+        @param ys: a NumPy array of integer y coordinates.
+        
+        @return: a NumPy array of Z levels.
+        """
+        
+        sector_indices = self.get_sectors_batch(xs, ys)
+        return self.get_planes_z_batch(sector_indices, self.columns.sector_floorz, 'floor_plane', xs, ys)
+    
+    
+    def get_ceil_z_batch(self, xs, ys):
+        """
+        Returns the ceiling Z levels at many map coordinates at once.
+        
+        @param xs: a NumPy array of integer x coordinates.
+        @param ys: a NumPy array of integer y coordinates.
+        
+        @return: a NumPy array of Z levels.
+        """
+        
+        sector_indices = self.get_sectors_batch(xs, ys)
+        return self.get_planes_z_batch(sector_indices, self.columns.sector_ceilingz, 'ceiling_plane', xs, ys)
+    
+    
+    def get_planes_z_batch(self, sector_indices, sector_z, plane_attribute, xs, ys):
+        """
+        Returns the Z levels of a sector plane at many map coordinates at once.
+        
+        @param sector_indices: a NumPy array of the sector index at each coordinate.
+        @param sector_z: the NumPy sector column with the Z level of non-sloped sectors.
+        @param plane_attribute: the name of the sector attribute containing a sloped sector's plane.
+        @param xs: a NumPy array of x coordinates.
+        @param ys: a NumPy array of y coordinates.
+        
+        @return: a NumPy array of Z levels.
+        """
+        
+        z = sector_z[sector_indices]
+        
+        # Evaluate the planes of sloped sectors for the coordinates that lie in them.
+        for sector_index in numpy.unique(sector_indices):
+            plane = getattr(self.sectors[sector_index], plane_attribute)
+            if plane is None:
+                continue
+            
+            if z.dtype != numpy.float64:
+                z = z.astype(numpy.float64)
+            mask = sector_indices == sector_index
+            z[mask] = -(plane.invc * (plane.a * xs[mask] + plane.b * ys[mask] + plane.d))
+        
+        return z
+    
+    
+    def points_in_subsectors_batch(self, xs, ys):
+        """
+        Returns the subsector indices that many map coordinates are in at once.
+        
+        All coordinates are walked down the node tree together, one level at a time. Coordinates that have reached
+        a subsector are dropped from the walk.
+        
+        @param xs: a NumPy array of integer x coordinates.
+        @param ys: a NumPy array of integer y coordinates.
+        
+        @return: a NumPy array of subsector indices.
+        """
+        
+        columns = self.columns
+        xs = numpy.asarray(xs, dtype=numpy.int64)
+        ys = numpy.asarray(ys, dtype=numpy.int64)
+        
+        node_indices = numpy.empty(len(xs), dtype=numpy.int64)
+        node_indices.fill(len(columns.node_x) - 1)
+        
+        # Indices of the coordinates that have not reached a subsector yet.
+        walking = numpy.arange(len(xs))
+        while len(walking) > 0:
+            nodes = node_indices[walking]
+            x = xs[walking]
+            y = ys[walking]
+            
+            node_x = columns.node_x[nodes].astype(numpy.int64)
+            node_y = columns.node_y[nodes].astype(numpy.int64)
+            delta_x = columns.node_dx[nodes].astype(numpy.int64)
+            delta_y = columns.node_dy[nodes].astype(numpy.int64)
+            
+            # Determine on what side the coordinates lie, in the same way as point_in_subsector.
+            nx = x - node_x
+            ny = y - node_y
+            side = numpy.where(
+                (delta_y ^ delta_x ^ nx ^ ny) < 0,
+                (delta_y ^ nx) < 0,
+                ny * delta_x >= delta_y * nx
+            )
+            side = numpy.where(delta_y == 0, numpy.where(y <= node_y, delta_x < 0, delta_x > 0), side)
+            side = numpy.where(delta_x == 0, numpy.where(x <= node_x, delta_y > 0, delta_y < 0), side)
+            
+            # Choose the left or right child nodes.
+            nodes = numpy.where(side, columns.node_left[nodes], columns.node_right[nodes])
+            node_indices[walking] = nodes
+            walking = walking[(nodes & Node.FLAG_SUBSECTOR) == 0]
+        
+        return node_indices & ~Node.FLAG_SUBSECTOR
         
         
     def get_sector_floor_z(self, sector_index, x, y):
@@ -248,10 +616,7 @@ class MapData(object):
         @param tid: the thing ID of the thing to look for.
         """
         
-        for thing in self.things:
-            if thing.tid != tid:
-                continue
-
+        for thing in self.tid_things.get(tid, ()):
             if sector_tag is not None:
                 thing_sector_index = self.get_sector(thing.x, thing.y)
                 if self.sectors[thing_sector_index].tag == sector_tag:
@@ -271,10 +636,7 @@ class MapData(object):
         @param thing_type: the thing type of the thing to look for.
         """
         
-        for thing in self.things:
-            if thing.doomid != thing_type:
-                continue
-
+        for thing in self.type_things.get(thing_type, ()):
             if thing.sector.tag == sector_tag:
                 return thing
         
@@ -305,11 +667,11 @@ class MapData(object):
         Returns the first linedef with the specified tag, or None of the linedef could not be found.
         """
         
-        for linedef in self.linedefs:
-            if linedef.tag == tag:
-                return linedef
-            
-        return None
+        linedefs = self.tag_linedefs.get(tag)
+        if linedefs is None:
+            return None
+        
+        return linedefs[0]
     
     
     def get_line_center(self, line_index):
@@ -331,34 +693,41 @@ class MapData(object):
         Returns the subsector index that the specified coordinates are in.
         """
         
-        node_index = len(self.nodes) - 1
+        # Keep local references to the flattened node tree as optimization.
+        node_x, node_y, node_dx, node_dy, node_right, node_left = self.columns.node_arrays
+        
+        node_index = len(node_x) - 1
         while (node_index & Node.FLAG_SUBSECTOR) == 0:
-            node = self.nodes[node_index]
+            delta_x = node_dx[node_index]
+            delta_y = node_dy[node_index]
             
             # Determine on what side the requested coordinates lie.
-            if node.delta_x == 0:
-                if x <= node.x:
-                    side = node.delta_y > 0
+            if delta_x == 0:
+                if x <= node_x[node_index]:
+                    side = delta_y > 0
                 else:
-                    side = node.delta_y < 0
+                    side = delta_y < 0
                 
-            elif node.delta_y == 0:
-                if y <= node.y:
-                    side = node.delta_x < 0
+            elif delta_y == 0:
+                if y <= node_y[node_index]:
+                    side = delta_x < 0
                 else:
-                    side = node.delta_x > 0
+                    side = delta_x > 0
         
             else:
-                nx = x - node.x
-                ny = y - node.y
+                nx = x - node_x[node_index]
+                ny = y - node_y[node_index]
             
-                if (node.delta_y ^ node.delta_x ^ nx ^ ny) < 0:
-                    side = (node.delta_y ^ nx) < 0
+                if (delta_y ^ delta_x ^ nx ^ ny) < 0:
+                    side = (delta_y ^ nx) < 0
                 else:
-                    side = ny * node.delta_x >= node.delta_y * nx
+                    side = ny * delta_x >= delta_y * nx
             
             # Choose the left or right child node.
-            node_index = self.nodes[node_index].children[side]
+            if side:
+                node_index = node_left[node_index]
+            else:
+                node_index = node_right[node_index]
             
         return node_index & ~Node.FLAG_SUBSECTOR
 
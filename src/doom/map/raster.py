@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#coding=utf8
+
+"""
+Sector index raster for fast sector lookups on a fixed lattice of map coordinates.
+"""
+
+import array
+import numpy
+
+
+# The number of lattice rows to look up in the node tree at once while building a raster.
+BUILD_ROWS = 64
+
+
+class SectorRaster(object):
+    """
+    Stores the sector index at every point of a regular lattice of map coordinates.
+    
+    Each lattice point holds the sector that the node tree returns for exactly that point, so a lookup of a lattice
+    point is always equal to a node tree lookup, even in lattice cells that are crossed by linedefs. Coordinates
+    that are not on the lattice, or outside of it, are not stored and need to be looked up in the node tree.
+    """
+    
+    def __init__(self):
+        # Map coordinates of the first lattice point.
+        self.origin_x = 0
+        self.origin_y = 0
+        
+        # Distance between lattice points, in map units.
+        self.spacing = 1
+        
+        # Size of the lattice, in points.
+        self.width = 0
+        self.height = 0
+        
+        # Sector index for each lattice point, stored as x + y * width.
+        self.sectors = None
+    
+    
+    def build(self, map_data, spacing, offset, margin):
+        """
+        Builds a raster covering a map's bounds.
+        
+        Map setup must have been done before a raster can be built.
+        
+        @param map_data: the map data object to build the raster for.
+        @param spacing: the distance between lattice points, in map units.
+        @param offset: the map coordinate of a lattice point, modulo spacing.
+        @param margin: the number of map units to extend the raster by outside of the map bounds.
+        """
+        
+        self.spacing = spacing
+        self.origin_x = ((map_data.min.x - margin - offset) // spacing) * spacing + offset
+        self.origin_y = ((map_data.min.y - margin - offset) // spacing) * spacing + offset
+        self.width = (map_data.max.x + margin - self.origin_x) // spacing + 1
+        self.height = (map_data.max.y + margin - self.origin_y) // spacing + 1
+        
+        # Look up the lattice points in the node tree a number of rows at a time.
+        self.sectors = array.array('i')
+        xs = numpy.arange(self.width, dtype=numpy.int64) * spacing + self.origin_x
+        for y in range(0, self.height, BUILD_ROWS):
+            rows = min(BUILD_ROWS, self.height - y)
+            ys = numpy.arange(y, y + rows, dtype=numpy.int64) * spacing + self.origin_y
+            
+            row_xs = numpy.tile(xs, rows)
+            row_ys = numpy.repeat(ys, self.width)
+            sectors = map_data.get_sectors_batch(row_xs, row_ys).astype(numpy.int32)
+            self.sectors.fromstring(sectors.tostring())
+    
+    
+    def get(self, x, y):
+        """
+        Returns the sector index at map coordinates x,y, or None if the coordinates are not on the lattice.
+        """
+        
+        x -= self.origin_x
+        y -= self.origin_y
+        if x % self.spacing != 0 or y % self.spacing != 0:
+            return None
+        
+        x //= self.spacing
+        y //= self.spacing
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return None
+        
+        return self.sectors[int(x + y * self.width)]
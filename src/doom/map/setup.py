@@ -71,7 +71,7 @@ class MapSetup(object):
                 continue
             
             # Line to line teleporters.
-            if Action.teleport_type != Action.TELEPORT_THING:
+            if action.teleport_type != Action.TELEPORT_THING:
                 kind = Teleporter.TELEPORTER_LINE
                 dest_line = self.map_data.get_line_destination(line_index)
                 if dest_line is None:
@@ -105,19 +105,19 @@ class MapSetup(object):
         Determines the minimum and maximum bounds of the map based on vertex coordinates.
         """
         
+        columns = self.map_data.columns
+        
         # Calculate map width and height.
-        for vertex in self.map_data.vertices:
-            self.map_data.min.x = min(self.map_data.min.x, vertex.x)
-            self.map_data.max.x = max(self.map_data.max.x, vertex.x)
-            self.map_data.min.y = min(self.map_data.min.y, vertex.y)
-            self.map_data.max.y = max(self.map_data.max.y, vertex.y)
+        if len(columns.vertex_x) > 0:
+            self.map_data.min.x = min(self.map_data.min.x, int(columns.vertex_x.min()))
+            self.map_data.max.x = max(self.map_data.max.x, int(columns.vertex_x.max()))
+            self.map_data.min.y = min(self.map_data.min.y, int(columns.vertex_y.min()))
+            self.map_data.max.y = max(self.map_data.max.y, int(columns.vertex_y.max()))
         
         # Find map depth.
-        for sector in self.map_data.sectors:
-            floorz = sector.floorz
-            ceilz = sector.ceilingz
-            self.map_data.min.z = min(floorz, min(ceilz, self.map_data.min.z))
-            self.map_data.max.z = max(floorz, max(ceilz, self.map_data.max.z))
+        if len(columns.sector_floorz) > 0:
+            self.map_data.min.z = min(self.map_data.min.z, int(columns.sector_floorz.min()), int(columns.sector_ceilingz.min()))
+            self.map_data.max.z = max(self.map_data.max.z, int(columns.sector_floorz.max()), int(columns.sector_ceilingz.max()))
         
         # Set map dimensions.
         self.map_data.size.x = self.map_data.max.x - self.map_data.min.x
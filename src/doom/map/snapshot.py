@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#coding=utf8
+
+"""
+Snapshots of map data, to find what changed between two versions of a map.
+"""
+
+from doom.map.objects import Linedef
+from util.rectangle import Rectangle
+import hashlib
+import numpy
+import struct
+
+
+class MapSnapshot(object):
+    """
+    Stores a signature and a bounding box for every linedef, sector and thing of a map.
+    
+    Signatures are digests of the object properties that affect where a player can walk. Comparing the snapshots of
+    two versions of a map finds the objects that changed, and the map region that they covered before and after.
+    """
+    
+    # Snapshot file structures.
+    FILE_ID = 'DPSNAP'
+    FILE_VERSION = 1
+    FILE_HEADER = struct.Struct('<6sHIII')
+    FILE_RECORD = numpy.dtype([
+        ('signature', '<u8'),
+        ('left', '<i4'),
+        ('top', '<i4'),
+        ('right', '<i4'),
+        ('bottom', '<i4')
+    ])
+    
+    
+    def __init__(self):
+        # A (signature, left, top, right, bottom) tuple for every map object.
+        self.linedefs = []
+        self.sectors = []
+        self.things = []
+    
+    
+    def build(self, map_data):
+        """
+        Builds this snapshot from a map that has been set up.
+        
+        Sectors are taken as they are after map setup, so that changes to the linedef actions that affect them are
+        found as sector changes.
+        """
+        
+        self.linedefs = []
+        for linedef in map_data.linedefs:
+            x1 = linedef.vertex1.x
+            y1 = linedef.vertex1.y
+            x2 = linedef.vertex2.x
+            y2 = linedef.vertex2.y
+            
+            properties = (x1, y1, x2, y2, linedef.flags, linedef.action, linedef.tag, tuple(linedef.args),
+                          get_sidedef_sector(map_data, linedef.sidedef_front),
+                          get_sidedef_sector(map_data, linedef.sidedef_back))
+            self.linedefs.append((get_signature(properties), min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+        
+        self.sectors = []
+        for sector in map_data.sectors:
+            properties = (sector.floorz, sector.ceilingz, sector.action, sector.tag, sector.flags, sector.damage,
+                          get_plane_properties(sector.floor_plane), get_plane_properties(sector.ceiling_plane),
+                          len(sector.threedfloors))
+            
+            # Sectors cover the bounding box of their linedefs.
+            left = top = 0x7FFFFFFF
+            right = bottom = -0x7FFFFFFF
+            for linedef in sector.linedefs:
+                for vertex in (linedef.vertex1, linedef.vertex2):
+                    left = min(left, vertex.x)
+                    top = min(top, vertex.y)
+                    right = max(right, vertex.x)
+                    bottom = max(bottom, vertex.y)
+            if left > right:
+                left = top = right = bottom = 0
+            
+            self.sectors.append((get_signature(properties), left, top, right, bottom))
+        
+        self.things = []
+        for index, thing in enumerate(map_data.things):
+            box = map_data.thing_boxes[index]
+            properties = (thing.doomid, thing.x, thing.y, thing.z, thing.angle, thing.flags, thing.tid, thing.action,
+                          tuple(thing.args), box)
+            
+            # Things that do not block movement still cover their position, they can be starting points.
+            if box is None:
+                self.things.append((get_signature(properties), thing.x, thing.y, thing.x, thing.y))
+            else:
+                self.things.append((get_signature(properties), box[0], box[1], box[2], box[3]))
+    
+    
+    def get_changed_bounds(self, old_snapshot):
+        """
+        Returns the bounding box of everything that changed since an older snapshot of the same map.
+        
+        @param old_snapshot: the MapSnapshot object of the older version of the map.
+        
+        @return: a Rectangle in map coordinates, or None if nothing changed.
+        """
+        
+        bounds = None
+        for new_objects, old_objects in ((self.linedefs, old_snapshot.linedefs), (self.sectors, old_snapshot.sectors),
+                                         (self.things, old_snapshot.things)):
+            for index in xrange(max(len(new_objects), len(old_objects))):
+                new_object = new_objects[index] if index < len(new_objects) else None
+                old_object = old_objects[index] if index < len(old_objects) else None
+                if new_object is not None and old_object is not None and new_object[0] == old_object[0]:
+                    continue
+                
+                # Both the old and the new region of a changed object are affected.
+                for changed in (new_object, old_object):
+                    if changed is None:
+                        continue
+                    
+                    if bounds is None:
+                        bounds = Rectangle(changed[1], changed[2], changed[3], changed[4])
+                    else:
+                        bounds.set(min(bounds.left, changed[1]), min(bounds.top, changed[2]),
+                                   max(bounds.right, changed[3]), max(bounds.bottom, changed[4]))
+        
+        return bounds
+    
+    
+    def write(self, filename):
+        """
+        Writes this snapshot to a file.
+        """
+        
+        with open(filename, 'wb') as f:
+            f.write(MapSnapshot.FILE_HEADER.pack(MapSnapshot.FILE_ID, MapSnapshot.FILE_VERSION, len(self.linedefs),
+                                                 len(self.sectors), len(self.things)))
+            for objects in (self.linedefs, self.sectors, self.things):
+                f.write(numpy.array(objects, dtype=MapSnapshot.FILE_RECORD).tostring())
+    
+    
+    def read(self, filename):
+        """
+        Reads a snapshot from a file.
+        
+        @return: True if the snapshot was read, False if the file is not a supported snapshot file.
+        """
+        
+        with open(filename, 'rb') as f:
+            data = f.read(MapSnapshot.FILE_HEADER.size)
+            if len(data) < MapSnapshot.FILE_HEADER.size:
+                return False
+            
+            file_id, version, linedef_count, sector_count, thing_count = MapSnapshot.FILE_HEADER.unpack(data)
+            if file_id != MapSnapshot.FILE_ID or version != MapSnapshot.FILE_VERSION:
+                return False
+            
+            lists = []
+            for count in (linedef_count, sector_count, thing_count):
+                records = numpy.frombuffer(f.read(count * MapSnapshot.FILE_RECORD.itemsize), dtype=MapSnapshot.FILE_RECORD)
+                if len(records) != count:
+                    return False
+                lists.append([tuple(record) for record in records.tolist()])
+        
+        self.linedefs, self.sectors, self.things = lists
+        
+        return True
+
+
+def get_signature(properties):
+    """
+    Returns a 64 bit integer digest of a tuple of object properties.
+    """
+    
+    return struct.unpack('<Q', hashlib.md5(repr(properties)).digest()[:8])[0]
+
+
+def get_sidedef_sector(map_data, sidedef_index):
+    """
+    Returns the sector index of a sidedef, or -1 for an unused sidedef.
+    """
+    
+    if sidedef_index == Linedef.SIDEDEF_NONE:
+        return -1
+    
+    return map_data.sidedefs[sidedef_index].sector
+
+
+def get_plane_properties(plane):
+    """
+    Returns the coefficients of a sector plane, or None if there is no plane.
+    """
+    
+    if plane is None:
+        return None
+    
+    return (plane.a, plane.b, plane.c, plane.d)
@@ -5,6 +5,7 @@
 Contains Doom WAD file reading classes.
 """
 
+import mmap
 import struct
 
 
@@ -30,7 +31,8 @@ class Lump(object):
     A lump that is part of a WAD file.
     
     It is recommended to access a lump's data through the get_data() method to prevent having to load an entire
-    WAD's data in memory.
+    WAD's data in memory. If the owning WAD is memory mapped, get_data() returns a read-only buffer into the mapping
+    instead of a copy of the data.
     """
     
     def __init__(self, name, size, offset, owner):
@@ -45,20 +47,61 @@ class Lump(object):
         """
         Returns this lump's data.
         
-        If the data has not yet been read, it will open the WAD file and read it before returning it.
+        If the data has not yet been read, it will open the WAD file and read it before returning it. If the WAD file
+        is memory mapped, a buffer object pointing into the mapping is returned and nothing is read or kept.
         """
         
+        if self.owner.mapping is not None:
+            return buffer(self.owner.mapping, self.offset, self.size)
+        
         if self.data is None:
             with open(self.owner.filename, 'rb') as f:
                 f.seek(self.offset)
                 self.data = f.read(self.size)
         
         return self.data
+    
+    
+    def get_data_chunks(self, chunk_size=65536):
+        """
+        Yields this lump's data in chunks of at most chunk_size bytes, without reading all of it into memory.
+        
+        Data that was already read or memory mapped is yielded from memory instead.
+        """
+        
+        if self.owner.mapping is not None or self.data is not None:
+            data = self.get_data()
+            for offset in xrange(0, self.size, chunk_size):
+                yield buffer(data, offset, chunk_size)
+            return
+        
+        with open(self.owner.filename, 'rb') as f:
+            f.seek(self.offset)
+            remaining = self.size
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if len(chunk) == 0:
+                    break
+                
+                remaining -= len(chunk)
+                yield chunk
+    
+    
+    def release(self):
+        """
+        Releases this lump's data if it was read before.
+        """
+        
+        self.data = None
      
 
 class WADReader(object):
     """
     Reads Doom WAD files.
+    
+    If mapped is True, the WAD file is memory mapped once and lump data is returned as buffers into that mapping,
+    which avoids opening the file and copying data for every lump. Call close() to release the mapping; any lump
+    data buffers retrieved from the WAD must no longer be used after that.
     """
     
     TYPE_IWAD = 'IWAD'
@@ -68,12 +111,33 @@ class WADReader(object):
     S_LUMP = struct.Struct("<II8s")
 
     
-    def __init__(self, filename):
+    def __init__(self, filename, mapped=False):
         self.filename = None
         self.lumps = None
         self.type = None
         
+        # Lump name to lump indices mapping, in directory order.
+        self.lump_indices = None
+        
+        # Lump indices of map header lumps, in directory order.
+        self.map_indices = None
+        
+        # File object and memory mapping, if this WAD is memory mapped.
+        self.file = None
+        self.mapping = None
+        
         self.read(filename)
+        
+        if mapped == True:
+            self.map_file()
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     
     def read(self, filename):
@@ -104,20 +168,72 @@ class WADReader(object):
             
         self.filename = filename
         self.type = wad_type
+        
+        self.build_index()
+    
+    
+    def build_index(self):
+        """
+        Builds the lump name and map header indices from the lump directory.
+        """
+        
+        self.lump_indices = {}
+        self.map_indices = []
+        
+        for index, lump in enumerate(self.lumps):
+            indices = self.lump_indices.get(lump.name)
+            if indices is None:
+                indices = []
+                self.lump_indices[lump.name] = indices
+            indices.append(index)
+            
+            # A map header lump directly precedes a THINGS lump.
+            if lump.name == 'THINGS' and index > 0:
+                self.map_indices.append(index - 1)
+    
+    
+    def map_file(self):
+        """
+        Memory maps this WAD file. Lump data will be returned as buffers into the mapping from now on.
+        """
+        
+        if self.mapping is not None:
+            return
+        
+        # Drop lump data that was read before, the mapping replaces it.
+        for lump in self.lumps:
+            lump.release()
+        
+        self.file = open(self.filename, 'rb')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    
+    def close(self):
+        """
+        Releases the memory mapping and file handle of this WAD file, if it is mapped.
+        """
+        
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+        
+        if self.file is not None:
+            self.file.close()
+            self.file = None
             
     
     def get_index(self, lump_name):
         """
         Returns the first index of a lump name.
+        
+        Lumps later in the directory override earlier lumps with the same name, so the last index is returned.
         """
         
-        index = len(self.lumps) - 1
-        for lump in reversed(self.lumps):
-            if lump.name == lump_name:
-                return index
-            index -= 1
+        indices = self.lump_indices.get(lump_name)
+        if indices is None:
+            return -1
         
-        return -1
+        return indices[-1]
     
     
     def get_lump_index(self, lump_index):
@@ -138,11 +254,11 @@ class WADReader(object):
         @return: the first matching lump with the specified name, or None if no lump with that name could be found.
         """
         
-        for lump in reversed(self.lumps):
-            if lump.name == lump_name:
-                return lump
+        indices = self.lump_indices.get(lump_name)
+        if indices is None:
+            return None
         
-        return None
+        return self.lumps[indices[-1]]
     
     
     def lump_exists(self, lump_name):
@@ -150,11 +266,7 @@ class WADReader(object):
         Returns True if the lump name exists in this WAD< False otherwise.
         """
         
-        for lump in self.lumps:
-            if lump.name == lump_name:
-                return True
-            
-        return False
+        return lump_name in self.lump_indices
     
     
     def get_map_list(self):
@@ -164,8 +276,7 @@ class WADReader(object):
         
         maplist = []
         
-        for index, lump in enumerate(self.lumps):
-            if lump.name == 'THINGS' and index > 0:
-                maplist.append(self.lumps[index - 1].name)
+        for index in self.map_indices:
+            maplist.append(self.lumps[index].name)
         
         return sorted(maplist)
\ No newline at end of file
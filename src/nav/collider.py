@@ -1,7 +1,34 @@
+from collections import OrderedDict
 from doom.map.objects import Linedef, Sector
-from util.rectangle import Rectangle
+from util.rectangle import Rectangle, intersects_with_lines
 from util.vector import Vector3
-import config
+import array
+import bisect
+import numpy
+
+
+# The number of linedefs from which Collider.check_linedefs tests all of them at once. Below this, the fixed cost of
+# the vectorized test is larger than that of testing each linedef by itself.
+LINEDEF_BATCH_COUNT = 64
+
+# The maximum number of linedef and thing sets that Collider keeps coordinate arrays for, each.
+LINEDEF_ARRAYS_SIZE = 4096
+
+# The maximum number of sloped floor and ceiling z values that SectorZCache keeps, each.
+SECTOR_Z_CACHE_SIZE = 65536
+
+# The number of positions that Collider.check_positions tests at once.
+CHECK_BATCH_SIZE = 4096
+
+# Position state flags, see PositionState.get_flags.
+POSITION_BLOCKLINE = 0x01
+POSITION_BLOCKTHING = 0x02
+POSITION_STEEP = 0x04
+POSITION_FLOOR_MOVES = 0x08
+POSITION_CEILING_MOVES = 0x10
+
+# Collision flag of a position, only stored in PositionResults.
+POSITION_COLLISION = 0x20
 
 
 class PositionState(object):
@@ -44,8 +71,9 @@ class PositionState(object):
         # This position's special sector index.
         self.special_sector = None
         
-        # This position's floor plane.
+        # This position's floor plane, and the index of the sector it belongs to.
         self.floor_plane = None
+        self.floor_plane_sector = None
 
         self.pos.copy_from(pos)
         self.bbox.set(
@@ -55,6 +83,317 @@ class PositionState(object):
             pos.y + radius
         )
         
+    
+    def get_flags(self):
+        """
+        Returns the boolean parts of this state as POSITION_* flags.
+        """
+        
+        flags = 0
+        if self.blockline == True:
+            flags |= POSITION_BLOCKLINE
+        if self.blockthing == True:
+            flags |= POSITION_BLOCKTHING
+        if self.steep == True:
+            flags |= POSITION_STEEP
+        if self.floor_moves == True:
+            flags |= POSITION_FLOOR_MOVES
+        if self.ceiling_moves == True:
+            flags |= POSITION_CEILING_MOVES
+        
+        return flags
+    
+    
+    def set_flags(self, flags):
+        """
+        Sets the boolean parts of this state from POSITION_* flags.
+        """
+        
+        self.blockline = (flags & POSITION_BLOCKLINE) != 0
+        self.blockthing = (flags & POSITION_BLOCKTHING) != 0
+        self.steep = (flags & POSITION_STEEP) != 0
+        self.floor_moves = (flags & POSITION_FLOOR_MOVES) != 0
+        self.ceiling_moves = (flags & POSITION_CEILING_MOVES) != 0
+
+
+class PositionResults(object):
+    """
+    Stores the outcome of many collision tests in typed arrays, so that they take up little memory and can be sent to
+    other processes cheaply.
+    
+    Indexed results are looked up by position in a dict of indices. After sort() that dict is dropped, and results
+    are looked up by binary search on their sorted x,y keys instead.
+    """
+    
+    def __init__(self, indexed=True):
+        # An x << 16 + y key, and the z, floor z, ceiling z, POSITION_* flags, special sector and floor plane sector
+        # of each result. Map coordinates are 16 bit, so keys order results by x, then y. Sector indices are -1 if a
+        # result has none.
+        self.keys = array.array('i')
+        self.z = array.array('d')
+        self.floorz = array.array('d')
+        self.ceilz = array.array('d')
+        self.flags = array.array('B')
+        self.special_sectors = array.array('i')
+        self.plane_sectors = array.array('i')
+        
+        # Result indices keyed by (x, y, z) map position, or None if the results are not indexed.
+        self.index = {} if indexed == True else None
+    
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    
+    def add(self, pos3, collision, state):
+        """
+        Adds the outcome of a single collision test.
+        
+        @param pos3: the tested position.
+        @param collision: the collision value returned by Collider.check_position.
+        @param state: the collider state returned by Collider.check_position.
+        """
+        
+        flags = state.get_flags()
+        if collision == True:
+            flags |= POSITION_COLLISION
+        
+        if self.index is not None:
+            self.index[(pos3.x, pos3.y, pos3.z)] = len(self.keys)
+        
+        self.keys.append((pos3.x << 16) + pos3.y)
+        self.z.append(pos3.z)
+        self.floorz.append(state.floorz)
+        self.ceilz.append(state.ceilz)
+        self.flags.append(flags)
+        self.special_sectors.append(-1 if state.special_sector is None else state.special_sector)
+        self.plane_sectors.append(-1 if state.floor_plane_sector is None else state.floor_plane_sector)
+    
+    
+    def add_batch(self, positions, results):
+        """
+        Adds the outcome of Collider.check_positions.
+        
+        @param positions: the sequence of (x, y, z) tuples that were tested.
+        @param results: the tuple of arrays returned by Collider.check_positions.
+        """
+        
+        collisions, floorz, ceilz, flags, special_sectors, plane_sectors = results
+        
+        if self.index is not None:
+            start = len(self.keys)
+            for index, position in enumerate(positions):
+                self.index[position] = start + index
+        
+        count = len(positions)
+        xs = numpy.fromiter((position[0] for position in positions), numpy.int64, count)
+        ys = numpy.fromiter((position[1] for position in positions), numpy.int64, count)
+        zs = numpy.fromiter((position[2] for position in positions), numpy.float64, count)
+        flags = flags | (collisions.astype(numpy.uint8) * POSITION_COLLISION)
+        
+        self.keys.fromstring(((xs << 16) + ys).astype(numpy.int32).tostring())
+        self.z.fromstring(zs.tostring())
+        self.floorz.fromstring(floorz.astype(numpy.float64).tostring())
+        self.ceilz.fromstring(ceilz.astype(numpy.float64).tostring())
+        self.flags.fromstring(flags.astype(numpy.uint8).tostring())
+        self.special_sectors.fromstring(special_sectors.astype(numpy.int32).tostring())
+        self.plane_sectors.fromstring(plane_sectors.astype(numpy.int32).tostring())
+    
+    
+    def extend(self, other):
+        """
+        Adds all results of another PositionResults object.
+        """
+        
+        if self.index is not None:
+            if other.index is None:
+                raise ValueError('Cannot add results that are not indexed to indexed results.')
+            start = len(self.keys)
+            for position, index in other.index.iteritems():
+                self.index[position] = start + index
+        
+        self.keys.extend(other.keys)
+        self.z.extend(other.z)
+        self.floorz.extend(other.floorz)
+        self.ceilz.extend(other.ceilz)
+        self.flags.extend(other.flags)
+        self.special_sectors.extend(other.special_sectors)
+        self.plane_sectors.extend(other.plane_sectors)
+    
+    
+    def sort(self):
+        """
+        Sorts the results by position, and drops the dict of indices.
+        """
+        
+        self.index = None
+        
+        keys = numpy.frombuffer(self.keys, dtype=numpy.int32)
+        zs = numpy.frombuffer(self.z, dtype=numpy.float64)
+        order = numpy.lexsort((zs, keys))
+        
+        for name, dtype in (('keys', numpy.int32), ('z', numpy.float64), ('floorz', numpy.float64),
+                            ('ceilz', numpy.float64), ('flags', numpy.uint8), ('special_sectors', numpy.int32),
+                            ('plane_sectors', numpy.int32)):
+            values = getattr(self, name)
+            sorted_values = array.array(values.typecode)
+            sorted_values.fromstring(numpy.frombuffer(values, dtype=dtype)[order].tostring())
+            setattr(self, name, sorted_values)
+    
+    
+    def find(self, x, y, z):
+        """
+        Returns the index of the result at a map position, or -1 if there is none.
+        """
+        
+        if self.index is not None:
+            return self.index.get((x, y, z), -1)
+        
+        keys = self.keys
+        key = (x << 16) + y
+        index = bisect.bisect_left(keys, key)
+        while index < len(keys) and keys[index] == key:
+            if self.z[index] == z:
+                return index
+            index += 1
+        
+        return -1
+    
+    
+    def restore(self, index, state, map_data):
+        """
+        Restores the outcome of a collision test into a collider state.
+        
+        @param index: the index of the result to restore.
+        @param state: the collider state to restore the result into. Its position is not changed.
+        @param map_data: the map data to look up the floor plane in.
+        
+        @return: the collision value of the result.
+        """
+        
+        flags = self.flags[index]
+        state.set_flags(flags)
+        state.floorz = self.floorz[index]
+        state.ceilz = self.ceilz[index]
+        
+        special_sector = self.special_sectors[index]
+        state.special_sector = None if special_sector == -1 else special_sector
+        
+        plane_sector = self.plane_sectors[index]
+        if plane_sector == -1:
+            state.floor_plane_sector = None
+            state.floor_plane = None
+        else:
+            state.floor_plane_sector = plane_sector
+            state.floor_plane = map_data.sectors[plane_sector].floor_plane
+        
+        return (flags & POSITION_COLLISION) != 0
+    
+    
+    def get_memory_size(self):
+        """
+        Returns the number of bytes that the result arrays take up.
+        """
+        
+        return sum(values.itemsize * len(values) for values in (self.keys, self.z, self.floorz, self.ceilz, self.flags,
+                                                                self.special_sectors, self.plane_sectors))
+        
+
+class SectorZCache(object):
+    """
+    Caches the floor and ceiling z of sectors at map coordinates.
+    
+    Flat sectors have the same z everywhere, which is read from the sector directly. Sloped sectors are cached by
+    sector index and map coordinates, which neighbouring collision boxes often share corners of. These are kept in
+    caches of limited size, that evict the least recently used values first. Only sloped lookups count towards the
+    cache statistics.
+    """
+    
+    def __init__(self, map_data, size):
+        self.map_data = map_data
+        self.size = size
+        
+        # Sloped floor and ceiling z values, by (sector index, x, y).
+        self.floor_planes = OrderedDict()
+        self.ceiling_planes = OrderedDict()
+        
+        # Cache statistics.
+        self.hits = 0
+        self.misses = 0
+    
+    
+    def get_sector_floor_z(self, sector_index, x, y):
+        """
+        Returns the floor z at map coordinates x,y inside a specific sector index.
+        """
+        
+        sector = self.map_data.sectors[sector_index]
+        if sector.floor_plane is None:
+            return sector.floorz
+        
+        return self.get_plane_z(self.floor_planes, sector.floor_plane, sector_index, x, y)
+    
+    
+    def get_sector_ceil_z(self, sector_index, x, y):
+        """
+        Returns the ceiling z at map coordinates x,y inside a specific sector index.
+        """
+        
+        sector = self.map_data.sectors[sector_index]
+        if sector.ceiling_plane is None:
+            return sector.ceilingz
+        
+        return self.get_plane_z(self.ceiling_planes, sector.ceiling_plane, sector_index, x, y)
+    
+    
+    def get_floor_z(self, x, y):
+        """
+        Returns the floor z at map coordinates x,y.
+        """
+        
+        return self.get_sector_floor_z(self.map_data.get_sector(x, y), x, y)
+    
+    
+    def get_ceil_z(self, x, y):
+        """
+        Returns the ceiling z at map coordinates x,y.
+        """
+        
+        return self.get_sector_ceil_z(self.map_data.get_sector(x, y), x, y)
+    
+    
+    def get_plane_z(self, cache, plane, sector_index, x, y):
+        """
+        Returns the z of a sloped plane at map coordinates x,y from a least recently used cache.
+        """
+        
+        key = (sector_index, x, y)
+        z = cache.pop(key, None)
+        if z is None:
+            self.misses += 1
+            z = plane.get_z(x, y)
+            if len(cache) >= self.size:
+                cache.popitem(last=False)
+        else:
+            self.hits += 1
+        
+        # Reinsert the value to make it the most recently used.
+        cache[key] = z
+        
+        return z
+    
+    
+    def get_hit_rate(self):
+        """
+        Returns the fraction of sloped plane lookups that were served from the cache.
+        """
+        
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        
+        return float(self.hits) / lookups
+
 
 class Collider(object):
     """
@@ -69,6 +408,19 @@ class Collider(object):
         # Temporary rectangle to avoid excessive allocation.
         self.temp_rect = Rectangle()
         
+        # Sector floor and ceiling z cache.
+        self.z_cache = SectorZCache(map_data, SECTOR_Z_CACHE_SIZE)
+        
+        # Endpoint arrays of large linedef sets, keyed by the id of the set.
+        self.linedef_arrays = {}
+        
+        # Collision box arrays of thing sets, keyed by the id of the set.
+        self.thing_arrays = {}
+        
+        # Collision boxes overlap at most 2 by 2 blocks, which keep their contents in tables.
+        if map_data.blockmap.region_linedefs is None:
+            map_data.blockmap.build_regions(map_data)
+        
         
     def get_bb_floor_z(self, pos, radius, sector_index=None):
         """
@@ -83,15 +435,15 @@ class Collider(object):
         """ 
         
         if sector_index is not None:
-            floorz = self.map_data.get_sector_floor_z(sector_index, pos.x - radius, pos.y)
-            floorz = max(floorz, self.map_data.get_sector_floor_z(sector_index, pos.x + radius, pos.y))
-            floorz = max(floorz, self.map_data.get_sector_floor_z(sector_index, pos.x - radius, pos.y + radius))
-            floorz = max(floorz, self.map_data.get_sector_floor_z(sector_index, pos.x + radius, pos.y - radius))
+            floorz = self.z_cache.get_sector_floor_z(sector_index, pos.x - radius, pos.y)
+            floorz = max(floorz, self.z_cache.get_sector_floor_z(sector_index, pos.x + radius, pos.y))
+            floorz = max(floorz, self.z_cache.get_sector_floor_z(sector_index, pos.x - radius, pos.y + radius))
+            floorz = max(floorz, self.z_cache.get_sector_floor_z(sector_index, pos.x + radius, pos.y - radius))
         else:
-            floorz = self.map_data.get_floor_z(pos.x - radius, pos.y)
-            floorz = max(floorz, self.map_data.get_floor_z(pos.x + radius, pos.y))
-            floorz = max(floorz, self.map_data.get_floor_z(pos.x - radius, pos.y + radius))
-            floorz = max(floorz, self.map_data.get_floor_z(pos.x + radius, pos.y - radius))
+            floorz = self.z_cache.get_floor_z(pos.x - radius, pos.y)
+            floorz = max(floorz, self.z_cache.get_floor_z(pos.x + radius, pos.y))
+            floorz = max(floorz, self.z_cache.get_floor_z(pos.x - radius, pos.y + radius))
+            floorz = max(floorz, self.z_cache.get_floor_z(pos.x + radius, pos.y - radius))
         
         return floorz
     
@@ -109,15 +461,15 @@ class Collider(object):
         """ 
         
         if sector_index is not None:
-            ceilz = self.map_data.get_sector_ceil_z(sector_index, pos2.x - radius, pos2.y)
-            ceilz = min(ceilz, self.map_data.get_sector_ceil_z(sector_index, pos2.x + radius, pos2.y))
-            ceilz = min(ceilz, self.map_data.get_sector_ceil_z(sector_index, pos2.x - radius, pos2.y + radius))
-            ceilz = min(ceilz, self.map_data.get_sector_ceil_z(sector_index, pos2.x + radius, pos2.y - radius))
+            ceilz = self.z_cache.get_sector_ceil_z(sector_index, pos2.x - radius, pos2.y)
+            ceilz = min(ceilz, self.z_cache.get_sector_ceil_z(sector_index, pos2.x + radius, pos2.y))
+            ceilz = min(ceilz, self.z_cache.get_sector_ceil_z(sector_index, pos2.x - radius, pos2.y + radius))
+            ceilz = min(ceilz, self.z_cache.get_sector_ceil_z(sector_index, pos2.x + radius, pos2.y - radius))
         else:
-            ceilz = self.map_data.get_ceil_z(pos2.x - radius, pos2.y)
-            ceilz = min(ceilz, self.map_data.get_ceil_z(pos2.x + radius, pos2.y))
-            ceilz = min(ceilz, self.map_data.get_ceil_z(pos2.x - radius, pos2.y + radius))
-            ceilz = min(ceilz, self.map_data.get_ceil_z(pos2.x + radius, pos2.y - radius))
+            ceilz = self.z_cache.get_ceil_z(pos2.x - radius, pos2.y)
+            ceilz = min(ceilz, self.z_cache.get_ceil_z(pos2.x + radius, pos2.y))
+            ceilz = min(ceilz, self.z_cache.get_ceil_z(pos2.x - radius, pos2.y + radius))
+            ceilz = min(ceilz, self.z_cache.get_ceil_z(pos2.x + radius, pos2.y - radius))
         
         return ceilz
     
@@ -135,33 +487,187 @@ class Collider(object):
         state.reset(pos3, radius, height)
                 
         # Select a starting sector.
-        subsector_index = self.map_data.point_in_subsector(pos3.x, pos3.y)
-        state.sector_index = self.map_data.subsectors[subsector_index].sector
+        state.sector_index = self.map_data.get_sector(pos3.x, pos3.y)
         state.base_sector_index = state.sector_index
             
         self.check_sector_position(state)
         
         # Set the blockmap region to test in.
-        x1, y1 = self.map_data.blockmap.map_to_blockmap(state.bbox.p1)
-        x2, y2 = self.map_data.blockmap.map_to_blockmap(state.bbox.p2)
-        rect = self.temp_rect
-        rect.set(x1, y1, x2, y2)
+        blockmap = self.map_data.blockmap
+        x1, y1 = blockmap.map_to_blockmap(state.bbox.p1)
+        x2, y2 = blockmap.map_to_blockmap(state.bbox.p2)
         
         # Get all testable items in a region and test against them.
-        linedefs, things = self.map_data.blockmap.get_region(rect)
+        linedefs, things = blockmap.get_region_sets(x1, y1, x2, y2)
         if len(linedefs) > 0:
-            linedefs = set(linedefs)
             self.check_linedefs(state, linedefs)
         if len(things) > 0:
-            things = set(things)
             self.check_things(state, things)
-
+        
+        return self.get_collision(state), state
+    
+    
+    def check_positions(self, positions, radius, height):
+        """
+        Check many positions for collision at once.
+        
+        Positions are grouped by the blockmap region that they test against, so that each group gathers its linedefs
+        and things once. All positions are then tested against the linedefs of their group at once. The results are
+        the same as those of check_position for each position.
+        
+        @param positions: a sequence of (x, y, z) tuples of integer map x and y coordinates.
+        @param radius: the radius to test.
+        @param height: the height of the test.
+        
+        @return: a tuple of NumPy arrays of collision values, floor z, ceiling z, POSITION_* flags, special sector
+                 indices and floor plane sector indices. Sector indices are -1 if a position has none.
+        """
+        
+        count = len(positions)
+        results = (
+            numpy.zeros(count, dtype=numpy.bool_),
+            numpy.zeros(count, dtype=numpy.float64),
+            numpy.zeros(count, dtype=numpy.float64),
+            numpy.zeros(count, dtype=numpy.uint8),
+            numpy.zeros(count, dtype=numpy.int32),
+            numpy.zeros(count, dtype=numpy.int32)
+        )
+        
+        for start in xrange(0, count, CHECK_BATCH_SIZE):
+            end = min(start + CHECK_BATCH_SIZE, count)
+            self.check_positions_batch(positions, start, end, radius, height, results)
+        
+        return results
+    
+    
+    def check_positions_batch(self, positions, start, end, radius, height, results):
+        """
+        Check a range of positions for collision, and store the outcome in result arrays.
+        """
+        
+        collisions, floorz, ceilz, flags, special_sectors, plane_sectors = results
+        
+        count = end - start
+        batch = positions[start:end]
+        xs = numpy.fromiter((position[0] for position in batch), numpy.int64, count)
+        ys = numpy.fromiter((position[1] for position in batch), numpy.int64, count)
+        sector_indices = self.map_data.get_sectors_batch(xs, ys).tolist()
+        
+        # Find the blockmap region that the bounding box of each position covers.
+        blockmap = self.map_data.blockmap
+        x1 = ((xs - radius - blockmap.origin.x) // blockmap.blocksize).tolist()
+        y1 = ((ys - radius - blockmap.origin.y) // blockmap.blocksize).tolist()
+        x2 = ((xs + radius - blockmap.origin.x) // blockmap.blocksize).tolist()
+        y2 = ((ys + radius - blockmap.origin.y) // blockmap.blocksize).tolist()
+        
+        regions = {}
+        position_regions = [regions.setdefault(region, len(regions)) for region in zip(x1, y1, x2, y2)]
+        
+        # Gather the contents of each region once.
+        region_linedefs = [None] * len(regions)
+        region_things = [None] * len(regions)
+        for region, region_index in regions.iteritems():
+            region_linedefs[region_index], region_things[region_index] = blockmap.get_region_sets(*region)
+        
+        # Test the bounding box of every position against the linedefs and things of its region at once.
+        bbox = (xs - radius, ys - radius, xs + radius, ys + radius)
+        linedef_hits, linedef_ends = self.get_region_hits(bbox, position_regions, region_linedefs, self.get_linedef_arrays, True)
+        thing_hits, thing_ends = self.get_region_hits(bbox, position_regions, region_things, self.get_thing_arrays, False)
+        
+        # Keep local references as optimization.
+        state = self.state
+        pos = Vector3()
+        
+        linedef_start = 0
+        thing_start = 0
+        for index in xrange(count):
+            pos.x, pos.y, pos.z = batch[index]
+            state.reset(pos, radius, height)
+            state.sector_index = sector_indices[index]
+            state.base_sector_index = state.sector_index
+            self.check_sector_position(state)
+            
+            linedef_end = linedef_ends[index]
+            if linedef_end > linedef_start:
+                self.check_intersecting_linedefs(state, linedef_hits[linedef_start:linedef_end])
+                linedef_start = linedef_end
+            
+            thing_end = thing_ends[index]
+            if thing_end > thing_start:
+                self.check_things(state, thing_hits[thing_start:thing_end])
+                thing_start = thing_end
+            
+            position = start + index
+            collisions[position] = self.get_collision(state)
+            floorz[position] = state.floorz
+            ceilz[position] = state.ceilz
+            flags[position] = state.get_flags()
+            special_sectors[position] = -1 if state.special_sector is None else state.special_sector
+            plane_sectors[position] = -1 if state.floor_plane_sector is None else state.floor_plane_sector
+    
+    
+    def get_region_hits(self, bbox, position_regions, region_items, get_arrays, lines):
+        """
+        Tests the bounding boxes of positions against all linedefs or things in their blockmap region at once.
+        
+        @param bbox: a tuple of NumPy arrays of the left, top, right and bottom coordinates of each bounding box.
+        @param position_regions: a list of the region index of each position.
+        @param region_items: a list of the linedef or thing tuples of each region.
+        @param get_arrays: the function returning the coordinate arrays of a tuple of items.
+        @param lines: True if the items are linedefs, False if they are thing collision boxes.
+        
+        @return: a tuple of a list of the items that are hit, ordered by position, and a list of the end of each
+                 position's hits in it.
+        """
+        
+        position_count = len(position_regions)
+        
+        # Concatenate the items of all regions.
+        items = []
+        region_counts = numpy.zeros(len(region_items), dtype=numpy.int64)
+        region_arrays = []
+        for region_index, region in enumerate(region_items):
+            if len(region) > 0:
+                items.extend(region)
+                region_counts[region_index] = len(region)
+                region_arrays.append(get_arrays(region))
+        
+        if len(items) == 0:
+            return items, [0] * position_count
+        
+        coordinates = [numpy.concatenate([arrays[column] for arrays in region_arrays]) for column in xrange(1, 5)]
+        region_offsets = numpy.cumsum(region_counts) - region_counts
+        
+        # Pair each position with every item of its region, the pairs of a position follow each other.
+        position_regions = numpy.array(position_regions, dtype=numpy.int64)
+        counts = region_counts[position_regions]
+        pair_starts = numpy.cumsum(counts) - counts
+        pair_positions = numpy.repeat(numpy.arange(position_count), counts)
+        pair_items = numpy.arange(len(pair_positions)) + numpy.repeat(region_offsets[position_regions] - pair_starts, counts)
+        
+        x1, y1, x2, y2 = [column[pair_items] for column in coordinates]
+        left, top, right, bottom = [column[pair_positions] for column in bbox]
+        if lines == True:
+            hits = intersects_with_lines(left, top, right, bottom, x1, y1, x2, y2)
+        else:
+            hits = (x1 <= right) & (x2 >= left) & (y1 <= bottom) & (y2 >= top)
+        hit_items = [items[index] for index in pair_items[hits].tolist()]
+        hit_ends = numpy.cumsum(numpy.bincount(pair_positions[hits], minlength=position_count)).tolist()
+        
+        return hit_items, hit_ends
+    
+    
+    def get_collision(self, state):
+        """
+        Returns True if a tested position collides, based on its collision state.
+        """
+        
         # Blocked by single-sided line or thing.
         if state.blockline == True or state.blockthing == True:
             collision = True
         
         # Ceiling is too low.
-        elif state.pos.z + height > state.ceilz:
+        elif state.pos.z + state.height > state.ceilz:
             if state.special_sector is None:
                 collision = True
             
@@ -179,24 +685,39 @@ class Collider(object):
         else:
             collision = False
             
-        return collision, state
+        return collision
     
     
     def check_linedefs(self, state, linedefs):
         """
         Check linedefs for collision and update state.
+        
+        @param linedefs: a tuple of (linedef index, x1, y1, x2, y2) tuples, see BlockMap.get_region_sets.
         """
         
-        for line_index in linedefs:
-            linedef = self.map_data.linedefs[line_index]
-            lx1 = linedef.vertex1.x
-            ly1 = linedef.vertex1.y
-            lx2 = linedef.vertex2.x
-            ly2 = linedef.vertex2.y 
+        if len(linedefs) >= LINEDEF_BATCH_COUNT:
+            linedefs = self.get_intersecting_linedefs(state, linedefs)
+        else:
             
-            # Ignore lines that do not intersect.                   
-            if state.bbox.intersects_with_line(lx1, ly1, lx2, ly2) == False:
-                continue
+            # Ignore lines that do not intersect.
+            intersects_with_line = state.bbox.intersects_with_line
+            linedefs = [entry for entry in linedefs if intersects_with_line(entry[1], entry[2], entry[3], entry[4]) == True]
+        
+        self.check_intersecting_linedefs(state, linedefs)
+    
+    
+    def check_intersecting_linedefs(self, state, linedefs):
+        """
+        Update state from linedefs that are known to intersect with its bounding box.
+        
+        @param linedefs: a sequence of (linedef index, x1, y1, x2, y2) tuples.
+        """
+        
+        # Keep local references as optimization.
+        map_linedefs = self.map_data.linedefs
+        
+        for line_index, _, _, _, _ in linedefs:
+            linedef = map_linedefs[line_index]
             
             # Cannot pass through impassible flagged lines.
             if (linedef.flags & Linedef.FLAG_IMPASSIBLE) != 0:
@@ -224,62 +745,99 @@ class Collider(object):
                     self.check_sector_position(state)
 
 
+    def get_intersecting_linedefs(self, state, linedefs):
+        """
+        Returns the linedefs that intersect with the state's bounding box, testing all of them at once.
+        
+        @param linedefs: a tuple of (linedef index, x1, y1, x2, y2) tuples.
+        
+        @return: a list of the intersecting linedef tuples, in the same order.
+        """
+        
+        arrays = self.get_linedef_arrays(linedefs)
+        bbox = state.bbox
+        intersecting = intersects_with_lines(bbox.left, bbox.top, bbox.right, bbox.bottom, arrays[1], arrays[2], arrays[3], arrays[4])
+        
+        return [linedefs[index] for index in numpy.flatnonzero(intersecting).tolist()]
+    
+    
+    def get_linedef_arrays(self, linedefs):
+        """
+        Returns the endpoint arrays of a set of linedefs.
+        
+        @param linedefs: a tuple of (linedef index, x1, y1, x2, y2) tuples.
+        
+        @return: a tuple of the set itself, and NumPy arrays of the x1, y1, x2 and y2 coordinates of its linedefs.
+        """
+        
+        # The set itself is stored along with its arrays, so that its id cannot be reused while it is cached.
+        arrays = self.linedef_arrays.get(id(linedefs))
+        if arrays is None or arrays[0] is not linedefs:
+            if len(self.linedef_arrays) >= LINEDEF_ARRAYS_SIZE:
+                self.linedef_arrays.clear()
+            
+            lines = numpy.array(linedefs, dtype=numpy.int64)
+            arrays = (linedefs, lines[:, 1], lines[:, 2], lines[:, 3], lines[:, 4])
+            self.linedef_arrays[id(linedefs)] = arrays
+        
+        return arrays
+    
+    
+    def get_thing_arrays(self, things):
+        """
+        Returns the collision box arrays of a set of things.
+        
+        @param things: a tuple of thing collision box tuples, see MapData.thing_boxes.
+        
+        @return: a tuple of the set itself, and NumPy arrays of the left, top, right and bottom coordinates of the
+                 collision boxes.
+        """
+        
+        arrays = self.thing_arrays.get(id(things))
+        if arrays is None or arrays[0] is not things:
+            if len(self.thing_arrays) >= LINEDEF_ARRAYS_SIZE:
+                self.thing_arrays.clear()
+            
+            boxes = numpy.array(things, dtype=numpy.float64)
+            arrays = (things, boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3])
+            self.thing_arrays[id(things)] = arrays
+        
+        return arrays
+        
+    
     def check_things(self, state, things):
         """
         Check things for collision and update state.
+        
+        @param things: a sequence of thing collision box tuples, see MapData.thing_boxes.
         """
         
-        for thing_index in things:
-            thing = self.map_data.things[thing_index]
-            thing_type = thing.doomid
+        # Keep local references as optimization.
+        bbox = state.bbox
+        left = bbox.left
+        top = bbox.top
+        right = bbox.right
+        bottom = bbox.bottom
+        z = state.pos.z
+        z_top = z + state.height
+        
+        for thing_left, thing_top, thing_right, thing_bottom, thing_z, thing_z_top in things:
             
-            # Parse custom bridge thing size.
-            if self.config.bridge_custom_type is not None and thing_type == self.config.bridge_custom_type:
-                thing_radius = thing.args[0]
-                thing_height = thing.args[1]
-                thing_flags = 0
-                
-            else:
-                thing_def = self.config.thing_dimensions.get(thing_type)
-                if thing_def is None:
-                    continue
-                 
-                thing_radius = thing_def.radius
-                thing_height = thing_def.height
-                thing_flags = thing_def.flags
-                
             # Test against thing rectangle.
-            thing_x = thing.x
-            thing_y = thing.y
-            rect = self.temp_rect
-            rect.set(
-                thing_x - thing_radius,
-                thing_y - thing_radius,
-                thing_x + thing_radius,
-                thing_y + thing_radius
-            )
-            if state.bbox.intersects_with(rect) == False:
+            if thing_left > right or thing_right < left or thing_top > bottom or thing_bottom < top:
                 continue
-            
-            # Determine z position.
-            if (thing_flags & config.DEF_FLAG_HANGING) != 0:
-                thing_z = self.map_data.get_ceil_z(thing_x, thing_y) - thing_height
-            else:
-                thing_z = self.map_data.get_floor_z(thing_x, thing_y)                            
-                if self.map_data.is_hexen == True:
-                    thing_z += thing.z
                 
             # Intersection with a thing.
-            if state.pos.z + state.height >= thing_z and state.pos.z <= thing_z + thing_height:
+            if z_top >= thing_z and z <= thing_z_top:
                 state.blockthing = True
                 
             # Point is above this thing, move the floor up to it.
-            if state.pos.z >= thing_z:
-                state.floorz = max(state.floorz, thing_z + thing_height)
+            if z >= thing_z:
+                state.floorz = max(state.floorz, thing_z_top)
                 state.special_sector = None
                 
             # Below this thing, move the ceiling down to it.
-            if state.pos.z + state.height <= thing_z + thing_height:
+            if z_top <= thing_z_top:
                 state.ceilz = min(state.ceilz, thing_z)
 
     
@@ -292,8 +850,8 @@ class Collider(object):
 
         # Find the floor and ceiling sectors to collide with.
         for stack in sector.threedstack:
-            sector_floor_z = self.map_data.get_sector_floor_z(stack[0], state.pos.x, state.pos.y)
-            sector_ceil_z = self.map_data.get_sector_ceil_z(stack[1], state.pos.x, state.pos.y)
+            sector_floor_z = self.z_cache.get_sector_floor_z(stack[0], state.pos.x, state.pos.y)
+            sector_ceil_z = self.z_cache.get_sector_ceil_z(stack[1], state.pos.x, state.pos.y)
             
             if state.pos.z >= sector_floor_z and state.pos.z <= sector_ceil_z:
                 floor_sector_index = stack[0]
@@ -322,7 +880,7 @@ class Collider(object):
             if floor_plane.c < self.config.slope_steep:
                 state.steep = True
         else:
-            sector_floor_z = self.map_data.get_sector_floor_z(floor_sector_index, state.pos.x, state.pos.y)
+            sector_floor_z = self.z_cache.get_sector_floor_z(floor_sector_index, state.pos.x, state.pos.y)
         
         if self.map_data.sectors[ceil_sector_index].ceiling_plane is not None:
             if state.sector_index != ceil_sector_index:
@@ -330,7 +888,7 @@ class Collider(object):
             else:
                 sector_ceil_z = self.get_bb_ceil_z(state.pos, state.radius)
         else:
-            sector_ceil_z = self.map_data.get_sector_ceil_z(ceil_sector_index, state.pos.x, state.pos.y)
+            sector_ceil_z = self.z_cache.get_sector_ceil_z(ceil_sector_index, state.pos.x, state.pos.y)
             
         # Keep this new floor as the special floor.
         floor_sector = self.map_data.sectors[floor_sector_index]
@@ -340,6 +898,7 @@ class Collider(object):
         # Keep floor planes.
         if floor_sector.floor_plane is not None:
             state.floor_plane = floor_sector.floor_plane
+            state.floor_plane_sector = floor_sector_index
             
         # Detect any moving sectors.
         state.floor_moves = ((floor_sector.flags & Sector.FLAG_FLOOR_MOVES) != 0) or state.floor_moves
@@ -0,0 +1,524 @@
+from util import compressedfile
+from util.vector import Vector3
+import array
+import numpy
+import struct
+import sys
+
+
+class CompactGrid(object):
+    """
+    The elements of a navigation grid, stored as typed arrays.
+    
+    Elements are identified by their index into the arrays. Each element has a position, flags, a linked floor plane,
+    a special sector and the indices of the elements that it is connected to in each direction. -1 is used for no
+    plane, sector or connected element.
+    
+    Elements are looked up by column, the set of elements at the same x and y position. Each element in a column is
+    in its own z layer. The lowest layer of every column is kept in a dense array that covers the bounds of the grid,
+    the rare columns with more than one layer keep their upper layers in a dict.
+    """
+    
+    # Grid file structures.
+    FILE_ID = 'DPGRID'
+    FILE_VERSION = 1
+    FILE_HEADER = struct.Struct('<6sII')
+    FILE_ELEMENT = numpy.dtype([
+        ('x', '<i2'),
+        ('y', '<i2'),
+        ('z', '<i2'),
+        ('plane', '<i4'),
+        ('special_sector', '<i4'),
+        ('flags', '<i4'),
+        ('elements', '<i4', (4,))
+    ])
+    
+    # The number of element records to write or read at a time.
+    FILE_CHUNK_SIZE = 65536
+    
+    # Per element arrays, with their array type code and NumPy type.
+    ELEMENT_ARRAYS = (
+        ('x', 'h', numpy.int16),
+        ('y', 'h', numpy.int16),
+        ('z', 'd', numpy.float64),
+        ('flags', 'B', numpy.uint8),
+        ('plane', 'i', numpy.int32),
+        ('special_sector', 'i', numpy.int32)
+    )
+    
+    # The connections of a new element.
+    NO_LINKS = (-1, -1, -1, -1)
+    
+    # The number of columns that the column index is grown by on a side, when an element is added outside of it.
+    COLUMN_MARGIN = 16
+    
+    # The number of bytes that a grid element should take up in memory, including its share of the column index.
+    ELEMENT_SIZE_TARGET = 64
+    
+    
+    def __init__(self):
+        self.map_data = None
+        
+        # The index of the first sector with the same floor plane object, for every sector. -1 for sectors without a
+        # floor plane.
+        self.plane_sectors = []
+        
+        # Element positions.
+        self.x = array.array('h')
+        self.y = array.array('h')
+        self.z = array.array('d')
+        
+        # Element flags.
+        self.flags = array.array('B')
+        
+        # The index of the sector whose floor plane is linked to an element, or -1. Sectors that share a plane object
+        # are stored as the first of them, see plane_sectors.
+        self.plane = array.array('i')
+        
+        # The special sector index of an element, or -1.
+        self.special_sector = array.array('i')
+        
+        # Connected element indices, 4 for each element in direction order, or -1.
+        self.links = array.array('i')
+        
+        # The element coordinates that the column index covers.
+        self.left = 0
+        self.top = 0
+        self.width = 0
+        self.height = 0
+        
+        # The element index of the lowest layer of each (x - left) + (y - top) * width column, or -1.
+        self.columns = array.array('i')
+        
+        # Lists of the element indices of the layers above the lowest one, in ascending z order, by column index.
+        self.layers = {}
+    
+    
+    def __len__(self):
+        return len(self.x)
+    
+    
+    def setup(self, map_data, left=0, top=0, right=-1, bottom=-1):
+        """
+        Prepares this grid for storing the elements of a map.
+        
+        @param left, top, right, bottom: the element coordinates that the column index should cover, inclusive.
+                                         Elements can still be added outside of these, at the cost of rebuilding the
+                                         column index.
+        """
+        
+        self.map_data = map_data
+        
+        plane_indices = {}
+        self.plane_sectors = []
+        for index, sector in enumerate(map_data.sectors):
+            if sector.floor_plane is None:
+                self.plane_sectors.append(-1)
+            else:
+                self.plane_sectors.append(plane_indices.setdefault(id(sector.floor_plane), index))
+        
+        self.set_bounds(left, top, right, bottom)
+    
+    
+    def set_bounds(self, left, top, right, bottom):
+        """
+        Rebuilds the column index to cover new element coordinates, inclusive.
+        """
+        
+        width = max(0, right - left + 1)
+        height = max(0, bottom - top + 1)
+        columns = array.array('i', [-1]) * (width * height)
+        layers = {}
+        
+        for cell, index in enumerate(self.columns):
+            if index == -1:
+                continue
+            
+            new_cell = (self.x[index] - left) + (self.y[index] - top) * width
+            columns[new_cell] = index
+            if cell in self.layers:
+                layers[new_cell] = self.layers[cell]
+        
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.columns = columns
+        self.layers = layers
+    
+    
+    def add_element(self, x, y, z):
+        """
+        Adds a new element without any flags, plane, special sector or connections.
+        
+        An element that is added at the same position as an existing one replaces it in its column. The existing
+        element remains part of the grid, but can no longer be looked up.
+        
+        @return: the index of the new element.
+        """
+        
+        index = len(self.x)
+        
+        self.x.append(x)
+        self.y.append(y)
+        self.z.append(z)
+        self.flags.append(0)
+        self.plane.append(-1)
+        self.special_sector.append(-1)
+        self.links.extend(CompactGrid.NO_LINKS)
+        
+        self.add_to_column(index)
+        
+        return index
+    
+    
+    def add_to_column(self, index):
+        """
+        Adds an element to the column at its position, in z order.
+        """
+        
+        x = self.x[index]
+        y = self.y[index]
+        z = self.z[index]
+        
+        if len(self.columns) == 0:
+            margin = CompactGrid.COLUMN_MARGIN
+            self.set_bounds(x - margin, y - margin, x + margin, y + margin)
+        elif x < self.left or y < self.top or x >= self.left + self.width or y >= self.top + self.height:
+            self.set_bounds(
+                min(self.left, x - CompactGrid.COLUMN_MARGIN),
+                min(self.top, y - CompactGrid.COLUMN_MARGIN),
+                max(self.left + self.width - 1, x + CompactGrid.COLUMN_MARGIN),
+                max(self.top + self.height - 1, y + CompactGrid.COLUMN_MARGIN)
+            )
+        
+        cell = (x - self.left) + (y - self.top) * self.width
+        first = self.columns[cell]
+        if first == -1:
+            self.columns[cell] = index
+            return
+        
+        zs = self.z
+        if zs[first] == z:
+            self.columns[cell] = index
+            return
+        
+        layers = self.layers.setdefault(cell, [])
+        if z < zs[first]:
+            self.columns[cell] = index
+            layers.insert(0, first)
+            return
+        
+        for position, other in enumerate(layers):
+            if zs[other] == z:
+                layers[position] = index
+                return
+            elif zs[other] > z:
+                layers.insert(position, index)
+                return
+        layers.append(index)
+    
+    
+    def get_element_xyz(self, x, y, z):
+        """
+        Returns the index of the element at the x,y,z coordinates, or None if no element exists at those coordinates.
+        """
+        
+        x -= self.left
+        y -= self.top
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return None
+        
+        cell = x + y * self.width
+        index = self.columns[cell]
+        if index == -1:
+            return None
+        
+        zs = self.z
+        if zs[index] == z:
+            return index
+        
+        layers = self.layers.get(cell)
+        if layers is not None:
+            for index in layers:
+                if zs[index] == z:
+                    return index
+        
+        return None
+    
+    
+    def get_element_list(self, pos2):
+        """
+        Returns a list of the indices of the elements at the 2d coordinates in ascending z order, or None if no
+        elements exist at those coordinates.
+        """
+        
+        column = self.get_column(pos2.x, pos2.y)
+        if len(column) == 0:
+            return None
+        
+        return column
+    
+    
+    def get_column(self, x, y):
+        """
+        Returns a list of the indices of the elements at x,y in ascending z order. The list is empty if there are
+        none.
+        """
+        
+        x -= self.left
+        y -= self.top
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return []
+        
+        cell = x + y * self.width
+        index = self.columns[cell]
+        if index == -1:
+            return []
+        
+        layers = self.layers.get(cell)
+        if layers is None:
+            return [index]
+        
+        return [index] + layers
+    
+    
+    def get_column_elements(self):
+        """
+        Returns an array of the indices of all elements that can be looked up by position, in no particular order.
+        """
+        
+        columns = self.get_array('columns', numpy.int32)
+        indices = [columns[columns != -1]]
+        for layers in self.layers.itervalues():
+            indices.append(numpy.array(layers, dtype=numpy.int32))
+        
+        return numpy.concatenate(indices)
+    
+    
+    def get_array(self, name, dtype):
+        """
+        Returns a NumPy view of one of the arrays of this grid.
+        
+        The view is only valid until elements are added or removed.
+        """
+        
+        return numpy.frombuffer(getattr(self, name), dtype=dtype)
+    
+    
+    def get_plane(self, index):
+        """
+        Returns the floor plane that is linked to an element, or None.
+        """
+        
+        sector_index = self.plane[index]
+        if sector_index == -1:
+            return None
+        
+        return self.map_data.sectors[sector_index].floor_plane
+    
+    
+    def set_plane_sector(self, index, sector_index):
+        """
+        Links the floor plane of a sector to an element.
+        """
+        
+        self.plane[index] = self.plane_sectors[sector_index]
+    
+    
+    def get_special_sector(self, index):
+        """
+        Returns the special sector index of an element, or None.
+        """
+        
+        sector_index = self.special_sector[index]
+        if sector_index == -1:
+            return None
+        
+        return sector_index
+    
+    
+    def is_similar(self, index, other):
+        """
+        Returns True if an element is similar, but not necessarily equal to, another element. Returns False otherwise.
+        """
+        
+        if self.special_sector[index] != self.special_sector[other] or self.flags[index] != self.flags[other]:
+            return False
+        
+        plane = self.plane[index]
+        if plane != -1 or self.plane[other] != -1:
+            return plane == self.plane[other]
+        else:
+            return self.z[index] == self.z[other]
+    
+    
+    def remove_elements(self, removed):
+        """
+        Removes elements from this grid. The remaining elements keep their order, connections to removed elements
+        are removed as well.
+        
+        @param removed: a set of the indices of the elements to remove.
+        
+        @return: an array of the new index of every old element, or -1 for removed elements.
+        """
+        
+        count = len(self)
+        keep = numpy.ones(count, dtype=numpy.bool_)
+        keep[numpy.fromiter(removed, numpy.int32, len(removed))] = False
+        new_indices = numpy.cumsum(keep, dtype=numpy.int32) - 1
+        new_indices[~keep] = -1
+        
+        for name, typecode, dtype in CompactGrid.ELEMENT_ARRAYS:
+            values = self.get_array(name, dtype)[keep]
+            setattr(self, name, array.array(typecode, values.tostring()))
+        
+        links = self.get_array('links', numpy.int32).reshape((count, 4))[keep]
+        links = numpy.where(links != -1, new_indices[links], -1).astype(numpy.int32)
+        self.links = array.array('i', links.tostring())
+        
+        # Move the next layer down into columns whose lowest layer was removed.
+        columns = self.get_array('columns', numpy.int32)
+        indexed = columns != -1
+        columns[indexed] = new_indices[columns[indexed]]
+        
+        for cell, layers in self.layers.items():
+            layers = [int(new_indices[index]) for index in layers if keep[index]]
+            if self.columns[cell] == -1 and len(layers) > 0:
+                self.columns[cell] = layers.pop(0)
+            
+            if len(layers) > 0:
+                self.layers[cell] = layers
+            else:
+                del self.layers[cell]
+        
+        return new_indices
+    
+    
+    def get_memory_size(self):
+        """
+        Returns the number of bytes that the arrays and column index of this grid take up in memory.
+        """
+        
+        size = sys.getsizeof(self.links) + sys.getsizeof(self.columns) + sys.getsizeof(self.layers)
+        for name, _, _ in CompactGrid.ELEMENT_ARRAYS:
+            size += sys.getsizeof(getattr(self, name))
+        for cell, layers in self.layers.iteritems():
+            size += sys.getsizeof(cell) + sys.getsizeof(layers)
+        
+        return size
+    
+    
+    def get_element_size(self):
+        """
+        Returns the average number of bytes that an element takes up in memory, see ELEMENT_SIZE_TARGET.
+        """
+        
+        if len(self) == 0:
+            return 0.0
+        
+        return float(self.get_memory_size()) / len(self)
+    
+    
+    def write(self, filename, codec=None, level=6):
+        """
+        Writes this grid to a file, optionally compressed.
+        
+        Planes are stored as the index of the sector that they are the floor plane of, plus one. 0 means no plane.
+        Elements are converted to file records in chunks, so that the records of all elements never need to be in
+        memory at once.
+        
+        @param codec: the name of the codec to compress the file with, or None to write an uncompressed file.
+        @param level: the compression level or preset.
+        """
+        
+        count = len(self)
+        x = self.get_array('x', numpy.int16)
+        y = self.get_array('y', numpy.int16)
+        z = self.get_array('z', numpy.float64)
+        flags = self.get_array('flags', numpy.uint8)
+        plane = self.get_array('plane', numpy.int32)
+        special_sector = self.get_array('special_sector', numpy.int32)
+        links = self.get_array('links', numpy.int32).reshape((count, 4))
+        
+        with compressedfile.open_write(filename, codec, level) as f:
+            f.write(CompactGrid.FILE_HEADER.pack(CompactGrid.FILE_ID, CompactGrid.FILE_VERSION, count))
+            
+            for start in xrange(0, count, CompactGrid.FILE_CHUNK_SIZE):
+                end = min(count, start + CompactGrid.FILE_CHUNK_SIZE)
+                records = numpy.empty(end - start, dtype=CompactGrid.FILE_ELEMENT)
+                records['x'] = x[start:end]
+                records['y'] = y[start:end]
+                records['z'] = z[start:end]
+                records['plane'] = plane[start:end] + 1
+                records['special_sector'] = special_sector[start:end]
+                records['flags'] = flags[start:end]
+                records['elements'] = links[start:end]
+                f.write(records.tostring())
+    
+    
+    def read(self, filename, map_data):
+        """
+        Reads a grid file from disk, replacing the elements of this grid. Compressed grid files are decompressed while
+        reading.
+        
+        @return: True if the grid was read, False if the file is not a supported grid file.
+        """
+        
+        with compressedfile.open_read(filename) as f:
+            file_id, version, element_count = CompactGrid.FILE_HEADER.unpack(f.read(CompactGrid.FILE_HEADER.size))
+            
+            # Validate header.
+            if file_id != CompactGrid.FILE_ID:
+                print 'Invalid grid file.'
+                return False
+            if version != CompactGrid.FILE_VERSION:
+                print 'Unsupported grid version {}'.format(version)
+                return False
+            
+            # Read records in chunks, so that compressed files are decompressed a part at a time.
+            records = numpy.empty(element_count, dtype=CompactGrid.FILE_ELEMENT)
+            for start in xrange(0, element_count, CompactGrid.FILE_CHUNK_SIZE):
+                end = min(element_count, start + CompactGrid.FILE_CHUNK_SIZE)
+                data = f.read((end - start) * CompactGrid.FILE_ELEMENT.itemsize)
+                records[start:end] = numpy.frombuffer(data, dtype=CompactGrid.FILE_ELEMENT, count=end - start)
+        
+        if map_data is not self.map_data:
+            self.setup(map_data, self.left, self.top, self.left + self.width - 1, self.top + self.height - 1)
+        
+        # Planes must be the floor plane of a sector.
+        plane = records['plane'].astype(numpy.int64) - 1
+        plane_sectors = numpy.array(self.plane_sectors + [-1], dtype=numpy.int32)
+        plane[(plane < 0) | (plane >= len(self.plane_sectors))] = len(self.plane_sectors)
+        plane = plane_sectors[plane]
+        for index in numpy.flatnonzero((plane == -1) & (records['plane'] != 0)).tolist():
+            record = records[index]
+            print 'Cannot find sector floor plane at element coordinates {}.'.format(Vector3(record['x'], record['y'], record['z']))
+        
+        self.x = array.array('h', records['x'].astype(numpy.int16).tostring())
+        self.y = array.array('h', records['y'].astype(numpy.int16).tostring())
+        self.z = array.array('d', records['z'].astype(numpy.float64).tostring())
+        self.flags = array.array('B', records['flags'].astype(numpy.uint8).tostring())
+        self.plane = array.array('i', plane.tostring())
+        self.special_sector = array.array('i', records['special_sector'].astype(numpy.int32).tostring())
+        self.links = array.array('i', records['elements'].astype(numpy.int32).tostring())
+        
+        # Index the elements in file order, so that elements at the same position replace each other like they did
+        # when they were added.
+        left, top = self.left, self.top
+        right, bottom = left + self.width - 1, top + self.height - 1
+        if element_count > 0:
+            x, y = records['x'], records['y']
+            if len(self.columns) == 0:
+                left, top, right, bottom = int(x.min()), int(y.min()), int(x.max()), int(y.max())
+            else:
+                left, top = min(left, int(x.min())), min(top, int(y.min()))
+                right, bottom = max(right, int(x.max())), max(bottom, int(y.max()))
+        
+        self.columns = array.array('i')
+        self.layers = {}
+        self.set_bounds(left, top, right, bottom)
+        for index in xrange(element_count):
+            self.add_to_column(index)
+        
+        return True
@@ -10,6 +10,14 @@ class ThingDef(object):
         self.radius = radius
         self.height = height
         self.flags = flags
+        
+        
+    def is_hanging(self):
+        """
+        Returns True if things of this type hang from the ceiling.
+        """
+        
+        return (self.flags & DEF_FLAG_HANGING) != 0
 
 
 class Config(object):
@@ -1,24 +1,9 @@
-from util.vector import Vector3
-
-
 class Element(object):
     """
-    A single square grid element on a map that the player can stand at.
-    """
-    
-    __slots__ = (
-        'pos',
-        'plane',
-        'special_sector',
-        'flags',
-        
-        'elements',
-        'area',
-        'connection',
-        
-        'index'
-    )
+    Constants for the square grid elements on a map that the player can stand at.
     
+    Elements themselves are stored in the typed arrays of a CompactGrid, and are referred to by their index.
+    """
     
     # Element connection direction.
     DIR_UP = 0
@@ -35,44 +20,3 @@ class Element(object):
     FLAG_JUMP_EAST = 0x0010
     FLAG_JUMP_SOUTH = 0x0020
     FLAG_JUMP_WEST = 0x0040
-
-    
-    def __init__(self, x, y, z):
-        # Absolute position on the map.
-        self.pos = Vector3(x, y, z)
-        
-        # A plane that is linked to this element.
-        self.plane = None
-        
-        # A sector that is linked to this element.
-        self.special_sector = None
-        
-        # FLags describing this element's properties.
-        self.flags = 0
-        
-        # Elements that this element is connected to.
-        self.elements = [None] * 4
-        
-        # The navigation area that this element belongs to.
-        self.area = None
-        
-        # Used internally to keep references to NavConnection objects during mesh generation.
-        self.connection = [None] * 4
-        
-        # The index of this element, used for reading and writing.
-        self.index = -1
-        
-        
-    def __repr__(self):
-        return 'element {}, flags {}, sector {}, plane {}'.format(self.pos, self.flags, self.special_sector, self.plane)
-   
-    
-    def is_similar(self, other):
-        """
-        Returns True if this element is similar, but not necessarily equal to, another element. Returns False otherwise.
-        """
-               
-        if self.plane is not None or other.plane is not None:
-            return self.special_sector == other.special_sector and self.flags == other.flags and self.plane == other.plane
-        else:
-            return self.special_sector == other.special_sector and self.flags == other.flags and self.pos.z == other.pos.z
\ No newline at end of file
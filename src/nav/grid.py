@@ -1,8 +1,13 @@
 from doom.map.objects import Sector, Teleporter
-from nav.collider import Collider
+from nav.collider import Collider, PositionResults
+from nav.compactgrid import CompactGrid
 from nav.element import Element
+from util.rectangle import Rectangle
 from util.vector import Vector3, Vector2
-import struct
+import math
+import multiprocessing
+import os
+import sys
 
 
 class Grid(object):
@@ -10,12 +15,6 @@ class Grid(object):
     A grid of elements, describing where a player can walk on the map.
     """
     
-    # Grid file structures.
-    FILE_ID = 'DPGRID'
-    FILE_VERSION = 1
-    FILE_HEADER = struct.Struct('<6sII')
-    FILE_ELEMENT = struct.Struct('<hhhiiiiiii')
-    
     # Grid collision reasons.
     REASON_NONE = 0
     REASON_BLOCK_LINE = 1
@@ -27,12 +26,19 @@ class Grid(object):
     REASON_TOO_HIGH = 7
     REASON_LEAK = 8
     
+    # Element jump flags for each direction.
+    JUMP_FLAGS = [Element.FLAG_JUMP_NORTH, Element.FLAG_JUMP_EAST, Element.FLAG_JUMP_SOUTH, Element.FLAG_JUMP_WEST]
+    
+    # The number of elements around a changed map region that are flooded again when updating a grid.
+    UPDATE_MARGIN = 2
+    
     
     def __init__(self):
         self.config = None
         self.map_data = None
         
-        # The size of a single element.
+        # The size of a single element, and the resolution it was derived from.
+        self.resolution = 1
         self.element_size = 0
         self.element_height = 0
 
@@ -43,20 +49,26 @@ class Grid(object):
         self.collider = None
         
         # All elements in this grid.
-        self.elements = []
+        self.elements = CompactGrid()
         
-        # A list of elements that still need to be examined.
+        # A list of the indices of elements that still need to be examined.
         self.element_tasks = []
         
-        # A (x + y * width) positional dictionary with element lists.
-        self.element_hash = {}
-        
-        # A set of elements that need to be pruned when calling remove_pruned_elements.
+        # A set of the indices of elements that need to be pruned when calling remove_pruned_elements.
         self.element_prune = set()
         
         # The map position currently being examined for collision.
         self.check_pos = Vector3()
         
+        # Collision test results from tile workers, a PositionResults object.
+        self.collision_results = None
+        
+        # Parallel tile flooding state. Collision test results are logged, and elements that fall outside of the
+        # tile rectangle are added to the frontier list instead of to the grid.
+        self.collision_log = None
+        self.tile = None
+        self.frontier = None
+        
         
     def add_walkable_element(self, pos2):
         """
@@ -72,9 +84,9 @@ class Grid(object):
         self.set_element_properties(sector_index, element)
         
         if (sector.flags & Sector.FLAG_FLOOR_MOVES) != 0:
-            element.special_sector = sector_index
+            self.elements.special_sector[element] = sector_index
         if (sector.flags & Sector.FLAG_CEILING_MOVES) != 0:
-            element.special_sector = sector_index
+            self.elements.special_sector[element] = sector_index
         
         # Schedule for examination.
         self.element_tasks.append(element)
@@ -84,21 +96,10 @@ class Grid(object):
         """
         Adds a new element at a specific location in the grid.
         
-        @return: the new Element object.
+        @return: the index of the new element.
         """
         
-        element = Element(x, y, z)
-
-        element_hash = x + (y * self.size.x)
-        elements = self.element_hash.get(element_hash)
-        if elements is None:
-            elements = {}
-            self.element_hash[element_hash] = elements
-        elements[z] = element
-        
-        self.elements.append(element)
-        
-        return element
+        return self.elements.add_element(x, y, z)
     
     
     def place_starts(self):
@@ -106,6 +107,22 @@ class Grid(object):
         Place elements at starting thing locations.
         """
         
+        start_positions, start_thing_count = self.get_start_positions()
+        for pos in start_positions:
+            self.add_walkable_element(pos)
+        
+        print 'Added {} starting elements.'.format(start_thing_count)
+    
+    
+    def get_start_positions(self):
+        """
+        Returns the map positions of starting things and teleporter destinations that the player can stand at.
+        
+        @return: a list of Vector3 map positions, and the number of starting things.
+        """
+        
+        start_positions = []
+        
         # Create a list of things that the grid generation starts at.
         start_things = []
         for thing_type in self.config.start_thing_types:
@@ -123,7 +140,7 @@ class Grid(object):
                 print 'Thing at {} has no room to spawn, ignoring.'.format(pos)
                 continue
             
-            self.add_walkable_element(pos)
+            start_positions.append(pos)
         
         # Add teleporter destinations as starting elements.
         for teleporter in self.map_data.teleporters:
@@ -142,162 +159,74 @@ class Grid(object):
                 print 'Teleporter destination at {} has no room to spawn, ignoring.'.format(dest)
                 continue
             
-            self.add_walkable_element(dest)
+            start_positions.append(dest)
         
-        print 'Added {} starting elements.'.format(len(start_things))
+        return start_positions, len(start_things)
     
     
     def remove_pruned_elements(self):
         """
         Remove elements from the elements_prune set from the element list.
-        """
         
-        # Filter prune elements from the element list.
-        self.elements = filter(lambda element: element not in self.element_prune, self.elements)
+        The remaining elements are renumbered, element tasks are renumbered along with them.
         
-        # Remove pruned elements from the element hash table.
-        for element in self.element_prune:
-            element_hash = element.pos.x + (element.pos.y * self.size.x)
-            elements = self.element_hash.get(element_hash)
-            if elements is None:
-                return
-                
-            del elements[element.pos.z]
-            if len(elements) == 0:
-                del self.element_hash[element_hash]
-                
-        # Remove the now invalid element connections.
-        for element in self.elements:
-            for direction in Element.DIR_RANGE:
-                if element.elements[direction] in self.element_prune:
-                    element.elements[direction] = None
+        @return: an array of the new index of every old element, or -1 for removed elements.
+        """
         
-        self.element_prune.clear() 
+        new_indices = self.elements.remove_elements(self.element_prune)
+        self.element_prune.clear()
+        
+        tasks = [new_indices[element] for element in self.element_tasks]
+        self.element_tasks = [int(element) for element in tasks if element != -1]
+            
+        return new_indices
                 
     
-    def write(self, filename):
+    def write(self, filename, codec=None, level=6):
         """
         Writes this grid to a file.
-        """
         
-        # Assign element indices.
-        for index, element in enumerate(self.elements):
-            element.index = index
+        @param codec: the name of the codec to compress the file with, or None to write an uncompressed file.
+        @param level: the compression level or preset.
+        """
         
-        with open(filename, 'wb') as f:            
-            header = Grid.FILE_HEADER.pack(Grid.FILE_ID, Grid.FILE_VERSION, len(self.elements))
-            f.write(header)
-
-            indices = [0] * 4            
-            for element in self.elements:
-                if element.plane is None:
-                    plane_hash = 0
-                else:
-                    plane_hash = hash(element.plane)
-            
-                # Gather indices for each element's direction and write it as a single struct.    
-                for direction in Element.DIR_RANGE:
-                    if element.elements[direction] is None:
-                        indices[direction] = -1
-                    else:
-                        indices[direction] = element.elements[direction].index
-                    
-                    if element.special_sector is None:
-                        special_sector = -1
-                    else:
-                        special_sector = element.special_sector
-                        
-                element_data = self.FILE_ELEMENT.pack(element.pos.x, element.pos.y, element.pos.z, plane_hash, special_sector, element.flags, indices[0], indices[1], indices[2], indices[3])
-                f.write(element_data)
+        self.elements.write(filename, codec, level)
            
                 
     def read(self, filename, map_data):
         """
         Reads a grid file from disk.
+        
+        @return: True if the grid was read, False if the file is not a supported grid file.
         """
         
         self.map_data = map_data
         
-        with open(filename, 'rb') as f:
-            file_id, version, element_count = Grid.FILE_HEADER.unpack(f.read(Grid.FILE_HEADER.size))
-            
-            # Validate header.
-            if file_id != Grid.FILE_ID:
-                print 'Invalid grid file.'
-                return
-            if version != Grid.FILE_VERSION:
-                print 'Unsupported grid version {}'.format(version)
-                return
-            
-            self.elements = []
-            for _ in range(element_count):
-                element = Element(0, 0, 0)
-                data = Grid.FILE_ELEMENT.unpack(f.read(Grid.FILE_ELEMENT.size))
-                
-                element.pos.x = data[0]
-                element.pos.y = data[1]
-                element.pos.z = data[2]
-                plane_hash = data[3]
-                element.special_sector = data[4]
-                element.flags = data[5]
-                element.elements[0] = data[6]
-                element.elements[1] = data[7]
-                element.elements[2] = data[8]
-                element.elements[3] = data[9]
-                
-                # Find matching planes in sectors.
-                for sector in self.map_data.sectors:
-                    if hash(sector.floor_plane) == plane_hash:
-                        element.plane = sector.floor_plane
-                        break
-                else:
-                    print 'Cannot find sector floor plane at element coordinates {}.'.format(element.pos)
-                
-                if element.special_sector == -1:
-                    element.special_sector = None
-                
-                self.elements.append(element)
-
-        # Set element references from stored indices.
-        for element in self.elements:
-            for direction in Element.DIR_RANGE:
-                if element.elements[direction] != -1:
-                    element.elements[direction] = self.elements[element.elements[direction]]
-                else:
-                    element.elements[direction] = None
-            
-        # Rebuild element position hash.
-        for element in self.elements:
-            element_hash = element.x + (element.y * self.width)
-            elements = self.element_hash.get(element_hash)
-            if elements is None:
-                elements = {}
-                self.element_hash[element_hash] = elements
-            elements[element.z] = element 
+        if self.elements.read(filename, map_data) == False:
+            return False
+        
+        if self.size is None:
+            self.size = Vector2(self.elements.width, self.elements.height)
+        
+        return True
             
     
     def get_element_xyz(self, x, y, z):
         """
-        Returns an element at the x,y,z coordinates, or None if no element exists at
+        Returns the index of the element at the x,y,z coordinates, or None if no element exists at
         those coordinates.
         """
         
-        element_hash = x + (y * self.size.x)
-        elements = self.element_hash.get(element_hash)
-        if elements is not None:
-            return elements.get(z)
-
-        return None
+        return self.elements.get_element_xyz(x, y, z)
     
     
     def get_element_list(self, pos2):
         """
-        Returns a list of elements at the 2d coordinates, or None if no list exists at
-        those coordinates.
+        Returns a list of the indices of the elements at the 2d coordinates in ascending z order, or None if no list
+        exists at those coordinates.
         """
         
-        element_hash = pos2.x + (pos2.y * self.size.x)
-        return self.element_hash.get(element_hash)
+        return self.elements.get_element_list(pos2)
         
 
     def map_to_element(self, pos2):
@@ -316,14 +245,14 @@ class Grid(object):
         return ((pos2.x * self.element_size) - (self.element_size / 2), (pos2.y * self.element_size) - (self.element_size / 2))
 
     
-    def create(self, config, map_data, resolution):
+    def setup(self, config, map_data, resolution):
         """
-        Traverse the map, starting at already placed starting elements, and place elements where a
-        player can walk.
+        Prepares this grid for placing elements on a map.
         """
         
         self.config = config
         self.map_data = map_data
+        self.resolution = resolution
         
         self.element_size = config.player_radius / resolution
         self.element_height = config.player_height
@@ -331,24 +260,194 @@ class Grid(object):
         self.size = Vector2(self.map_data.size.x / self.element_size, self.map_data.size.y / self.element_size)        
         self.collider = Collider(map_data, config)
         
+        self.elements = self.create_elements()
+        
+        # Element centers and the corners of their collision boxes all lie on a lattice with element size spacing.
+        # Cache the sectors on that lattice, unless the map data arrived with one already.
+        raster = self.map_data.sector_raster
+        if raster is None or raster.spacing != self.element_size:
+            self.map_data.build_sector_raster(self.element_size, -(self.element_size / 2), self.element_size * 2)
+    
+    
+    def create_elements(self):
+        """
+        Returns a new empty CompactGrid, with a column index of the whole map and a border of leaking elements around
+        it.
+        """
+        
+        left = self.map_data.min.x / self.element_size
+        top = self.map_data.min.y / self.element_size
+        
+        elements = CompactGrid()
+        elements.setup(self.map_data, left, top, left + self.size.x + 2, top + self.size.y + 2)
+        
+        return elements
+    
+    
+    def create(self, config, map_data, resolution, jobs=1):
+        """
+        Traverse the map, starting at already placed starting elements, and place elements where a
+        player can walk.
+        
+        @param jobs: the number of processes to flood the map with. If more than 1, the map is split into tiles that
+                     are flooded in parallel first, and the collision test results of those are reused while
+                     placing elements in the same order as a single process would. This trades memory for time:
+                     every worker holds a copy of the collision parts of the map data, and the results of all
+                     tiles are kept until the elements are placed, at 37 bytes per tested position.
+        """
+        
+        self.setup(config, map_data, resolution)
+        
         # Place starting elements.
         self.place_starts()
         
-        # Keep testing elements until the task list is empty.
+        if jobs > 1:
+            self.collision_results = self.flood_tiles(jobs)
+        
+        try:
+            self.process_tasks()
+        finally:
+            self.collision_results = None
+        
+        # The flood fill is done, the sector raster is no longer needed.
+        self.map_data.release_sector_raster()
+        
+        element_size = self.elements.get_element_size()
+        if element_size > CompactGrid.ELEMENT_SIZE_TARGET:
+            print 'Warning: grid elements take up {:.1f} bytes each, more than the target of {} bytes.'.format(element_size, CompactGrid.ELEMENT_SIZE_TARGET)
+        else:
+            print 'Grid elements take up {:.1f} bytes each.'.format(element_size)
+        
+        z_cache = self.collider.z_cache
+        print 'Sloped sector height cache: {} lookups, {:.1f}% hits.'.format(z_cache.hits + z_cache.misses, z_cache.get_hit_rate() * 100)
+        
+    
+    def update(self, bounds):
+        """
+        Floods the part of this grid around a changed map region again.
+        
+        Elements inside the region and a margin around it are removed. Flooding then restarts from the elements that
+        led into the region, and from starting positions inside it. Elements that can no longer be reached from any
+        starting position are removed afterwards.
+        
+        The result can differ from flooding the changed map completely, because elements are found in a different
+        order. The links and jump flags that are set depend on that order, and elements outside the region keep the
+        ones from the previous run.
+        
+        @param bounds: a Rectangle of the changed map region, in map coordinates.
+        
+        @return: a Rectangle of the element coordinates that were flooded again, inclusive.
+        """
+        
+        x1, y1 = self.map_to_element(bounds.p1)
+        x2, y2 = self.map_to_element(bounds.p2)
+        rect = Rectangle(x1 - Grid.UPDATE_MARGIN, y1 - Grid.UPDATE_MARGIN, x2 + Grid.UPDATE_MARGIN, y2 + Grid.UPDATE_MARGIN)
+        
+        # Remove the elements inside the region.
+        elements = self.elements
+        for element in xrange(len(elements)):
+            x = elements.x[element]
+            y = elements.y[element]
+            if x >= rect.left and x <= rect.right and y >= rect.top and y <= rect.bottom:
+                self.element_prune.add(element)
+        
+        # Elements that lead into the region are tested again in the directions that they did.
+        links = elements.links
+        for element in xrange(len(elements)):
+            if element in self.element_prune:
+                continue
+            
+            for direction in Element.DIR_RANGE:
+                if links[element * 4 + direction] in self.element_prune:
+                    elements.flags[element] &= ~Grid.JUMP_FLAGS[direction]
+                    if len(self.element_tasks) == 0 or self.element_tasks[-1] != element:
+                        self.element_tasks.append(element)
+        
+        removed = len(self.element_prune)
+        self.remove_pruned_elements()
+        
+        # Start again from starting positions that are inside the region.
+        start_positions, _ = self.get_start_positions()
+        for pos in start_positions:
+            x, y = self.map_to_element(pos)
+            if rect.is_point_inside(Vector2(x, y)) and self.get_element_xyz(x, y, pos.z) is None:
+                self.add_walkable_element(pos)
+        
+        count = len(self.elements)
+        self.process_tasks()
+        added = len(self.elements) - count
+        
+        unreachable = self.prune_unreachable(start_positions)
+        self.map_data.release_sector_raster()
+        print 'Removed {} elements, added {} elements and pruned {} unreachable elements.'.format(removed, added, unreachable)
+        
+        return rect
+    
+    
+    def prune_unreachable(self, start_positions):
+        """
+        Removes elements that cannot be reached from any starting position.
+        
+        @param start_positions: a list of Vector3 starting map positions, see get_start_positions.
+        
+        @return: the number of elements that were removed.
+        """
+        
+        # Follow element connections from all starting elements.
+        reachable = set()
+        tasks = []
+        for pos in start_positions:
+            x, y = self.map_to_element(pos)
+            element = self.get_element_xyz(x, y, pos.z)
+            if element is not None and element not in reachable:
+                reachable.add(element)
+                tasks.append(element)
+        
+        links = self.elements.links
+        while len(tasks) > 0:
+            element = tasks.pop()
+            for other in links[element * 4:element * 4 + 4]:
+                if other != -1 and other not in reachable:
+                    reachable.add(other)
+                    tasks.append(other)
+        
+        for element in xrange(len(self.elements)):
+            if element not in reachable:
+                self.element_prune.add(element)
+        
+        count = len(self.element_prune)
+        self.remove_pruned_elements()
+        
+        return count
+    
+    
+    def process_tasks(self, tasks=None):
+        """
+        Keeps testing elements until the task list is empty.
+        
+        @param tasks: a list of element indices to test instead of the task list. New elements are still added to
+                      the task list.
+        """
+        
+        if tasks is None:
+            tasks = self.element_tasks
+        
         pos = Vector3()
+        elements = self.elements
+        xs, ys, zs, links = elements.x, elements.y, elements.z, elements.links
         while 1:
-            if len(self.element_tasks) == 0:
+            if len(tasks) == 0:
                 break
-            element = self.element_tasks.pop()
+            element = tasks.pop()
             
-            if len(self.elements) % 5000 == 0:
-                print '{} elements, {} tasks left...'.format(len(self.elements), len(self.element_tasks))
+            if len(elements) % 5000 == 0:
+                print '{} elements, {} tasks left...'.format(len(elements), len(tasks))
             
             # Test each direction for walkability.
             for direction in Element.DIR_RANGE:
-                pos.x = element.pos.x
-                pos.y = element.pos.y
-                pos.z = element.pos.z
+                pos.x = xs[element]
+                pos.y = ys[element]
+                pos.z = zs[element]
                 
                 if direction == Element.DIR_UP:
                     pos.y -= 1
@@ -365,10 +464,10 @@ class Grid(object):
                     
                     # If not, test if an element can be placed there.
                     reason, new_element = self.test_element(pos, direction, element)
-                    if reason != Grid.REASON_NONE:
+                    if reason != Grid.REASON_NONE or new_element is None:
                         continue
                     
-                element.elements[direction] = new_element
+                links[element * 4 + direction] = new_element
 
         
     def test_element(self, pos3, direction, element):
@@ -377,7 +476,7 @@ class Grid(object):
         
         @param pos: the 3d map position to test.
         @param direction: the direction of the new element relative to it's previous element.
-        @param element: the previous origin element. 
+        @param element: the index of the previous origin element.
         """
         
         map_x, map_y = self.element_to_map(pos3)
@@ -390,7 +489,7 @@ class Grid(object):
         check_pos.x = map_x
         check_pos.y = map_y
         check_pos.z = pos3.z
-        collision, state = self.collider.check_position(check_pos, self.element_size, self.element_height)
+        collision, state = self.check_position(check_pos)
         
         # Ignore sectors flagged as such.
         if state.special_sector is not None:
@@ -421,7 +520,7 @@ class Grid(object):
                     return Grid.REASON_TOO_HIGH, None
                 
         # Steep slopes cannot be walked up, only down.
-        if state.steep == True and state.floorz > element.pos.z:
+        if state.steep == True and state.floorz > self.elements.z[element]:
             return Grid.REASON_SLOPE_TOO_STEEP, None
         
         # Snap to moving sector floor.
@@ -430,14 +529,7 @@ class Grid(object):
         
         # Set origin element jumping flags.
         if jump == True:
-            if direction == Element.DIR_UP:
-                element.flags |= Element.FLAG_JUMP_NORTH
-            elif direction == Element.DIR_RIGHT:
-                element.flags |= Element.FLAG_JUMP_EAST
-            elif direction == Element.DIR_DOWN:
-                element.flags |= Element.FLAG_JUMP_SOUTH
-            elif direction == Element.DIR_LEFT:
-                element.flags |= Element.FLAG_JUMP_WEST
+            self.elements.flags[element] |= Grid.JUMP_FLAGS[direction]
         
         # Drop to the lowest floor.
         check_pos.z = min(check_pos.z, state.floorz)
@@ -453,24 +545,228 @@ class Grid(object):
         new_element = self.get_element_xyz(new_pos[0], new_pos[1], check_pos.z)
         if new_element is None:
             
+            # Leave elements outside of the tile being flooded to the tile that they are in.
+            if self.tile is not None:
+                x, y = new_pos
+                if x < self.tile[0] or y < self.tile[1] or x > self.tile[2] or y > self.tile[3]:
+                    self.frontier.append((x, y, check_pos.z))
+                    return Grid.REASON_NONE, None
+            
             new_element = self.add_element_xyz(new_pos[0], new_pos[1], check_pos.z)
             
             # Set new element properties to match collision results.
             if state.special_sector is not None:
                 self.set_element_properties(state.special_sector, new_element)
             if state.floor_plane is not None:
-                new_element.plane = state.floor_plane                
-            if state.floor_moves == True or state.ceiling_moves == True:
-                new_element.special_sector = state.special_sector
+                self.elements.set_plane_sector(new_element, state.floor_plane_sector)
+            if (state.floor_moves == True or state.ceiling_moves == True) and state.special_sector is not None:
+                self.elements.special_sector[new_element] = state.special_sector
             
             self.element_tasks.append(new_element)
             
         return Grid.REASON_NONE, new_element
             
             
+    def check_position(self, pos3):
+        """
+        Tests an element sized box at a map position for collision.
+        
+        @return: the collision value and the collider state, see Collider.check_position.
+        """
+        
+        if self.collision_results is not None:
+            index = self.collision_results.find(pos3.x, pos3.y, pos3.z)
+            if index != -1:
+                state = self.collider.state
+                state.pos.copy_from(pos3)
+                return self.collision_results.restore(index, state, self.map_data), state
+        
+        collision, state = self.collider.check_position(pos3, self.element_size, self.element_height)
+        if self.collision_log is not None:
+            self.collision_log.add(pos3, collision, state)
+        
+        return collision, state
+    
+    
+    def test_task_positions(self):
+        """
+        Tests the positions next to all elements in the task list for collision at once, and logs the results.
+        
+        Only the positions that test_element will check first are tested, at the z of the element they are next to.
+        Positions where an element already exists, that leak out of the map or that were tested before are skipped.
+        """
+        
+        # Keep local references as optimization.
+        elements = self.elements
+        xs, ys, zs = elements.x, elements.y, elements.z
+        get_element_xyz = elements.get_element_xyz
+        log = self.collision_log
+        element_size = self.element_size
+        half_size = element_size / 2
+        min_x = self.map_data.min.x
+        min_y = self.map_data.min.y
+        max_x = self.map_data.max.x
+        max_y = self.map_data.max.y
+        
+        positions = set()
+        for element in self.element_tasks:
+            x = xs[element]
+            y = ys[element]
+            z = zs[element]
+            for pos_x, pos_y in ((x, y - 1), (x + 1, y), (x, y + 1), (x - 1, y)):
+                map_x = pos_x * element_size - half_size
+                map_y = pos_y * element_size - half_size
+                if map_x < min_x or map_x > max_x or map_y < min_y or map_y > max_y:
+                    continue
+                
+                if log.find(map_x, map_y, z) == -1 and get_element_xyz(pos_x, pos_y, z) is None:
+                    positions.add((map_x, map_y, z))
+        
+        if len(positions) == 0:
+            return
+        
+        positions = list(positions)
+        log.add_batch(positions, self.collider.check_positions(positions, self.element_size, self.element_height))
+    
+    
+    def flood_tiles(self, jobs):
+        """
+        Floods the map in tiles, with each tile being processed in a separate process.
+        
+        Each tile is flooded from the seed elements that lie inside it. Elements that are found outside of a tile
+        become seeds for the tile they are in, and tiles are flooded again until no new seeds are found. The
+        elements found this way are not used directly, because the elements and links that are placed depend on the
+        order in which they are found. Instead the collision test results of all tiles are returned, so that
+        placing the elements in order needs only few collision tests of its own.
+        
+        @param jobs: the number of processes to use.
+        
+        @return: a sorted PositionResults object of the collision test results.
+        """
+        
+        # Split the element grid into at least as many tiles as there are processes.
+        tile_rows = int(math.ceil(math.sqrt(jobs)))
+        tile_width = (self.size.x + 2) / tile_rows + 1
+        tile_height = (self.size.y + 2) / tile_rows + 1
+        origin_x = self.map_data.min.x / self.element_size
+        origin_y = self.map_data.min.y / self.element_size
+        
+        # The outer tiles extend outwards without limit, to hold any elements that leak out of the map.
+        tiles = []
+        for tile_y in range(tile_rows):
+            for tile_x in range(tile_rows):
+                left = origin_x + tile_x * tile_width
+                top = origin_y + tile_y * tile_height
+                right = left + tile_width - 1
+                bottom = top + tile_height - 1
+                if tile_x == 0:
+                    left = -sys.maxint
+                if tile_y == 0:
+                    top = -sys.maxint
+                if tile_x == tile_rows - 1:
+                    right = sys.maxint
+                if tile_y == tile_rows - 1:
+                    bottom = sys.maxint
+                tiles.append((left, top, right, bottom))
+        
+        def get_tile_index(pos):
+            tile_x = min(max((pos[0] - origin_x) / tile_width, 0), tile_rows - 1)
+            tile_y = min(max((pos[1] - origin_y) / tile_height, 0), tile_rows - 1)
+            return tile_x + tile_y * tile_rows
+        
+        # The starting elements are the first seeds.
+        known = [set() for _ in tiles]
+        seeds = [set() for _ in tiles]
+        elements = self.elements
+        for element in xrange(len(elements)):
+            pos = (elements.x[element], elements.y[element], elements.z[element])
+            seeds[get_tile_index(pos)].add(pos)
+        
+        # Workers only get the parts of the map that collision tests need.
+        pool = multiprocessing.Pool(jobs, init_tile_worker, (self.config, self.map_data.get_collision_data(), self.resolution))
+        
+        results = PositionResults(False)
+        passes = 0
+        while 1:
+            tile_indices = [index for index, tile_seeds in enumerate(seeds) if len(tile_seeds) > 0]
+            if len(tile_indices) == 0:
+                break
+            passes += 1
+            
+            tile_jobs = [(tiles[index], list(seeds[index]), list(known[index])) for index in tile_indices]
+            seeds = [set() for _ in tiles]
+            for index, (collision_log, found, frontier) in zip(tile_indices, pool.map(flood_tile_job, tile_jobs)):
+                results.extend(collision_log)
+                known[index].update(found)
+                
+                # Exchange elements across tile seams.
+                for pos in frontier:
+                    tile_index = get_tile_index(pos)
+                    if pos not in known[tile_index]:
+                        seeds[tile_index].add(pos)
+        
+        pool.close()
+        pool.join()
+        
+        results.sort()
+        print 'Flooded {} tiles in {} passes, {} collision test results in {:.1f} MB.'.format(len(tiles), passes, len(results), results.get_memory_size() / 1048576.0)
+        
+        return results
+    
+    
+    def flood_tile(self, tile, seeds, known):
+        """
+        Floods a single tile from seed elements. The positions next to each wave of new elements are tested for
+        collision together, with Collider.check_positions.
+        
+        @param tile: a (left, top, right, bottom) tuple of the element coordinates of the tile, inclusive.
+        @param seeds: a list of (x, y, z) element positions to start flooding from.
+        @param known: a list of (x, y, z) element positions in the tile that were found in earlier passes.
+        
+        @return: a tuple of the collision test results, a list of new element positions found in this tile and a list
+                 of element positions found outside of this tile.
+        """
+        
+        self.elements = self.create_elements()
+        self.element_tasks = []
+        self.collision_log = PositionResults()
+        self.tile = tile
+        self.frontier = []
+        
+        for x, y, z in known:
+            self.add_element_xyz(x, y, z)
+        known_count = len(self.elements)
+        
+        for x, y, z in seeds:
+            if self.get_element_xyz(x, y, z) is None:
+                self.element_tasks.append(self.add_element_xyz(x, y, z))
+        
+        # Flood in waves. The positions next to all elements of a wave are tested at once, and the elements that
+        # they add form the next wave.
+        self.collision_results = self.collision_log
+        while len(self.element_tasks) > 0:
+            self.test_task_positions()
+            tasks = self.element_tasks
+            self.element_tasks = []
+            self.process_tasks(tasks)
+        
+        elements = self.elements
+        found = [(elements.x[element], elements.y[element], elements.z[element]) for element in xrange(known_count, len(elements))]
+        
+        # Only the result arrays are sent back, without their dict of indices.
+        collision_log = self.collision_log
+        collision_log.sort()
+        self.collision_log = None
+        self.collision_results = None
+        
+        return collision_log, found, self.frontier
+    
+    
     def set_element_properties(self, sector_index, element):
         """
         Sets an element's properties (but not flags) from sector flags.
+        
+        @param element: the index of the element.
         """
         
         sector = self.map_data.sectors[sector_index]
@@ -478,8 +774,30 @@ class Grid(object):
         # Set sector damage flag.
         if sector.damage > 0:
             if sector.damage <= 5:
-                element.flags |= Element.FLAG_DAMAGE_LOW
+                self.elements.flags[element] |= Element.FLAG_DAMAGE_LOW
             elif sector.damage <= 10:
-                element.flags |= Element.FLAG_DAMAGE_MEDIUM
+                self.elements.flags[element] |= Element.FLAG_DAMAGE_MEDIUM
             elif sector.damage >= 20:
-                element.flags |= Element.FLAG_DAMAGE_HIGH
\ No newline at end of file
+                self.elements.flags[element] |= Element.FLAG_DAMAGE_HIGH
+
+
+# The grid of a tile flooding worker process.
+tile_grid = None
+
+
+def init_tile_worker(config, map_data, resolution):
+    """
+    Initializes a tile flooding worker process.
+    """
+    
+    global tile_grid
+    
+    # Leaks and progress are reported when the elements are placed by the main process.
+    sys.stdout = open(os.devnull, 'w')
+    
+    tile_grid = Grid()
+    tile_grid.setup(config, map_data, resolution)
+
+
+def flood_tile_job(args):
+    return tile_grid.flood_tile(*args)
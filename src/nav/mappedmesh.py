@@ -0,0 +1,201 @@
+from nav.connection import Connection
+from nav.mesh import Mesh
+from util import compressedfile
+import mmap
+import numpy
+import os
+
+
+class MappedMesh(object):
+    """
+    A read-only navigation mesh that is memory mapped from a mesh file.
+    
+    Planes, connections, areas and area connections are NumPy record arrays that are views into the mapped file, using
+    the record types of Mesh. No objects are created per area or connection, so loading takes about as long as mapping
+    the file. Area adjacency is built from the connections the first time it is needed. Call close() to release the
+    mapping. Arrays that were retrieved from this mesh before that keep the mapping alive until they are gone.
+    """
+    
+    def __init__(self):
+        # File object and memory mapping of the mesh file.
+        self.file = None
+        self.mapping = None
+        
+        # The hash of the map that the mesh was generated from.
+        self.data_hash = None
+        
+        # Record array views of each file section.
+        self.planes = None
+        self.connections = None
+        self.areas = None
+        self.area_connections = None
+        
+        # Area adjacency in compressed sparse row form. The areas reachable from area i, and the indices of the
+        # connections leading to them, are at adjacency_starts[i] up to adjacency_starts[i + 1].
+        self.adjacency_starts = None
+        self.adjacency_areas = None
+        self.adjacency_connections = None
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    
+    def read(self, filename):
+        """
+        Memory maps a mesh file. Only uncompressed version 2 mesh files can be mapped.
+        
+        @return: True if the mesh was mapped, False if the file is not a supported mesh file.
+        """
+        
+        self.close()
+        
+        header_size = Mesh.FILE_HEADER.size + Mesh.FILE_SECTIONS.size
+        
+        self.file = open(filename, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < header_size:
+            print 'Invalid mesh file.'
+            self.close()
+            return False
+        
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        # Validate header.
+        file_id, file_version, self.data_hash = Mesh.FILE_HEADER.unpack_from(self.mapping, 0)
+        if file_id.startswith(compressedfile.FILE_ID):
+            print 'Compressed mesh files cannot be memory mapped.'
+            self.close()
+            return False
+        if file_id != Mesh.FILE_ID:
+            print 'Invalid mesh file.'
+            self.close()
+            return False
+        if file_version != Mesh.FILE_VERSION:
+            print 'Unsupported mesh version {}.'.format(file_version)
+            self.close()
+            return False
+        
+        table = Mesh.FILE_SECTIONS.unpack_from(self.mapping, Mesh.FILE_HEADER.size)
+        sections = []
+        for index, dtype in enumerate((Mesh.FILE_PLANE_RECORD, Mesh.FILE_CONNECTION_RECORD, Mesh.FILE_AREA_RECORD,
+                                       Mesh.FILE_AREA_CONNECTION_RECORD)):
+            offset, count = table[index * 2], table[index * 2 + 1]
+            if offset < header_size or offset + count * dtype.itemsize > size:
+                print 'Invalid mesh file.'
+                self.close()
+                return False
+            
+            sections.append(numpy.frombuffer(self.mapping, dtype=dtype, count=count, offset=offset))
+        self.planes, self.connections, self.areas, self.area_connections = sections
+        
+        return True
+    
+    
+    def close(self):
+        """
+        Releases the memory mapping and file handle of this mesh, if it is mapped.
+        
+        The views into the mapping are dropped first. The mapping itself is not closed explicitly, because that would
+        unmap the memory of any array that was retrieved from this mesh and is still in use. Every view holds a
+        reference to the mapping instead, so it is unmapped as soon as the last view is gone.
+        """
+        
+        self.planes = None
+        self.connections = None
+        self.areas = None
+        self.area_connections = None
+        self.adjacency_starts = None
+        self.adjacency_areas = None
+        self.adjacency_connections = None
+        
+        self.mapping = None
+        
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    
+    def check_mapped(self):
+        """
+        Raises an error if this mesh is not mapped.
+        
+        @raise ValueError: if no mesh file was mapped, or this mesh was closed.
+        """
+        
+        if self.mapping is None:
+            raise ValueError('The navigation mesh is not mapped, or has been closed.')
+    
+    
+    def get_area_count(self):
+        """
+        Returns the number of areas in this mesh.
+        """
+        
+        self.check_mapped()
+        return len(self.areas)
+    
+    
+    def get_area_connections(self, area_index):
+        """
+        Returns an array of the indices of the connections of an area.
+        """
+        
+        self.check_mapped()
+        record = self.areas[area_index]
+        start = record['connection_start']
+        
+        return self.area_connections[start:start + record['connection_count']]
+    
+    
+    def build_adjacency(self):
+        """
+        Builds the compressed sparse row adjacency of areas, following the directions that connections allow.
+        """
+        
+        self.check_mapped()
+        
+        area_a = self.connections['area_a']
+        area_b = self.connections['area_b']
+        flags = self.connections['flags']
+        
+        linked = (area_a != -1) & (area_b != -1)
+        ab = numpy.flatnonzero(linked & ((flags & Connection.FLAG_AB) != 0))
+        ba = numpy.flatnonzero(linked & ((flags & Connection.FLAG_BA) != 0))
+        
+        sources = numpy.concatenate((area_a[ab], area_b[ba]))
+        targets = numpy.concatenate((area_b[ab], area_a[ba]))
+        connections = numpy.concatenate((ab, ba)).astype(numpy.int32)
+        
+        # Keep edges from the same area in connection order.
+        order = numpy.argsort(sources, kind='mergesort')
+        
+        starts = numpy.zeros(len(self.areas) + 1, dtype=numpy.int32)
+        starts[1:] = numpy.cumsum(numpy.bincount(sources, minlength=len(self.areas)))
+        
+        self.adjacency_starts = starts
+        self.adjacency_areas = targets[order]
+        self.adjacency_connections = connections[order]
+    
+    
+    def get_neighbours(self, area_index):
+        """
+        Returns the areas that can be reached from an area.
+        
+        @return: a tuple of an array of area indices, and an array of the indices of the connections leading to them.
+        
+        @raise ValueError: if this mesh is not mapped.
+        """
+        
+        self.check_mapped()
+        if self.adjacency_starts is None:
+            self.build_adjacency()
+        
+        start = self.adjacency_starts[area_index]
+        end = self.adjacency_starts[area_index + 1]
+        
+        return self.adjacency_areas[start:end], self.adjacency_connections[start:end]
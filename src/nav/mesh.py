@@ -3,8 +3,11 @@ from doom.map.plane import Plane
 from nav.area import Area
 from nav.connection import Connection
 from nav.element import Element
+from util import compressedfile
 from util.rectangle import Rectangle
+from util.stagetimer import StageTimer
 from util.vector import Vector2
+import numpy
 import struct
 
 
@@ -15,8 +18,42 @@ class Mesh(object):
     
     # File structures.
     FILE_ID = 'DPMESH'
-    FILE_VERSION = 1
+    FILE_VERSION = 2
     FILE_HEADER = struct.Struct('<6sH16s')
+    FILE_SECTIONS = struct.Struct('<IIIIIIII')
+    FILE_PLANE_RECORD = numpy.dtype([
+        ('a', '<f4'),
+        ('b', '<f4'),
+        ('c', '<f4'),
+        ('d', '<f4'),
+        ('invc', '<f4')
+    ])
+    FILE_CONNECTION_RECORD = numpy.dtype([
+        ('left', '<i2'),
+        ('top', '<i2'),
+        ('right', '<i2'),
+        ('bottom', '<i2'),
+        ('area_a', '<i4'),
+        ('area_b', '<i4'),
+        ('linedef', '<i4'),
+        ('flags', '<i4')
+    ])
+    FILE_AREA_RECORD = numpy.dtype([
+        ('left', '<i2'),
+        ('top', '<i2'),
+        ('right', '<i2'),
+        ('bottom', '<i2'),
+        ('z', '<i2'),
+        ('reserved', '<i2'),
+        ('plane', '<i4'),
+        ('sector', '<i4'),
+        ('flags', '<i4'),
+        ('connection_start', '<i4'),
+        ('connection_count', '<i4')
+    ])
+    FILE_AREA_CONNECTION_RECORD = numpy.dtype('<i4')
+    
+    # Version 1 file structures.
     FILE_AREAS_HEADER = struct.Struct('<I')
     FILE_AREA = struct.Struct('<ihhhhhihIH')
     FILE_AREA_CONNECTION = struct.Struct('<i')
@@ -33,62 +70,212 @@ class Mesh(object):
         # All navigation areas that are aprt of this mesh.
         self.areas = []
         
+        # The area that each grid element is a part of, by element index. Used during mesh generation.
+        self.element_areas = None
+        
+        # The time taken by each stage of creating this mesh.
+        self.timer = StageTimer()
+        
         
     def create(self, nav_grid, map_data, config, max_area_size, max_area_size_merged):
         """
         Creates navigation areas from a navigation grid.
         """
         
+        self.setup(nav_grid, map_data, config, max_area_size, max_area_size_merged)
+        
+        # Generate square areas of decreasing size. 
+        self.timer.start('Generating areas')
+        self.generate_areas(self.get_scan_order(self.get_grid_area()))
+        
+        # Merge areas until none can be merged any more.
+        print 'Merging...'
+        self.timer.start('Merging areas')
+        self.merge_areas()
+        
+        self.finish()
+        
+        return True
+    
+    
+    def update(self, nav_grid, map_data, config, max_area_size, max_area_size_merged, rect):
+        """
+        Updates a mesh that was read from a file, after part of the navigation grid it was created from changed.
+        
+        Areas that overlap the changed part of the grid, or that no longer match the grid elements inside them are
+        removed. New areas are generated from the elements that are left over, and merged with each other and with
+        the remaining areas. All areas are then connected again.
+        
+        The areas can be laid out differently than those of a mesh created from the same grid. Remaining areas keep
+        their bounds, so new areas grow from the edges of the changed part instead of in scan order across the whole
+        map. The result can have a different number of areas and connections.
+        
+        @param rect: a Rectangle of the element coordinates that changed, inclusive, or None if no elements changed.
+                     See Grid.update.
+        """
+        
+        self.setup(nav_grid, map_data, config, max_area_size, max_area_size_merged)
+        
+        print 'Matching areas to elements...'
+        self.timer.start('Matching areas')
+        count = len(self.areas)
+        self.assign_area_elements(rect)
+        print 'Kept {} of {} navigation areas.'.format(len(self.areas), count)
+        
+        # Generate areas only from elements that are not part of a remaining area.
+        self.timer.start('Generating areas')
+        count = len(self.areas)
+        element_areas = self.element_areas
+        elements = [element for element in self.get_scan_order(self.get_grid_area()) if element_areas[element] is None]
+        self.generate_areas(elements)
+        
+        print 'Merging...'
+        self.timer.start('Merging areas')
+        self.merge_areas(set(self.areas[count:]))
+        
+        self.finish()
+        
+        return True
+    
+    
+    def setup(self, nav_grid, map_data, config, max_area_size, max_area_size_merged):
+        """
+        Prepares this mesh for generating areas from a navigation grid.
+        """
+        
         self.map_data = map_data
         self.config = config
         self.nav_grid = nav_grid
         self.max_area_size = max_area_size
         self.max_area_size_merged = max_area_size_merged
         self.max_size_elements = self.max_area_size / self.nav_grid.element_size
+        self.element_areas = [None] * len(nav_grid.elements)
+    
+    
+    def get_grid_area(self):
+        """
+        Returns a Rectangle of the element coordinates in which areas should be generated.
+        """
         
-        # Determine the area where to test for elements.
         grid_area = Rectangle()
         grid_area.left = self.nav_grid.map_data.min.x / self.nav_grid.element_size
         grid_area.top = self.nav_grid.map_data.min.y / self.nav_grid.element_size
         grid_area.right = grid_area.left + self.nav_grid.size.x
         grid_area.bottom = grid_area.top + self.nav_grid.size.y
         
-        # Generate square areas of decreasing size. 
+        return grid_area
+    
+    
+    def generate_areas(self, elements):
+        """
+        Generates square areas of decreasing size.
+        
+        @param elements: the elements to place areas at, in the order that they should be tested in.
+        """
+        
+        candidates = self.get_area_candidates(elements, self.max_size_elements)
         min_side = self.max_size_elements
         while min_side > 0:
             print 'Size iteration {}...'.format(min_side)
-            self.generate_iteration(grid_area, min_side)            
+            self.generate_iteration(candidates[min_side], min_side)
             min_side -= 1
-        
-        # Merge areas until none can be merged any more.
-        print 'Merging...'
-        while 1:
-            old_len = len(self.areas)
-            self.areas = filter(self.area_merge_filter, self.areas)
-            new_len = len(self.areas)
-            
-            # If no areas were removed, stop merging.
-            if new_len == old_len:
-                break
-            
-            print 'Merged to {} navigation areas.'.format(new_len)
+    
+    
+    def finish(self):
+        """
+        Prunes area elements and connects the areas of this mesh, after they have been generated and merged.
+        """
         
         print 'Adding areas to blockmap...'
+        self.timer.start('Adding to blockmap')
         self.map_data.blockmap.generate_areas(self)
 
         print 'Pruning elements...'
+        self.timer.start('Pruning elements')
         self.prune_elements()
         
         print 'Connecting areas...'
+        self.timer.start('Connecting areas')
         count = self.connect_areas()
         print 'Generated {} connections.'.format(count)
         
         print 'Connecting teleporters...'
+        self.timer.start('Connecting teleporters')
         self.connect_teleporters()
         
-        return True
-
-
+        self.timer.stop()
+        self.timer.print_stages()
+    
+    
+    def assign_area_elements(self, rect):
+        """
+        Assigns navigation grid elements to the areas of a mesh that was read from a file.
+        
+        Areas that overlap rect, or that have no matching element at every position inside them are removed. All
+        connections are removed as well, they are created again by connect_areas.
+        
+        @param rect: a Rectangle of element coordinates, inclusive, or None.
+        """
+        
+        areas = []
+        for area in self.areas:
+            area.connections = []
+            area.elements = []
+            
+            # Areas span element coordinates x1 to x2 and y1 to y2, exclusive.
+            x1, y1 = self.nav_grid.map_to_element(area.rect.p1)
+            x2, y2 = self.nav_grid.map_to_element(area.rect.p2)
+            if rect is not None and x1 <= rect.right and x2 > rect.left and y1 <= rect.bottom and y2 > rect.top:
+                continue
+            
+            elements = self.get_matching_elements(area, x1, y1, x2, y2)
+            if elements is None:
+                continue
+            
+            # Use the map's own plane object for the area.
+            if area.plane is not None:
+                area.plane = self.nav_grid.elements.get_plane(elements[0])
+            
+            area.elements = elements
+            for element in elements:
+                self.element_areas[element] = area
+            areas.append(area)
+        
+        self.areas = areas
+    
+    
+    def get_matching_elements(self, area, x1, y1, x2, y2):
+        """
+        Returns a list of the elements that an area consists of, or None if an element is missing.
+        
+        Elements match an area if they are not part of another area, and have the same properties as the area.
+        """
+        
+        plane_key = get_plane_key(area.plane)
+        grid_elements = self.nav_grid.elements
+        element_areas = self.element_areas
+        sector = -1 if area.sector is None else area.sector
+        
+        elements = []
+        for y in xrange(y1, y2):
+            for x in xrange(x1, x2):
+                for element in grid_elements.get_column(x, y):
+                    if element_areas[element] is not None or grid_elements.flags[element] != area.flags or grid_elements.special_sector[element] != sector:
+                        continue
+                    if get_plane_key(grid_elements.get_plane(element)) != plane_key:
+                        continue
+                    if plane_key is None and grid_elements.z[element] != area.z:
+                        continue
+                    
+                    elements.append(element)
+                    break
+                
+                else:
+                    return None
+        
+        return elements
+    
+    
     def get_area_at(self, pos2, z):
         """
         Returns the area object at a 2d position..
@@ -212,7 +399,11 @@ class Mesh(object):
             area.inside_rect.set(x1, y1, x2, y2)
             area.elements = filter(self.area_element_prune_filter, area.elements)
             
-        self.nav_grid.remove_pruned_elements()
+        # Renumber the remaining area elements.
+        new_indices = self.nav_grid.remove_pruned_elements()
+        for area in self.areas:
+            area.elements = new_indices[area.elements].tolist()
+        self.element_areas = [area for area, index in zip(self.element_areas, new_indices.tolist()) if index != -1]
     
     
     def connect_areas(self):
@@ -224,59 +415,61 @@ class Mesh(object):
         """
         
         count = 0
-               
+        links = self.nav_grid.elements.links
+        element_areas = self.element_areas
+        
+        # Connections by (area a, area b, rectangle coordinates), to find the connection that leads back to an area.
+        connections = {}
+        
         for area in self.areas:
             
-            # Test each element in an area.
+            # Group the elements that connect to other areas by direction and other area, in the order they are found.
+            groups = [{}, {}, {}, {}]
+            keys = []
             for element in area.elements:
                 for direction in Element.DIR_RANGE:
-                    if element.connection[direction] is not None:
+                    other_element = links[element * 4 + direction]
+                    if other_element == -1:
                         continue
-                
-                    other_element = element.elements[direction]
-                    if other_element is None or other_element.area == area or other_element.area is None:
-                        continue
-                    
-                    # Find all elements that connect to the same area.
-                    connecting = []
-                    other_area = other_element.area
-                    for c_element in area.elements:
-                        
-                        # Add elements that connect to the same area to a list of connection elements.
-                        if c_element.elements[direction] is not None and c_element.elements[direction].area == other_area:
-                            connecting.append(c_element)
-                            connecting.append(c_element.elements[direction])
                     
-                    # Calculate the bounding box of the connecting elements.
-                    # This forms the bounding box of the connection area.
-                    rect = self.get_elements_bounds(connecting)
+                    other_area = element_areas[other_element]
+                    if other_area is area or other_area is None:
+                        continue
                     
-                    # See if a connection exists in the other area that is equal to the current one.
-                    connection = None
-                    for c_connection in other_area.connections:
-                        if c_connection.area_b == area and c_connection.rect == rect:
-                            connection = c_connection
-                            connection.flags |= Connection.FLAG_BA
-                            break
+                    connecting = groups[direction].get(other_area)
+                    if connecting is None:
+                        connecting = []
+                        groups[direction][other_area] = connecting
+                        keys.append((direction, other_area))
+                    connecting.append(element)
+                    connecting.append(other_element)
+            
+            for direction, other_area in keys:
+                connecting = groups[direction][other_area]
+                
+                # Calculate the bounding box of the connecting elements.
+                # This forms the bounding box of the connection area.
+                rect = self.get_elements_bounds(connecting)
+                
+                # See if a connection exists in the other area that is equal to the current one.
+                connection = connections.get((other_area, area, rect.left, rect.top, rect.right, rect.bottom))
+                if connection is not None:
+                    connection.flags |= Connection.FLAG_BA
 
-                    # Create new connection object if needed.
-                    if connection is None:
-                        count += 1
-                        
-                        connection = Connection()
-                        connection.flags = Connection.FLAG_AB
-                        connection.area_a = area
-                        connection.area_b = other_area
-                        connection.rect.copy_from(rect)
-                        connection.center = connection.rect.get_center()
-                        
-                    area.connections.append(connection)
+                # Create new connection object if needed.
+                else:
+                    count += 1
                     
-                    # Assign connection to elements.
-                    for c_element in connecting:
-                        if c_element.area == area:
-                            c_element.connection[direction] = connection
-        
+                    connection = Connection()
+                    connection.flags = Connection.FLAG_AB
+                    connection.area_a = area
+                    connection.area_b = other_area
+                    connection.rect.copy_from(rect)
+                    connection.center = connection.rect.get_center()
+                    connections.setdefault((area, other_area, rect.left, rect.top, rect.right, rect.bottom), connection)
+                    
+                area.connections.append(connection)
+                
         return count
                     
     
@@ -289,11 +482,12 @@ class Mesh(object):
         p2 = Vector2(-0x8000, -0x8000)
         
         # Find minimum and maximum element positions.
-        for element in elements:
-            p1.x = min(element.pos.x, p1.x)
-            p1.y = min(element.pos.y, p1.y)
-            p2.x = max(element.pos.x, p2.x)
-            p2.y = max(element.pos.y, p2.y)
+        if len(elements) > 0:
+            grid_elements = self.nav_grid.elements
+            xs = [grid_elements.x[element] for element in elements]
+            ys = [grid_elements.y[element] for element in elements]
+            p1.set(min(xs), min(ys))
+            p2.set(max(xs), max(ys))
         
         # Convert these to map coordinates.
         x1, y1 = self.nav_grid.element_to_map(p1)
@@ -313,19 +507,126 @@ class Mesh(object):
         Filters elements from an area that are not at the outer borders.
         """
         
-        if element.pos.x >= element.area.inside_rect.left and element.pos.y >= element.area.inside_rect.top \
-         and element.pos.x < element.area.inside_rect.right and element.pos.y < element.area.inside_rect.bottom:
+        x = self.nav_grid.elements.x[element]
+        y = self.nav_grid.elements.y[element]
+        inside_rect = self.element_areas[element].inside_rect
+        if x >= inside_rect.left and y >= inside_rect.top and x < inside_rect.right and y < inside_rect.bottom:
             self.nav_grid.element_prune.add(element)
             return False
         
         return True
             
     
-    def generate_iteration(self, grid_area, size):
+    def get_scan_order(self, grid_area):
         """
-        Generates navigation areas of a set size where possible.
+        Returns a list of the indices of the elements that areas are placed at, in the order that they are tested in.
         
         @param grid_area: a Rectangle in which areas should be generated.
+        """
+        
+        grid_elements = self.nav_grid.elements
+        grid_width = self.nav_grid.size.x
+        
+        # Elements are tested by ascending x + y * width position hash, which covers the grid area row by row, and
+        # then by ascending z.
+        elements = grid_elements.get_column_elements()
+        x = grid_elements.get_array('x', numpy.int16)[elements].astype(numpy.int64)
+        y = grid_elements.get_array('y', numpy.int16)[elements].astype(numpy.int64)
+        z = grid_elements.get_array('z', numpy.float64)[elements]
+        keys = x + y * grid_width
+        
+        start = grid_area.left + grid_area.top * grid_width
+        end = grid_area.left + grid_area.bottom * grid_width
+        inside = (keys >= start) & (keys < end)
+        elements = elements[inside]
+        
+        return elements[numpy.lexsort((z[inside], keys[inside]))].tolist()
+    
+    
+    def get_area_candidates(self, elements, max_size):
+        """
+        Finds the elements at which an area of each size could be placed.
+        
+        test_area walks from the top left element to the bottom right element of an area, and from there tests the
+        area's columns of elements. The largest square of similar elements that ends at every grid element is computed
+        along those same element connections, for all elements at once. An area of a size can only be placed at an
+        element if the square that ends at the element's bottom right element is at least as large. Areas that are
+        placed later on are not accounted for, so candidates still need to be tested with test_area.
+        
+        @param elements: the indices of the elements to find candidates in, in the order that they are tested in.
+        @param max_size: the largest area size to find candidates for.
+        
+        @return: a list of candidate element index lists, indexed by area size. Candidates are in the same order as
+                 elements.
+        """
+        
+        grid_elements = self.nav_grid.elements
+        count = len(grid_elements)
+        element_indices = numpy.array(elements, dtype=numpy.int32)
+        
+        # Connected element indices, one row for each direction. Missing elements are given an index past the end of
+        # the arrays.
+        links = numpy.empty((4, count + 1), dtype=numpy.int32)
+        links[:, :count] = grid_elements.get_array('links', numpy.int32).reshape((count, 4)).T
+        links[links == -1] = count
+        links[:, count] = count
+        
+        # Number each group of elements that are similar to each other, see CompactGrid.is_similar. Elements without
+        # a plane are similar if they are at the same z.
+        plane = grid_elements.get_array('plane', numpy.int32)
+        keys = numpy.empty((4, count))
+        keys[0] = grid_elements.get_array('special_sector', numpy.int32)
+        keys[1] = grid_elements.get_array('flags', numpy.uint8)
+        keys[2] = plane
+        keys[3] = numpy.where(plane == -1, grid_elements.get_array('z', numpy.float64), 0)
+        order = numpy.lexsort(keys)
+        sorted_keys = keys[:, order]
+        group = numpy.empty(count + 1, dtype=numpy.int32)
+        group[order] = numpy.concatenate(([0], numpy.cumsum(numpy.any(sorted_keys[:, 1:] != sorted_keys[:, :-1], axis=0))))
+        group[count] = -1
+        
+        up = links[Element.DIR_UP, :count]
+        left = links[Element.DIR_LEFT, :count]
+        similar_up = group[up] == group[:count]
+        similar_left = group[left] == group[:count]
+        
+        # The number of similar elements in a row upwards, and to the left of every element. Each iteration extends
+        # the known rows by one element.
+        rows_up = numpy.ones(count + 1, dtype=numpy.int32)
+        rows_left = numpy.ones(count + 1, dtype=numpy.int32)
+        rows_up[count] = 0
+        rows_left[count] = 0
+        for _ in xrange(max_size - 1):
+            rows_up[:count] = numpy.where(similar_up, rows_up[up] + 1, 1)
+            rows_left[:count] = numpy.where(similar_left, rows_left[left] + 1, 1)
+        
+        # The size of the largest square that ends at every element. A square can be no larger than the rows leading
+        # up to its bottom right element, and no more than one larger than the square that ends to the left of it.
+        rows = numpy.minimum(rows_up, rows_left)
+        squares = numpy.minimum(rows, 1)
+        for _ in xrange(max_size - 1):
+            squares[:count] = numpy.minimum(rows[:count], squares[left] + 1)
+        
+        # The element one step to the right and down from every element.
+        diagonal = links[Element.DIR_DOWN][links[Element.DIR_RIGHT]]
+        
+        # Select candidates by following elements down to the bottom right element of each area size.
+        candidates = [[]]
+        corners = element_indices
+        for size in xrange(1, max_size + 1):
+            selected = element_indices[(squares[corners] >= size) & (group[corners] == group[element_indices])]
+            candidates.append(selected.tolist())
+            corners = diagonal[corners]
+        
+        return candidates
+    
+    
+    def generate_iteration(self, candidates, size):
+        """
+        Generates navigation areas of a set size where possible.
+        
+        @param candidates: a list of the indices of elements to attempt to place an area at, see
+                           get_area_candidates.
         @param size: the size of areas to generate.  
         """
         
@@ -333,44 +634,105 @@ class Mesh(object):
         test_area = self.test_area
         add_area = self.add_area
         areas = self.areas
-        element_hash = self.nav_grid.element_hash
-        grid_width = self.nav_grid.size.x
+        element_areas = self.element_areas
+        grid_elements = self.nav_grid.elements
 
-        # Loop over every unused element.
-        x = grid_area.left
-        y = grid_area.top
+        # Loop over every unused candidate element.
+        for element in candidates:
+            if element_areas[element] is not None:
+                continue
+            
+            # Attempt to place an area.
+            if test_area(element, size) == False:
+                continue
+            
+            area = add_area(element, size, size)
+            area.sector = grid_elements.get_special_sector(element)
+            area.flags = grid_elements.flags[element]
+            area.plane = grid_elements.get_plane(element)
+            areas.append(area)
+            
+            if len(areas) % int(1000 / size) == 0:
+                print '{} navigation areas.'.format(len(areas))
+
+    
+    def merge_areas(self, changed=None):
+        """
+        Merges similar connecting areas together until none can be merged any more.
+        
+        Areas are merged in passes over all areas, in the same order as repeatedly filtering them with merge_area
+        would. An area that could not be merged is only tested again once itself, or one of the areas that it was
+        tested against has changed. Only the areas around a merged area need to be tested again in the next pass.
+        
+        @param changed: a set of the areas to test in the first pass, or None to test all areas.
+        """
+        
+        # Keep local references as optimization.
+        merge_area = self.merge_area
+        
+        # The areas that tested against an area since it last changed.
+        testers = {}
+        
+        # Areas that need to be tested again.
+        if changed is None:
+            changed = set(self.areas)
+        
         while 1:
-            elements = element_hash.get(x + (y * grid_width))
-            if elements is not None:
-                for element in elements.itervalues():
-                    if element.area is not None:
-                        continue
-                    
-                    # Attempt to place an area.
-                    if test_area(element, size) == False:
-                        continue
-                    
-                    area = add_area(element, size, size)
-                    area.sector = element.special_sector
-                    area.flags = element.flags
-                    area.plane = element.plane
+            areas = []
+            merged = False
+            for area in self.areas:
+                if area not in changed:
                     areas.append(area)
-                    
-                    if len(areas) % int(1000 / size) == 0:
-                        print '{} navigation areas.'.format(len(areas))
-            
-            # Advance to next element.
-            x += 1
-            if x >= grid_area.right:
-                x = grid_area.left
-                y += 1
-                if y >= grid_area.bottom:
-                    break
-
+                    continue
+                changed.discard(area)
+                
+                tested = []
+                target = merge_area(area, tested)
+                
+                # Keep the area, and test it again once any of the areas it was tested against change.
+                if target is None:
+                    for tested_area in tested:
+                        testers.setdefault(tested_area, set()).add(area)
+                    areas.append(area)
+                    continue
+                
+                # The merged areas have changed, so everything that tested against them needs to be tested again.
+                changed.update(testers.pop(area, ()))
+                changed.update(testers.pop(target, ()))
+                changed.add(target)
+                changed.discard(area)
+                merged = True
+            
+            self.areas = areas
+            
+            # If no areas were merged, stop merging.
+            if merged == False:
+                break
+            
+            print 'Merged to {} navigation areas.'.format(len(areas))
+    
+    
+    def get_area_element(self, area, x, y):
+        """
+        Returns the index of the element of an area at element coordinates x,y, or None if the area has no element
+        there.
+        """
+        
+        for element in self.nav_grid.elements.get_column(x, y):
+            if self.element_areas[element] is area:
+                return element
+        
+        return None
     
-    def area_merge_filter(self, area):
+    
+    def merge_area(self, area, tested):
         """
-        Filters and merges similar connecting areas together.
+        Merges an area into a similar connecting area, if possible.
+        
+        @param area: the area to merge.
+        @param tested: a list to which the areas that were tested for merging are added.
+        
+        @return: the area that area was merged into, or None if it could not be merged.
         """
         
         pos = Vector2()
@@ -395,24 +757,23 @@ class Mesh(object):
             ex, ey = self.nav_grid.map_to_element(pos)
             
             # Find the element in this area.
-            for element in area.elements:
-                if element.pos.x == ex and element.pos.y == ey:
-                    break
-            else:
+            element = self.get_area_element(area, ex, ey)
+            if element is None:
                 continue
             
             # Select the connected element on the current side.
-            element = element.elements[direction]
-            if element is None:
+            element = self.nav_grid.elements.links[element * 4 + direction]
+            if element == -1:
                 continue
             
             # Select the navigation area that the selected element is a part of.
-            merge_area = element.area
+            merge_area = self.element_areas[element]
             if merge_area is None:
                 continue
+            tested.append(merge_area)
             
             # Ignore areas that do not have similar contents.
-            if not (area.elements[0].is_similar(merge_area.elements[0])):
+            if not (self.nav_grid.elements.is_similar(area.elements[0], merge_area.elements[0])):
                 continue
             
             # See if the two areas have matching opposite sides.
@@ -454,26 +815,29 @@ class Mesh(object):
             # Merge the area element lists.
             merge_area.elements.extend(area.elements)
             for element in area.elements:
-                element.area = merge_area
+                self.element_areas[element] = merge_area
                 
-            return False
+            return merge_area
         
-        return True
+        return None
 
     
     def add_area(self, element, width, height):
         """
         Adds a new navigation area.
         
-        @param element: the top left element of the new area.
+        @param element: the index of the top left element of the new area.
         @param width: the width of the new area, in map units.
         @param height: the height of the new area, in map units.
         
         @return: the new Area object.
         """  
         
+        grid_elements = self.nav_grid.elements
+        links = grid_elements.links
+        
         area_rect = Rectangle()
-        area_rect.set_size(element.pos.x, element.pos.y, width, height)
+        area_rect.set_size(grid_elements.x[element], grid_elements.y[element], width, height)
         
         # Create a new nav area of the found width and height.
         x1, y1 = self.nav_grid.element_to_map(area_rect.p1)
@@ -487,7 +851,7 @@ class Mesh(object):
         p2.x -= (self.nav_grid.element_size / 2)
         p2.y -= (self.nav_grid.element_size / 2)
 
-        area = Area(p1.x, p1.y, p2.x, p2.y, element.pos.z)
+        area = Area(p1.x, p1.y, p2.x, p2.y, grid_elements.z[element])
         
         # Assign this area to all the elements in it.
         xelement = element
@@ -495,12 +859,12 @@ class Mesh(object):
             
             yelement = xelement
             for _ in range(0, height):
-                yelement.area = area
+                self.element_areas[yelement] = area
                 area.elements.append(yelement)
                 
-                yelement = yelement.elements[Element.DIR_DOWN]
+                yelement = links[yelement * 4 + Element.DIR_DOWN]
             
-            xelement = xelement.elements[Element.DIR_RIGHT]
+            xelement = links[xelement * 4 + Element.DIR_RIGHT]
         
         return area
     
@@ -509,24 +873,29 @@ class Mesh(object):
         """
         Returns True if an area can be placed at the element's coordinates.
         
-        @param element: the top left element of the area to test.
+        @param element: the index of the top left element of the area to test.
         @param size: the size of the area to test.
         """  
         
-        x = element.pos.x
-        y = element.pos.y
+        grid_elements = self.nav_grid.elements
+        links = grid_elements.links
+        is_similar = grid_elements.is_similar
+        element_areas = self.element_areas
+        
+        x = grid_elements.x[element]
+        y = grid_elements.y[element]
 
         # Move to the bottom right element.
         # This also rejects the potential area early on.
         start_element = element
         cx = 1
         while cx < size:
-            start_element = start_element.elements[Element.DIR_RIGHT]
-            if start_element is None:
+            start_element = links[start_element * 4 + Element.DIR_RIGHT]
+            if start_element == -1:
                 return False
             
-            start_element = start_element.elements[Element.DIR_DOWN]
-            if start_element is None:
+            start_element = links[start_element * 4 + Element.DIR_DOWN]
+            if start_element == -1:
                 return False
             
             cx += 1
@@ -539,95 +908,98 @@ class Mesh(object):
             yelement = xelement
             cy = y + size
             while cy > y:
-                if yelement is None or yelement.area is not None or (not yelement.is_similar(element)):
+                if yelement == -1 or element_areas[yelement] is not None or (not is_similar(yelement, element)):
                     return False
                 
                 cy -= 1
-                yelement = yelement.elements[Element.DIR_UP]
+                yelement = links[yelement * 4 + Element.DIR_UP]
                 
             cx -= 1
-            xelement = xelement.elements[Element.DIR_LEFT]
+            xelement = links[xelement * 4 + Element.DIR_LEFT]
 
         return True
     
     
-    def write(self, filename):
+    def write(self, filename, codec=None, level=6):
         """
         Writes this mesh to a file.
+        
+        Planes, connections and areas refer to each other by their index in their file section. Each section is
+        written as a single array of fixed size records.
+        
+        @param codec: the name of the codec to compress the file with, or None to write an uncompressed file.
+        @param level: the compression level or preset.
         """
         
-        with open(filename, 'wb') as f:
-            header_data = Mesh.FILE_HEADER.pack(Mesh.FILE_ID, Mesh.FILE_VERSION, self.map_data.data_hash)
-            f.write(header_data)
+        # Number planes and connections in the order that areas first refer to them.
+        plane_indices = {}
+        planes = []
+        connection_indices = {}
+        connections = []
+        for area in self.areas:
+            plane = area.plane
+            if plane is not None and plane not in plane_indices:
+                plane_indices[plane] = len(planes)
+                planes.append(plane)
             
-            # Generate a list of area subdata.
-            area_hashes = []
-            plane_hashes = {}
-            connection_hashes = {}
-            for area in self.areas:
-                area_hashes.append(hash(area))
-                
-                if area.plane is not None:
-                    plane_hashes[hash(area.plane)] = area.plane
-                
-                for connection in area.connections:
-                    connection_hashes[hash(connection)] = connection
-            
-            # Write plane data.
-            planes_header = Mesh.FILE_PLANES_HEADER.pack(len(plane_hashes))
-            f.write(planes_header)
-            for plane_hash, plane in plane_hashes.iteritems():
-                plane_data = Mesh.FILE_PLANE.pack(plane_hash, plane.a, plane.b, plane.c, plane.d, plane.invc)
-                f.write(plane_data)
-            
-            # Write connection data.
-            connections_header = Mesh.FILE_CONNECTIONS_HEADER.pack(len(connection_hashes))
-            f.write(connections_header)
-            for connection_hash, connection in connection_hashes.iteritems():
-                if connection.area_a is not None:
-                    area_a_hash = hash(connection.area_a)
-                else:
-                    area_a_hash = 0
-                if connection.area_b is not None:
-                    area_b_hash = hash(connection.area_b)
-                else:
-                    area_a_hash = 0
-                if connection.linedef is not None:
-                    linedef = connection.linedef
-                else:
-                    linedef = -1
-                    
-                connection_data = Mesh.FILE_CONNECTION.pack(connection_hash, connection.rect.left, connection.rect.top, connection.rect.right, connection.rect.bottom, area_a_hash, area_b_hash, linedef, connection.flags)
-                f.write(connection_data)
-            
-            # Write area data.
-            areas_header = Mesh.FILE_AREAS_HEADER.pack(len(area_hashes))
-            f.write(areas_header)
-            for index, area in enumerate(self.areas):
-                if area.sector is None:
-                    sector_index = -1
-                else:
-                    sector_index = area.sector
-                    
-                if area.plane is not None:
-                    plane_hash = hash(area.plane)
-                else:
-                    plane_hash = 0
-                    
-                area_data = Mesh.FILE_AREA.pack(area_hashes[index], area.rect.left, area.rect.top, area.rect.right, area.rect.bottom, area.z, plane_hash, sector_index, area.flags, len(area.connections))
-                f.write(area_data)
-                
-                for connection in area.connections:
-                    connection_data = Mesh.FILE_AREA_CONNECTION.pack(hash(connection))
-                    f.write(connection_data)
-                
+            for connection in area.connections:
+                if connection not in connection_indices:
+                    connection_indices[connection] = len(connections)
+                    connections.append(connection)
+        
+        area_indices = {}
+        for index, area in enumerate(self.areas):
+            area_indices[area] = index
+        
+        plane_records = numpy.array(
+            [(plane.a, plane.b, plane.c, plane.d, plane.invc) for plane in planes],
+            dtype=Mesh.FILE_PLANE_RECORD
+        )
+        
+        connection_records = numpy.array(
+            [(connection.rect.left, connection.rect.top, connection.rect.right, connection.rect.bottom,
+              area_indices.get(connection.area_a, -1), area_indices.get(connection.area_b, -1),
+              -1 if connection.linedef is None else connection.linedef, connection.flags) for connection in connections],
+            dtype=Mesh.FILE_CONNECTION_RECORD
+        )
+        
+        # Area connections are stored as one list, each area refers to a range of it.
+        area_connections = []
+        area_records = []
+        for area in self.areas:
+            area_records.append((
+                area.rect.left, area.rect.top, area.rect.right, area.rect.bottom, area.z, 0,
+                plane_indices.get(area.plane, -1), -1 if area.sector is None else area.sector, area.flags,
+                len(area_connections), len(area.connections)
+            ))
+            area_connections.extend([connection_indices[connection] for connection in area.connections])
+        area_records = numpy.array(area_records, dtype=Mesh.FILE_AREA_RECORD)
+        area_connections = numpy.array(area_connections, dtype=Mesh.FILE_AREA_CONNECTION_RECORD)
+        
+        # Sections follow the header and section table back to back.
+        sections = (plane_records, connection_records, area_records, area_connections)
+        section_table = []
+        offset = Mesh.FILE_HEADER.size + Mesh.FILE_SECTIONS.size
+        for records in sections:
+            section_table.extend((offset, len(records)))
+            offset += records.nbytes
+        
+        with compressedfile.open_write(filename, codec, level) as f:
+            f.write(Mesh.FILE_HEADER.pack(Mesh.FILE_ID, Mesh.FILE_VERSION, self.map_data.data_hash))
+            f.write(Mesh.FILE_SECTIONS.pack(*section_table))
+            for records in sections:
+                f.write(records.tostring())
+    
     
     def read(self, filename, map_data):
         """
-        Reads a mesh from a file.
+        Reads a mesh from a file. Version 1 mesh files are also supported, and compressed mesh files are decompressed
+        while reading.
+        
+        @return: True if the mesh was read, False if the file is not a supported mesh file.
         """
         
-        with open(filename, 'rb') as f:
+        with compressedfile.open_read(filename) as f:
             data = Mesh.FILE_HEADER.unpack(f.read(Mesh.FILE_HEADER.size))
             file_id = data[0]
             file_version = data[1]
@@ -642,70 +1014,199 @@ class Mesh(object):
             # Validate header.
             if file_id != Mesh.FILE_ID:
                 print 'Invalid mesh file.'
-                return
+                return False
             if file_version > Mesh.FILE_VERSION:
                 print 'Unsupported mesh version {}.'.format(file_version)
-                return
-            
-            area_hashes = {}
-            plane_hashes = {}
-            connection_hashes = {}
-            self.areas = []
-            
-            # Read planes.
-            planes_count = Mesh.FILE_PLANES_HEADER.unpack(f.read(Mesh.FILE_PLANES_HEADER.size))[0]
-            for _ in range(planes_count):
-                plane = Plane()
-                plane_hash, plane.a, plane.b, plane.c, plane.d, plane.invc = Mesh.FILE_PLANE.unpack(f.read(Mesh.FILE_PLANE.size))
-                plane_hashes[plane_hash] = plane
-            
-            # Read area connections.
-            connections_count = Mesh.FILE_CONNECTIONS_HEADER.unpack(f.read(Mesh.FILE_CONNECTIONS_HEADER.size))[0]
-            for _ in range(connections_count):
-                connection = Connection()
-                connection_hash, left, top, right, bottom, area_a_hash, area_b_hash, linedef, flags = Mesh.FILE_CONNECTION.unpack(f.read(Mesh.FILE_CONNECTION.size))
-                
-                if linedef == -1:
-                    linedef = None
-                
-                connection.rect.set(left, top, right, bottom)
-                connection.center = connection.rect.get_center()
-                connection.area_a = area_a_hash
-                connection.area_b = area_b_hash
-                connection.linedef = linedef
-                connection.flags = flags
-                connection_hashes[connection_hash] = connection
+                return False
             
-            # Read mesh areas.
-            area_count = Mesh.FILE_AREAS_HEADER.unpack(f.read(Mesh.FILE_AREAS_HEADER.size))[0]
-            for index in range(area_count):
-                area_hash, left, top, right, bottom, z, plane_hash, sector_index, flags, connection_count = Mesh.FILE_AREA.unpack(f.read(Mesh.FILE_AREA.size))
-                
-                area = Area(left, top, right, bottom, z)
-                if sector_index == -1:
-                    sector_index = None
+            if file_version == 1:
+                self.read_version_1(f)
+            elif self.read_sections(f) == False:
+                print 'Invalid mesh file.'
+                return False
+        
+        self.map_data = map_data
+        
+        return True
+    
+    
+    def read_sections(self, f):
+        """
+        Reads the sections of a version 2 mesh file, after its header.
+        
+        Sections are read one at a time in file order, so that compressed files are decompressed a section at a time.
+        
+        @return: False if the section table does not match the file.
+        """
+        
+        table = Mesh.FILE_SECTIONS.unpack(f.read(Mesh.FILE_SECTIONS.size))
+        
+        # Section offsets are relative to the start of the file.
+        position = Mesh.FILE_HEADER.size + Mesh.FILE_SECTIONS.size
+        sections = []
+        for index, dtype in enumerate((Mesh.FILE_PLANE_RECORD, Mesh.FILE_CONNECTION_RECORD, Mesh.FILE_AREA_RECORD,
+                                       Mesh.FILE_AREA_CONNECTION_RECORD)):
+            offset, count = table[index * 2], table[index * 2 + 1]
+            if offset < position:
+                return False
+            
+            # Skip anything between sections.
+            if offset > position:
+                f.read(offset - position)
+            
+            size = count * dtype.itemsize
+            data = f.read(size)
+            if len(data) != size:
+                return False
+            position = offset + size
+            
+            sections.append(numpy.frombuffer(data, dtype=dtype, count=count).tolist())
+        plane_records, connection_records, area_records, area_connections = sections
+        
+        planes = []
+        for a, b, c, d, invc in plane_records:
+            plane = Plane()
+            plane.a = a
+            plane.b = b
+            plane.c = c
+            plane.d = d
+            plane.invc = invc
+            planes.append(plane)
+        
+        self.areas = []
+        for index, record in enumerate(area_records):
+            left, top, right, bottom, z, _, plane_index, sector_index, flags, _, _ = record
+            
+            area = Area(left, top, right, bottom, z)
+            if sector_index != -1:
                 area.sector = sector_index
-                area.flags = flags
-                area.index = index
-                if plane_hash != 0:
-                    area.plane = plane_hashes[plane_hash]
-                
-                for _ in range(connection_count):
-                    connection_hash = Mesh.FILE_AREA_CONNECTION.unpack(f.read(Mesh.FILE_AREA_CONNECTION.size))[0]
-                    area.connections.append(connection_hashes[connection_hash])
-                
-                self.areas.append(area)
-                area_hashes[area_hash] = area
+            area.flags = flags
+            area.index = index
+            if plane_index != -1:
+                area.plane = planes[plane_index]
+            self.areas.append(area)
+        
+        # Keep local references as optimization.
+        areas = self.areas
+        
+        connections = []
+        for left, top, right, bottom, area_a, area_b, linedef, flags in connection_records:
+            connection = Connection()
+            connection.rect.set(left, top, right, bottom)
+            connection.center = connection.rect.get_center()
+            if area_a != -1:
+                connection.area_a = areas[area_a]
+            if area_b != -1:
+                connection.area_b = areas[area_b]
+            if linedef != -1:
+                connection.linedef = linedef
+            connection.flags = flags
+            connections.append(connection)
+        
+        for area, record in zip(areas, area_records):
+            start = record[9]
+            area.connections = [connections[index] for index in area_connections[start:start + record[10]]]
+        
+        return True
+    
+    
+    def read_version_1(self, f):
+        """
+        Reads the data of a version 1 mesh file, after its header.
+        
+        Version 1 files refer to objects by unique ids, and prefix each section and area connection list with a count.
+        """
+        
+        area_hashes = {}
+        plane_hashes = {}
+        connection_hashes = {}
+        self.areas = []
+        
+        # Read planes.
+        planes_count = Mesh.FILE_PLANES_HEADER.unpack(f.read(Mesh.FILE_PLANES_HEADER.size))[0]
+        for _ in range(planes_count):
+            plane = Plane()
+            plane_hash, plane.a, plane.b, plane.c, plane.d, plane.invc = Mesh.FILE_PLANE.unpack(f.read(Mesh.FILE_PLANE.size))
+            plane_hashes[plane_hash] = plane
+        
+        # Read area connections.
+        connections_count = Mesh.FILE_CONNECTIONS_HEADER.unpack(f.read(Mesh.FILE_CONNECTIONS_HEADER.size))[0]
+        for _ in range(connections_count):
+            connection = Connection()
+            connection_hash, left, top, right, bottom, area_a_hash, area_b_hash, linedef, flags = Mesh.FILE_CONNECTION.unpack(f.read(Mesh.FILE_CONNECTION.size))
             
-            # Set connection objects. 
-            for connection in connection_hashes.itervalues():
-                if connection.area_a != 0:
-                    connection.area_a = area_hashes[connection.area_a]
-                else:
-                    connection.area_a = None
-                if connection.area_b != 0:
-                    connection.area_b = area_hashes[connection.area_b]
-                else:
-                    connection.area_b = None
+            if linedef == -1:
+                linedef = None
+            
+            connection.rect.set(left, top, right, bottom)
+            connection.center = connection.rect.get_center()
+            connection.area_a = area_a_hash
+            connection.area_b = area_b_hash
+            connection.linedef = linedef
+            connection.flags = flags
+            connection_hashes[connection_hash] = connection
         
-        self.map_data = map_data
\ No newline at end of file
+        # Read mesh areas.
+        area_count = Mesh.FILE_AREAS_HEADER.unpack(f.read(Mesh.FILE_AREAS_HEADER.size))[0]
+        for index in range(area_count):
+            area_hash, left, top, right, bottom, z, plane_hash, sector_index, flags, connection_count = Mesh.FILE_AREA.unpack(f.read(Mesh.FILE_AREA.size))
+            
+            area = Area(left, top, right, bottom, z)
+            if sector_index == -1:
+                sector_index = None
+            area.sector = sector_index
+            area.flags = flags
+            area.index = index
+            if plane_hash != 0:
+                area.plane = plane_hashes[plane_hash]
+            
+            for _ in range(connection_count):
+                connection_hash = Mesh.FILE_AREA_CONNECTION.unpack(f.read(Mesh.FILE_AREA_CONNECTION.size))[0]
+                area.connections.append(connection_hashes[connection_hash])
+            
+            self.areas.append(area)
+            area_hashes[area_hash] = area
+        
+        # Set connection objects. 
+        for connection in connection_hashes.itervalues():
+            if connection.area_a != 0:
+                connection.area_a = area_hashes[connection.area_a]
+            else:
+                connection.area_a = None
+            if connection.area_b != 0:
+                connection.area_b = area_hashes[connection.area_b]
+            else:
+                connection.area_b = None
+
+
+def get_plane_key(plane):
+    """
+    Returns a comparable key of the coefficients of a plane, as they are stored in mesh files. Returns None for
+    no plane.
+    """
+    
+    if plane is None:
+        return None
+    
+    return Mesh.FILE_PLANE.pack(0, plane.a, plane.b, plane.c, plane.d, plane.invc)
+
+
+def read_mesh_header(filename):
+    """
+    Reads only the header of a mesh file.
+    
+    @return: a tuple of the mesh file version and the hash of the map it was generated from, or None if the file is
+             not a mesh file.
+    """
+    
+    with compressedfile.open_read(filename) as f:
+        data = f.read(Mesh.FILE_HEADER.size)
+    
+    if len(data) < Mesh.FILE_HEADER.size:
+        return None
+    
+    file_id, file_version, data_hash = Mesh.FILE_HEADER.unpack(data)
+    if file_id != Mesh.FILE_ID:
+        return None
+    
+    return file_version, data_hash
\ No newline at end of file
@@ -0,0 +1,277 @@
+from doom import wad
+from doom.map.data import MapData
+from nav.compactgrid import CompactGrid
+from nav.config import Config
+from nav.grid import Grid
+from nav.mappedmesh import MappedMesh
+from nav.mesh import Mesh, read_mesh_header
+from navbench import options
+from navgen.main import get_side_filename
+from os import path
+from util import compressedfile
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+
+APP_NAME = 'navbench'
+APP_VERSION = '0.9 beta'
+
+
+def time_best(func, repeat):
+    """
+    Returns the fastest time in seconds of repeated calls to func, and the result of the last call.
+    """
+    
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - start
+        
+        if best is None or elapsed < best:
+            best = elapsed
+    
+    return best, result
+
+
+def get_decoded_fields(map_data):
+    """
+    Returns the decoded fields of the vertices, linedefs, segments and nodes of a map, with object references replaced
+    by indices.
+    """
+    
+    vertex_indices = {}
+    for index, vertex in enumerate(map_data.vertices):
+        vertex_indices[vertex] = index
+    linedef_indices = {}
+    for index, linedef in enumerate(map_data.linedefs):
+        linedef_indices[linedef] = index
+    
+    vertices = [(vertex.x, vertex.y) for vertex in map_data.vertices]
+    linedefs = [(vertex_indices[linedef.vertex1], vertex_indices[linedef.vertex2], linedef.flags, linedef.action,
+                 linedef.tag, tuple(linedef.args), linedef.sidedef_front, linedef.sidedef_back)
+                for linedef in map_data.linedefs]
+    segments = [(vertex_indices[segment.vertex_start], vertex_indices[segment.vertex_end],
+                 linedef_indices[segment.linedef], segment.angle, segment.direction, segment.offset)
+                for segment in map_data.segments]
+    nodes = [(node.x, node.y, node.delta_x, node.delta_y, node.bb_right.left, node.bb_right.top, node.bb_right.right,
+              node.bb_right.bottom, node.bb_left.left, node.bb_left.top, node.bb_left.right, node.bb_left.bottom,
+              tuple(node.children)) for node in map_data.nodes]
+    
+    return vertices, linedefs, segments, nodes
+
+
+def benchmark_load(wad_file, maplist, settings):
+    """
+    Compares loading maps with per-record and bulk lump decoding.
+    """
+    
+    print '{:<8} {:>8} {:>10} {:>10} {:>8}'.format('Map', 'Segments', 'Records', 'Bulk', 'Speedup')
+    
+    total_records = 0.0
+    total_bulk = 0.0
+    for map_lump in maplist:
+        time_records, map_records = time_best(lambda: MapData(wad_file, map_lump, bulk=False), settings.repeat)
+        time_bulk, map_bulk = time_best(lambda: MapData(wad_file, map_lump, bulk=True), settings.repeat)
+        
+        # Both decoding methods must produce the same map.
+        if get_decoded_fields(map_records) != get_decoded_fields(map_bulk):
+            print 'Map {} decoded differently!'.format(map_lump)
+        
+        total_records += time_records
+        total_bulk += time_bulk
+        
+        print '{:<8} {:>8} {:>9.1f}ms {:>9.1f}ms {:>7.2f}x'.format(map_lump, len(map_bulk.segments), time_records * 1000,
+                                                                  time_bulk * 1000, time_records / time_bulk)
+    
+    print '{:<8} {:>8} {:>9.1f}ms {:>9.1f}ms {:>7.2f}x'.format('Total', '', total_records * 1000, total_bulk * 1000,
+                                                              total_records / total_bulk)
+
+
+def benchmark_bsp(wad_file, maplist, settings):
+    """
+    Times point_in_subsector lookups of random points inside each map's bounds.
+    """
+    
+    print '{:<8} {:>6} {:>10} {:>10} {:>14}'.format('Map', 'Nodes', 'Points', 'Time', 'Points/second')
+    
+    for map_lump in maplist:
+        map_data = MapData(wad_file, map_lump)
+        columns = map_data.columns
+        
+        # Use the same random points for every run.
+        random.seed(1751987)
+        x1 = int(columns.vertex_x.min())
+        x2 = int(columns.vertex_x.max())
+        y1 = int(columns.vertex_y.min())
+        y2 = int(columns.vertex_y.max())
+        xs = [random.randint(x1, x2) for _ in xrange(settings.points)]
+        ys = [random.randint(y1, y2) for _ in xrange(settings.points)]
+        
+        def run():
+            point_in_subsector = map_data.point_in_subsector
+            for index in xrange(settings.points):
+                point_in_subsector(xs[index], ys[index])
+        
+        elapsed, _ = time_best(run, settings.repeat)
+        print '{:<8} {:>6} {:>10} {:>9.2f}s {:>14.0f}'.format(map_lump, len(map_data.nodes), settings.points, elapsed,
+                                                               settings.points / elapsed)
+
+
+def benchmark_mesh(wad_file, maplist, settings):
+    """
+    Compares reading the mesh files generated for each map into objects, and memory mapping them.
+    """
+    
+    print '{:<8} {:>8} {:>10} {:>10} {:>10}'.format('Map', 'Areas', 'Objects', 'Mapped', 'Adjacency')
+    
+    for map_lump in maplist:
+        mesh_file = get_side_filename(settings.wad, map_lump, 'dpm')
+        if not path.exists(mesh_file):
+            print '{:<8} no mesh file'.format(map_lump)
+            continue
+        
+        # Only current mesh files can be mapped.
+        header = read_mesh_header(mesh_file)
+        if header is None or header[0] != Mesh.FILE_VERSION:
+            print '{:<8} unsupported mesh file'.format(map_lump)
+            continue
+        
+        map_data = MapData(wad_file, map_lump)
+        time_objects, _ = time_best(lambda: Mesh().read(mesh_file, map_data), settings.repeat)
+        
+        # Close every mapping inside the timed run, so that no open mappings are left behind between runs.
+        def run_mapped():
+            mapped_mesh = MappedMesh()
+            mapped_mesh.read(mesh_file)
+            mapped_mesh.close()
+        time_mapped, _ = time_best(run_mapped, settings.repeat)
+        
+        mapped_mesh = MappedMesh()
+        mapped_mesh.read(mesh_file)
+        time_adjacency, _ = time_best(mapped_mesh.build_adjacency, settings.repeat)
+        
+        print '{:<8} {:>8} {:>9.2f}ms {:>9.2f}ms {:>9.2f}ms'.format(map_lump, mapped_mesh.get_area_count(),
+                                                                    time_objects * 1000, time_mapped * 1000,
+                                                                    time_adjacency * 1000)
+        mapped_mesh.close()
+
+
+def benchmark_grid(wad_file, maplist, settings):
+    """
+    Times generating the navigation grid of each map, and checks the memory taken up by its elements against
+    CompactGrid.ELEMENT_SIZE_TARGET.
+    """
+    
+    print '{:<8} {:>8} {:>10} {:>10} {:>8}'.format('Map', 'Elements', 'Time', 'Bytes', 'Target')
+    
+    over_target = 0
+    for map_lump in maplist:
+        map_data = MapData(wad_file, map_lump)
+        config_data = Config('doompath.json', 'zdoom' if map_data.is_hexen else 'doom')
+        
+        # Keep the progress output of grid generation out of the results.
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            map_data.setup(config_data)
+            nav_grid = Grid()
+            elapsed, _ = time_best(lambda: nav_grid.create(config_data, map_data, 1), 1)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        
+        element_size = nav_grid.elements.get_element_size()
+        if element_size > CompactGrid.ELEMENT_SIZE_TARGET:
+            over_target += 1
+            status = 'over'
+        else:
+            status = 'ok'
+        
+        print '{:<8} {:>8} {:>9.2f}s {:>10.1f} {:>8}'.format(map_lump, len(nav_grid.elements), elapsed, element_size,
+                                                               status)
+    
+    print 'Target is {} bytes per element, {} maps over target.'.format(CompactGrid.ELEMENT_SIZE_TARGET, over_target)
+
+
+def benchmark_compression(wad_file, maplist, settings):
+    """
+    Compares the size, write and load time of grid and mesh files for each compression codec and level.
+    """
+    
+    codecs = [(None, 0), ('zlib', 1), ('zlib', 6), ('zlib', 9)]
+    if compressedfile.is_codec_available('lzma'):
+        codecs.extend([('lzma', 0), ('lzma', 6), ('lzma', 9)])
+    else:
+        print 'The lzma module is not available, only testing zlib.'
+    
+    handle, temp_file = tempfile.mkstemp()
+    os.close(handle)
+    
+    for map_lump in maplist:
+        grid_file = get_side_filename(settings.wad, map_lump, 'dpg')
+        mesh_file = get_side_filename(settings.wad, map_lump, 'dpm')
+        if not path.exists(grid_file) or not path.exists(mesh_file):
+            print '{:<8} no grid or mesh file'.format(map_lump)
+            continue
+        
+        map_data = MapData(wad_file, map_lump)
+        compact_grid = CompactGrid()
+        mesh = Mesh()
+        if compact_grid.read(grid_file, map_data) == False or mesh.read(mesh_file, map_data) == False:
+            continue
+        
+        print ''
+        print '[{}] {} elements, {} areas'.format(map_lump, len(compact_grid), len(mesh.areas))
+        print '{:<6} {:>6} {:>5} {:>10} {:>7} {:>10} {:>10}'.format('Type', 'Codec', 'Level', 'Bytes', 'Ratio',
+                                                                     'Write', 'Load')
+        
+        for kind, save, load in (
+            ('grid', compact_grid.write, lambda: CompactGrid().read(temp_file, map_data)),
+            ('mesh', mesh.write, lambda: Mesh().read(temp_file, map_data))
+        ):
+            base_size = None
+            for codec, level in codecs:
+                time_write, _ = time_best(lambda: save(temp_file, codec, level), settings.repeat)
+                size = path.getsize(temp_file)
+                time_load, _ = time_best(load, settings.repeat)
+                if base_size is None:
+                    base_size = size
+                
+                print '{:<6} {:>6} {:>5} {:>10} {:>6.1f}% {:>8.1f}ms {:>8.1f}ms'.format(
+                    kind, codec or 'none', level, size, size * 100.0 / base_size, time_write * 1000, time_load * 1000)
+    
+    os.remove(temp_file)
+
+
+if __name__ == '__main__':
+    print '{} version {}'.format(APP_NAME, APP_VERSION)
+    
+    parser = options.get_parser()
+    settings = parser.parse_args()
+    
+    print 'Loading {}...'.format(settings.wad)
+    wad_file = wad.WADReader(settings.wad, mapped=True)
+    
+    if settings.map is None:
+        maplist = wad_file.get_map_list()
+    else:
+        maplist = [settings.map]
+    
+    print ''
+    if settings.benchmark == 'load':
+        benchmark_load(wad_file, maplist, settings)
+    elif settings.benchmark == 'bsp':
+        benchmark_bsp(wad_file, maplist, settings)
+    elif settings.benchmark == 'mesh':
+        benchmark_mesh(wad_file, maplist, settings)
+    elif settings.benchmark == 'grid':
+        benchmark_grid(wad_file, maplist, settings)
+    elif settings.benchmark == 'compression':
+        benchmark_compression(wad_file, maplist, settings)
+    
+    wad_file.close()
+    sys.exit(0)
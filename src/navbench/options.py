@@ -0,0 +1,54 @@
+import argparse
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='navbench',
+        description='Benchmark parts of the map loading and navigation mesh generation process.'
+    )
+
+    parser.add_argument(
+        '--wad',
+        help='The WAD file containing the maps to benchmark with.',
+        action='store',
+        type=str,
+        required=True
+    )
+
+    parser.add_argument(
+        '--map',
+        help='The name of the map lump to benchmark with. If not specified, all maps in the WAD will be used.',
+        action='store',
+        type=str,
+        required=False
+    )
+
+    parser.add_argument(
+        '--benchmark',
+        help='The benchmark to run.',
+        action='store',
+        choices=['load', 'bsp', 'mesh', 'grid', 'compression'],
+        default='load',
+        type=str,
+        required=False
+    )
+
+    parser.add_argument(
+        '--points',
+        help='The number of random points to look up in the bsp benchmark.',
+        action='store',
+        type=int,
+        default=1000000,
+        required=False
+    )
+
+    parser.add_argument(
+        '--repeat',
+        help='The number of times to repeat each timed run. The fastest run is reported.',
+        action='store',
+        type=int,
+        default=5,
+        required=False
+    )
+
+    return parser
@@ -6,6 +6,7 @@ from navedit import pathfind
 from util.vector import Vector2, Vector3
 import cProfile
 import camera
+import numpy
 import pygame
 import random
 import render
@@ -99,16 +100,23 @@ class Loop(object):
 
     def benchmark_pathfinder(self):
         random.seed(1751987)
+        count = 5000
+
+        # Generate start and end points, and look up their floor z all at once.
+        xs = numpy.empty(count * 2, dtype=numpy.int64)
+        ys = numpy.empty(count * 2, dtype=numpy.int64)
+        for index in range(count * 2):
+            xs[index] = random.randint(self.map_data.min.x, self.map_data.max.x)
+            ys[index] = random.randint(self.map_data.min.y, self.map_data.max.y)
+        zs = self.map_data.get_floor_z_batch(xs, ys).tolist()
+        xs = xs.tolist()
+        ys = ys.tolist()
+
         start = Vector3()
         end = Vector3()
-        for _ in range(5000):
-            start.x = random.randint(self.map_data.min.x, self.map_data.max.x)
-            start.y = random.randint(self.map_data.min.y, self.map_data.max.y)
-            start.z = self.map_data.get_floor_z(start.x, start.y)
-
-            end.x = random.randint(self.map_data.min.x, self.map_data.max.x)
-            end.y = random.randint(self.map_data.min.y, self.map_data.max.y)
-            end.z = self.map_data.get_floor_z(end.x, end.y)
+        for index in range(0, count * 2, 2):
+            start.set(xs[index], ys[index], zs[index])
+            end.set(xs[index + 1], ys[index + 1], zs[index + 1])
 
             path = self.pathfinder.find(start, end)
             if path is not None and self.pathfinder.nodes_visited > 0:
@@ -284,22 +284,25 @@ def render_grid_init(nav_grid):
 def render_grid(nav_grid, surface, camera, mouse_pos):
     COLOR_ELEMENT_HIGHLIGHT = pygame.Color(0, 255, 255, 255)
     
-    mouse_pos = nav_grid.map_to_element(mouse_pos)
+    grid_elements = nav_grid.elements
+    mouse_x, mouse_y = nav_grid.map_to_element(mouse_pos)
     rect = pygame.Rect((0, 0), (nav_grid.element_size * camera.zoom, nav_grid.element_size * camera.zoom))
     z_mod = 255.0 / nav_grid.map_data.size.z
     
     elements = []
-    for element in nav_grid.elements:
-        if element.pos.x == mouse_pos.x and element.pos.y == mouse_pos.y:
+    for element in xrange(len(grid_elements)):
+        element_x = grid_elements.x[element]
+        element_y = grid_elements.y[element]
+        if element_x == mouse_x and element_y == mouse_y:
             elements.append(element)
         
-        pos = nav_grid.element_to_map(element.pos)
-        x, y = camera.map_to_screen(pos.x, pos.y)
+        x, y = nav_grid.element_to_map(Vector2(element_x, element_y))
+        x, y = camera.map_to_screen(x, y)
         rect.top = y - (nav_grid.element_size / 2) * camera.zoom
         rect.left = x - (nav_grid.element_size / 2) * camera.zoom
         
-        v = int((element.pos.z - nav_grid.map_data.min_z) * z_mod)
-        if element.special_sector is not None:
+        v = int((grid_elements.z[element] - nav_grid.map_data.min_z) * z_mod)
+        if grid_elements.special_sector[element] != -1:
             color = nav_grid.grid_colors_special[v]
         else:
             color = nav_grid.grid_colors[v]
@@ -307,13 +310,12 @@ def render_grid(nav_grid, surface, camera, mouse_pos):
         pygame.draw.rect(surface, color, rect, 1)
     
     rect = pygame.Rect((0, 0), (nav_grid.element_size * camera.zoom, nav_grid.element_size * camera.zoom))
-    element_hash = mouse_pos.x + (mouse_pos.y * (nav_grid.map_data.size.x / nav_grid.element_size))
-    element = nav_grid.element_hash.get(element_hash)
+    element = grid_elements.get_element_list(Vector2(mouse_x, mouse_y))
     if element is not None:
-        element = element[element.keys()[0]]
+        element = element[0]
 
         color = COLOR_ELEMENT_HIGHLIGHT
-        x, y = nav_grid.element_to_map(element.x, element.y)
+        x, y = nav_grid.element_to_map(Vector2(mouse_x, mouse_y))
         x, y = camera.map_to_screen(x, y)
         rect.top = y - (nav_grid.element_size / 2) * camera.zoom
         rect.left = x - (nav_grid.element_size / 2) * camera.zoom
@@ -321,7 +323,7 @@ def render_grid(nav_grid, surface, camera, mouse_pos):
         pygame.draw.rect(surface, color, rect, 1)
         
         for direction in Element.DIR_RANGE:
-            if element.elements[direction] is not None:
+            if grid_elements.links[element * 4 + direction] != -1:
                 start = (rect.left + (nav_grid.element_size * camera.zoom) / 2, rect.top + (nav_grid.element_size * camera.zoom) / 2)
                 
                 if direction == Element.DIR_UP:
@@ -1,18 +1,22 @@
 from doom import wad
-from doom.map.data import MapData
+from doom.map.data import MapData, compute_map_hash
+from doom.map.snapshot import MapSnapshot
 from nav.config import Config
 from nav.grid import Grid
-from nav.mesh import Mesh
+from nav.mesh import Mesh, read_mesh_header
 from navgen import options
 from os import path
+import multiprocessing
+import StringIO
 import sys
+import traceback
 
 
 APP_NAME = 'navgen'
 APP_VERSION = '0.9 beta'
 
        
-def generate_map(wad_file, map_lump, settings):
+def generate_map(wad_file, map_lump, settings, grid_jobs=1):
 
     print ''
     print '[{}]'.format(map_lump)
@@ -31,23 +35,145 @@ def generate_map(wad_file, map_lump, settings):
     
     print 'Map setup...'
     map_data.setup(config_data)
+    
+    # Updating regions needs the grid and snapshot of the previous run.
+    grid_file = get_side_filename(settings.wad, map_lump, 'dpg')
+    mesh_file = get_side_filename(settings.wad, map_lump, 'dpm')
+    snapshot_file = get_side_filename(settings.wad, map_lump, 'dps')
+    
+    snapshot = MapSnapshot()
+    snapshot.build(map_data)
+    
+    nav_grid = None
+    nav_mesh = None
+    if settings.update_regions == True:
+        nav_grid, nav_mesh = update_map(map_data, config_data, settings, snapshot, grid_file, mesh_file, snapshot_file)
+    
+    if nav_mesh is None:
+        print 'Detecting walkable space...'
+        nav_grid = Grid()
+        nav_grid.create(config_data, map_data, settings.resolution, grid_jobs)
+        if settings.write_grid == True or settings.update_regions == True:
+            nav_grid.write(grid_file, settings.compression, settings.compression_level)
+            
+        print 'Generating navigation mesh...'
+        nav_mesh = Mesh()
+        nav_mesh.create(nav_grid, map_data, config_data, settings.max_area_size, settings.max_area_size_merged)
+    
+    print 'Writing navigation mesh...'
+    nav_mesh.write(mesh_file, settings.compression, settings.compression_level)
+    if settings.update_regions == True:
+        snapshot.write(snapshot_file)
+    
+    return True
 
-    print 'Detecting walkable space...'
+
+def update_map(map_data, config_data, settings, snapshot, grid_file, mesh_file, snapshot_file):
+    """
+    Updates the navigation grid and mesh of a previous run, for the parts of a map that changed since then.
+    
+    The updated mesh can have a different area layout than a full run on the same map would create, see Grid.update
+    and Mesh.update.
+    
+    @return: the updated Grid and Mesh objects, or None, None if the map needs to be generated completely.
+    """
+    
+    if not path.exists(grid_file) or not path.exists(mesh_file) or not path.exists(snapshot_file):
+        return None, None
+    
+    old_snapshot = MapSnapshot()
+    if old_snapshot.read(snapshot_file) == False:
+        return None, None
+    bounds = snapshot.get_changed_bounds(old_snapshot)
+    
+    print 'Updating walkable space...'
     nav_grid = Grid()
-    nav_grid.create(config_data, map_data, settings.resolution)
-    if settings.write_grid == True:
-        dest_file = get_side_filename(settings.wad, map_lump, 'dpg')
-        nav_grid.write(dest_file)
-        
-    print 'Generating navigation mesh...'
+    nav_grid.setup(config_data, map_data, settings.resolution)
+    if nav_grid.read(grid_file, map_data) == False:
+        return None, None
+    
+    if bounds is None:
+        print 'No map changes found.'
+        rect = None
+    else:
+        print 'Map changed between ({}, {}) and ({}, {}).'.format(bounds.left, bounds.top, bounds.right, bounds.bottom)
+        rect = nav_grid.update(bounds)
+    nav_grid.write(grid_file, settings.compression, settings.compression_level)
+    
+    print 'Updating navigation mesh...'
     nav_mesh = Mesh()
-    nav_mesh.create(nav_grid, map_data, config_data, settings.max_area_size, settings.max_area_size_merged)
+    if nav_mesh.read(mesh_file, map_data) == False:
+        return None, None
+    nav_mesh.update(nav_grid, map_data, config_data, settings.max_area_size, settings.max_area_size_merged, rect)
     
-    print 'Writing navigation mesh...'
-    dest_file = get_side_filename(settings.wad, map_lump, 'dpm')
-    nav_mesh.write(dest_file)
+    return nav_grid, nav_mesh
+
+
+def generate_map_job(map_lump, settings, grid_jobs=1, wad_file=None):
+    """
+    Generates a navigation mesh for a single map, reporting any errors instead of raising them.
     
-    return True
+    Both the worker processes and a single process generate maps through this, so that failing maps are reported in
+    the same way.
+    
+    @param grid_jobs: the number of processes to detect walkable space with.
+    @param wad_file: the WADReader to read the map from, or None to open the WAD file for only this map.
+    
+    @return: True if the map was generated successfully.
+    """
+    
+    try:
+        if wad_file is not None:
+            return generate_map(wad_file, map_lump, settings, grid_jobs)
+        
+        wad_file = wad.WADReader(settings.wad, mapped=True)
+        try:
+            return generate_map(wad_file, map_lump, settings, grid_jobs)
+        finally:
+            wad_file.close()
+    
+    # Report any errors instead of aborting the remaining maps.
+    except Exception:
+        print 'Error generating navigation mesh for {}.'.format(map_lump)
+        traceback.print_exc(file=sys.stdout)
+        return False
+
+
+def generate_map_job_output(args):
+    """
+    Runs generate_map_job in a worker process, and collects its output so that it can be printed by the main process
+    in map order.
+    
+    @return: a tuple of the result of generate_map_job and the output text.
+    """
+    
+    output = StringIO.StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        success = generate_map_job(*args)
+    finally:
+        sys.stdout = stdout
+    
+    return success, output.getvalue()
+
+
+def is_up_to_date(wad_file, map_lump, settings):
+    """
+    Returns True if a map's navigation mesh file exists and was generated from the map's current data.
+    
+    Only the map data hash in the mesh file header is compared, the mesh itself is not read.
+    """
+    
+    mesh_file = get_side_filename(settings.wad, map_lump, 'dpm')
+    if not path.exists(mesh_file):
+        return False
+    
+    header = read_mesh_header(mesh_file)
+    if header is None:
+        return False
+    
+    return header[1] == compute_map_hash(wad_file, map_lump)
 
 
 def get_side_filename(wad, map_name, extension):
@@ -56,7 +182,7 @@ def get_side_filename(wad, map_name, extension):
     
     base_path = path.split(wad)[0]
     
-    return '{}/{}_{}.{}'.format(base_path, base_name, map_name.lower(), extension)
+    return path.join(base_path, '{}_{}.{}'.format(base_name, map_name.lower(), extension))
         
         
 if __name__ == '__main__':
@@ -73,15 +199,65 @@ if __name__ == '__main__':
         print ''
         
     print 'Loading {}...'.format(settings.wad)
-    wad_file = wad.WADReader(settings.wad)
+    wad_file = wad.WADReader(settings.wad, mapped=True)
     
     if settings.map is None:
         maplist = wad_file.get_map_list() 
     else:
         maplist = [settings.map] 
         
-    for map_lump in maplist:
-        generate_map(wad_file, map_lump, settings)
+    rebuilt = 0
+    skipped = 0
+    failed = 0
+    
+    if settings.incremental == True:
+        outdated = []
+        for map_lump in maplist:
+            try:
+                up_to_date = is_up_to_date(wad_file, map_lump, settings)
+            
+            # Generate maps whose previous files cannot be checked again.
+            except Exception:
+                print 'Error checking navigation mesh for {}.'.format(map_lump)
+                traceback.print_exc(file=sys.stdout)
+                up_to_date = False
+            
+            if up_to_date:
+                print ''
+                print '[{}]'.format(map_lump)
+                print 'Navigation mesh is up to date, skipping.'
+                skipped += 1
+            else:
+                outdated.append(map_lump)
+        maplist = outdated
+    
+    if settings.jobs > 1 and len(maplist) > 1:
+        wad_file.close()
+        
+        # Each worker process reads the map data itself, only the results and output are sent back. imap returns
+        # results in map order, so the output of each map can be printed as soon as all maps before it are done.
+        pool = multiprocessing.Pool(min(settings.jobs, len(maplist)))
+        jobs = [(map_lump, settings) for map_lump in maplist]
+        for success, output in pool.imap(generate_map_job_output, jobs):
+            sys.stdout.write(output)
+            if success == True:
+                rebuilt += 1
+            else:
+                failed += 1
+        pool.close()
+        pool.join()
+    
+    else:
+        # With only a single map to generate, use the jobs to detect walkable space in parallel instead.
+        for map_lump in maplist:
+            if generate_map_job(map_lump, settings, settings.jobs, wad_file) == True:
+                rebuilt += 1
+            else:
+                failed += 1
+        wad_file.close()
     
     print ''
+    print 'Rebuilt {} maps, skipped {} up to date maps.'.format(rebuilt, skipped)
+    if failed > 0:
+        print 'Failed to generate {} maps.'.format(failed)
     print 'Finished.'
\ No newline at end of file
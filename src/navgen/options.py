@@ -1,4 +1,5 @@
 from argparse import ArgumentTypeError
+from util import compressedfile
 import argparse
 
 
@@ -13,18 +14,15 @@ def get_parser():
         help='The WAD file containing the maps to be processed.',
         action='store',
         type=str,
-        nargs=1,
         required=True
     )
 
     parser.add_argument(
         '--map',
         help='The name of the map lump to generate a navigation mesh for. If not specified, all maps in the WAD will \
-              have a navigation mesh generated.',
+              have a navigation mesh generated. Earlier versions generated only MAP01 if this was not specified.',
         action='store',
-        default='MAP01',
         type=str,
-        nargs=1,
         required=False
     )
 
@@ -34,9 +32,7 @@ def get_parser():
               normal Doom\Boom compatible maps, and "zdoom" will be used for Hexen format maps.',
         action='store',
         choices=['doom', 'zdoom'],
-        default='doom',
         type=str,
-        nargs=1,
         required=False
     )
 
@@ -50,7 +46,6 @@ def get_parser():
         choices=[1, 2, 4],
         default=1,
         type=int,
-        nargs=1,
         required=False
     )
 
@@ -63,7 +58,6 @@ def get_parser():
         action='store',
         type=area_size,
         default=256,
-        nargs=1,
         required=False
     )
 
@@ -75,7 +69,6 @@ def get_parser():
         action='store',
         type=area_size,
         default=512,
-        nargs=1,
         required=False
     )
 
@@ -87,6 +80,57 @@ def get_parser():
         required=False
     )
 
+    parser.add_argument(
+        '--incremental',
+        help='Skips maps that already have a navigation mesh file that was generated from the current map data. \
+              Only the map data hash in the header of the navigation mesh file is checked, so changed generation \
+              options require a run without this option.',
+        action='store_true',
+        required=False
+    )
+
+    parser.add_argument(
+        '--update-regions',
+        help='For maps that changed since the previous run with this option, only generates the navigation grid and \
+              areas around the changed linedefs, sectors and things again. This also writes the navigation grid and a \
+              snapshot of the map data that the next run compares against. The areas can be laid out differently than \
+              those of a full run, because areas outside the changed region are kept as they are. Only changes to the \
+              map data are detected, so changed generation options require a full run.',
+        action='store_true',
+        required=False
+    )
+
+    parser.add_argument(
+        '--compression',
+        help='Compresses the navigation mesh and grid files that are written with "zlib" or "lzma". LZMA compresses \
+              better but is slower, and needs the lzma module. Compressed files are decompressed automatically when \
+              they are read, but cannot be memory mapped.',
+        action='store',
+        type=compression_codec,
+        default=None,
+        required=False
+    )
+
+    parser.add_argument(
+        '--compression-level',
+        help='The compression level to use, from 0 to 9. Higher levels create smaller files but take longer to write.',
+        action='store',
+        type=compression_level,
+        default=6,
+        required=False
+    )
+
+    parser.add_argument(
+        '--jobs',
+        help='The number of maps to generate navigation meshes for at the same time, each in a separate process. The \
+              output of each map is displayed once it has been completed. If only a single map is generated, its \
+              walkable space is detected in this number of processes instead.',
+        action='store',
+        type=job_count,
+        default=1,
+        required=False
+    )
+
     parser.add_argument(
         '--license',
         help='Displays the license of this program, without doing anything else.',
@@ -105,6 +149,31 @@ def area_size(string):
     return value
 
 
+def job_count(string):
+    value = int(string)
+    if value < 1:
+        raise ArgumentTypeError('At least 1 job is needed.')
+
+    return value
+
+
+def compression_codec(string):
+    if string not in compressedfile.CODECS:
+        raise ArgumentTypeError('{} is not a supported compression codec.'.format(string))
+    if not compressedfile.is_codec_available(string):
+        raise ArgumentTypeError('{} compression is not available on this system.'.format(string))
+
+    return string
+
+
+def compression_level(string):
+    value = int(string)
+    if value < 0 or value > 9:
+        raise ArgumentTypeError('The compression level must be between 0 and 9.')
+
+    return value
+
+
 def print_license():
     print """
     Copyright (c) 2013, Dennis Meuwissen
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#coding=utf8
+
+"""
+A compressed container for grid and mesh files.
+
+A compressed file starts with its own header, followed by the original file contents as a single zlib or LZMA
+stream. Files are compressed and decompressed in chunks, so the uncompressed contents never need to be in memory at
+once. Files without the container header are read as they are.
+"""
+
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Container file structures.
+FILE_ID = 'DPPACK'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<6sHBB')
+
+# Codec names and the ids they are stored as.
+CODECS = {
+    'zlib': 1,
+    'lzma': 2
+}
+
+# The number of compressed bytes to read at a time.
+CHUNK_SIZE = 65536
+
+
+class CompressedWriter(object):
+    """
+    A write-only file object that compresses everything written to it.
+    """
+    
+    def __init__(self, filename, codec, level):
+        self.file = open(filename, 'wb')
+        self.file.write(FILE_HEADER.pack(FILE_ID, FILE_VERSION, CODECS[codec], level))
+        
+        if codec == 'zlib':
+            self.compressor = zlib.compressobj(level)
+        else:
+            self.compressor = lzma.LZMACompressor(preset=level)
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    
+    def write(self, data):
+        """
+        Compresses data and writes the compressed output that is ready so far.
+        """
+        
+        self.file.write(self.compressor.compress(data))
+    
+    
+    def close(self):
+        """
+        Writes the remaining compressed output, and closes the file.
+        """
+        
+        if self.file is None:
+            return
+        
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        self.file = None
+
+
+class CompressedReader(object):
+    """
+    A read-only file object that decompresses a compressed file in chunks as it is read.
+    """
+    
+    def __init__(self, f, codec_id):
+        self.file = f
+        
+        if codec_id == CODECS['zlib']:
+            self.decompressor = zlib.decompressobj()
+        else:
+            self.decompressor = lzma.LZMADecompressor()
+        
+        # Decompressed data, and the offset in it up to which it has been read.
+        self.buffer = ''
+        self.offset = 0
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    
+    def read(self, size=-1):
+        """
+        Reads up to size decompressed bytes, or everything that remains if size is negative.
+        """
+        
+        # Serve reads from the decompressed data that is left where possible, without copying the rest of it.
+        length = len(self.buffer) - self.offset
+        if size >= 0 and length >= size:
+            data = self.buffer[self.offset:self.offset + size]
+            self.offset += size
+            return data
+        
+        pieces = [self.buffer[self.offset:]]
+        while (size < 0 or length < size) and self.decompressor is not None:
+            data = self.file.read(CHUNK_SIZE)
+            if len(data) > 0:
+                data = self.decompressor.decompress(data)
+            else:
+                # Only zlib holds back output until it is flushed.
+                if hasattr(self.decompressor, 'flush'):
+                    data = self.decompressor.flush()
+                self.decompressor = None
+            
+            pieces.append(data)
+            length += len(data)
+        
+        data = ''.join(pieces)
+        if size < 0 or size >= len(data):
+            self.buffer = ''
+            self.offset = 0
+            return data
+        
+        self.buffer = data
+        self.offset = size
+        return data[:size]
+    
+    
+    def close(self):
+        """
+        Closes the file.
+        """
+        
+        self.decompressor = None
+        self.buffer = ''
+        self.offset = 0
+        self.file.close()
+
+
+def is_codec_available(codec):
+    """
+    Returns True if a codec name can be used for compression on this system.
+    """
+    
+    if codec == 'lzma':
+        return lzma is not None
+    
+    return codec in CODECS
+
+
+def open_write(filename, codec=None, level=6):
+    """
+    Opens a file for writing, compressed with a codec if one is given.
+    
+    @param codec: the name of the codec to compress with, or None to write an uncompressed file.
+    @param level: the compression level or preset, from 0 to 9.
+    """
+    
+    if codec is None:
+        return open(filename, 'wb')
+    
+    return CompressedWriter(filename, codec, level)
+
+
+def open_read(filename):
+    """
+    Opens a file for reading, decompressing it if it is compressed.
+    
+    @raise IOError: if the file is compressed with a codec that is not available.
+    """
+    
+    f = open(filename, 'rb')
+    data = f.read(FILE_HEADER.size)
+    if len(data) < FILE_HEADER.size or not data.startswith(FILE_ID):
+        f.seek(0)
+        return f
+    
+    _, _, codec_id, _ = FILE_HEADER.unpack(data)
+    if codec_id == CODECS['lzma'] and lzma is None:
+        f.close()
+        raise IOError('{} is LZMA compressed, which needs the lzma module.'.format(filename))
+    elif codec_id not in CODECS.values():
+        f.close()
+        raise IOError('{} is compressed with an unknown codec.'.format(filename))
+    
+    return CompressedReader(f, codec_id)
@@ -2,6 +2,7 @@
 #coding=utf8
 
 from util.vector import Vector2
+import numpy
 
 
 class Rectangle(object):   
@@ -149,4 +150,59 @@ class Rectangle(object):
     
     
     def __repr__(self):
-        return '{}, {}'.format(self.p1, self.p2)
\ No newline at end of file
+        return '{}, {}'.format(self.p1, self.p2)
+
+
+def intersects_with_lines(left, top, right, bottom, x1, y1, x2, y2):
+    """
+    Tests boxes against lines for intersection, with the same results as Rectangle.intersects_with_line.
+    
+    All parameters are NumPy arrays or scalars, and are broadcast against each other. Integer coordinates use floor
+    division to find intercepts, like Python 2 does for integers.
+    
+    @return: a boolean NumPy array that is True where a box and line intersect.
+    """
+    
+    # Cohen-Sutherland outcodes, as separate boolean arrays for each side.
+    right1 = x1 > right
+    left1 = (x1 < left) & ~right1
+    top1 = y1 > bottom
+    bottom1 = (y1 < top) & ~top1
+    right2 = x2 > right
+    left2 = (x2 < left) & ~right2
+    top2 = y2 > bottom
+    bottom2 = (y2 < top) & ~top2
+    
+    outside_x1 = right1 | left1
+    outside_y1 = top1 | bottom1
+    result = ~(outside_x1 | outside_y1) | ~(right2 | left2 | top2 | bottom2)
+    clip = ~(result | (right1 & right2) | (left1 & left2) | (top1 & top2) | (bottom1 & bottom2))
+    
+    # Intercept the vertical box side that the first point lies beyond. The line cannot be vertical here, because
+    # both points would then lie beyond the same side.
+    clip_x = clip & outside_x1
+    if clip_x.any():
+        interceptx = numpy.where(right1, right, left)
+        ax1 = numpy.where(clip_x, x2 - x1, 1)
+        intercepty = y1 + divide((interceptx - x1) * (y2 - y1), ax1)
+        result |= clip_x & (intercepty <= bottom) & (intercepty >= top)
+    
+    # Intercept the horizontal box side.
+    clip_y = clip & outside_y1 & ~result
+    if clip_y.any():
+        intercepty = numpy.where(top1, bottom, top)
+        ay1 = numpy.where(clip_y, y2 - y1, 1)
+        interceptx = x1 + divide((intercepty - y1) * (x2 - x1), ay1)
+        result |= clip_y & (interceptx <= right) & (interceptx >= left)
+    
+    return result
+
+
+def divide(a, b):
+    """
+    Divides NumPy arrays like Python 2 divides numbers, using floor division if both are integers.
+    """
+    
+    if numpy.asarray(a).dtype.kind in 'iu' and numpy.asarray(b).dtype.kind in 'iu':
+        return a // b
+    return a / b
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#coding=utf8
+
+import timeit
+
+
+class StageTimer(object):
+    """
+    Measures how long each consecutive stage of a process takes.
+    """
+    
+    def __init__(self):
+        # A list of (stage name, elapsed seconds) tuples for every finished stage.
+        self.stages = []
+        
+        # The stage that is currently being timed.
+        self.name = None
+        self.start_time = None
+    
+    
+    def start(self, name):
+        """
+        Ends the current stage, and starts timing a new one.
+        """
+        
+        self.stop()
+        
+        self.name = name
+        self.start_time = timeit.default_timer()
+    
+    
+    def stop(self):
+        """
+        Ends the current stage, if any.
+        """
+        
+        if self.name is None:
+            return
+        
+        self.stages.append((self.name, timeit.default_timer() - self.start_time))
+        self.name = None
+        self.start_time = None
+    
+    
+    def get_total(self):
+        """
+        Returns the total number of seconds taken by all finished stages.
+        """
+        
+        return sum([elapsed for _, elapsed in self.stages])
+    
+    
+    def print_stages(self):
+        """
+        Prints the time taken by every finished stage.
+        """
+        
+        for name, elapsed in self.stages:
+            print '{:<24} {:>8.3f}s'.format(name, elapsed)
+        print '{:<24} {:>8.3f}s'.format('Total', self.get_total())